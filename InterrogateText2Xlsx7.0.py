@@ -544,6 +544,89 @@ def setup_excel_sheets(wb: Workbook) -> Tuple[Worksheet, Worksheet, Worksheet]:
 
     return ws_matched, ws_no_txt, ws_tag_frequency
 
+# --- NEW FUNCTION: Save Workbook Once, Retry Only the File Replace ---
+def save_workbook_with_retries(wb: Workbook, target_path: Path, fallback_path: Path, log_manager: LogManager) -> Path:
+    """
+    保存工作簿：只序列化一次到目标目录中的临时文件 (~文件名.tmp)，再用 os.replace 原子替换为目标文件。
+    目标被占用 (PermissionError) 时只重试替换这一步；检测到 Excel 锁文件 (~$文件名) 时不再等待。
+    仍然失败时把临时文件移动到备用位置；目标目录无法写入临时文件时（例如磁盘已满）先删除写了一半的临时文件，再直接保存到备用位置。
+    Returns:
+        Path: 实际保存的路径；都失败时为 Path("N/A_SAVE_FAILED")。
+    """
+    temp_path = target_path.with_name(f"~{target_path.name}.tmp")
+    try:
+        wb.save(str(temp_path))
+    except Exception as e:
+        log_manager.write_log(f"错误: 无法在 '{normalize_drive_letter(str(target_path.parent))}' 中写入临时结果文件: {e}。尝试直接保存到备用位置。", level="ERROR")
+        print(f"错误: 无法写入临时结果文件 {temp_path}. 错误: {e}")
+        remove_partial_file(temp_path, log_manager)
+        temp_path = None
+
+    try:
+        if temp_path is not None:
+            lock_file_path = target_path.with_name("~$" + target_path.name)
+            for attempt in range(MAX_SAVE_RETRIES):
+                if lock_file_path.exists():
+                    log_manager.write_log(f"警告: 检测到锁文件 '{normalize_drive_letter(str(lock_file_path))}'，结果文件正被其他程序（如Excel）打开，不再重试。", level="WARNING")
+                    print(f"警告: {target_path} 正被其他程序（如Excel）打开，不再重试。")
+                    break
+                try:
+                    os.replace(temp_path, target_path)
+                    log_manager.write_log(f"扫描结果已保存到: {normalize_drive_letter(str(target_path))} (尝试 {attempt + 1}/{MAX_SAVE_RETRIES})", level="INFO")
+                    print(f"扫描结果已保存到: {target_path}")
+                    return target_path
+                except PermissionError as e:
+                    log_manager.write_log(
+                        f"警告: 无法将扫描结果保存到 '{normalize_drive_letter(str(target_path))}'，原因: 权限拒绝！请确保该文件未被其他程序（如Excel）打开。尝试 {attempt + 1}/{MAX_SAVE_RETRIES}。错误: {e}",
+                        level="WARNING"
+                    )
+                    print(f"警告: 无法保存结果到 {target_path}！原因: 权限拒绝。尝试 {attempt + 1}/{MAX_SAVE_RETRIES}。等待 {RETRY_DELAY_SECONDS} 秒后重试...")
+                    if attempt + 1 < MAX_SAVE_RETRIES:
+                        time.sleep(RETRY_DELAY_SECONDS) # 等待一段时间后重试
+                except OSError as e: # 其他错误重试没有意义，直接转到备用
+                    log_manager.write_log(
+                        f"错误: 将扫描结果保存到 '{normalize_drive_letter(str(target_path))}' 失败: {e} (尝试 {attempt + 1}/{MAX_SAVE_RETRIES})",
+                        level="ERROR"
+                    )
+                    print(f"错误: 无法保存结果到 {target_path}. 错误: {e}")
+                    break
+            log_manager.write_log(
+                f"严重警告: 无法将扫描结果保存到 '{normalize_drive_letter(str(target_path))}'。尝试保存到备用位置。",
+                level="CRITICAL"
+            )
+            print(f"严重警告: 无法将扫描结果保存到 {target_path}。尝试保存到备用位置...")
+
+        try:
+            if temp_path is not None:
+                shutil.move(str(temp_path), str(fallback_path)) # 跨磁盘时为复制后删除
+            else:
+                wb.save(str(fallback_path))
+            log_manager.write_log(f"成功将扫描结果保存到备用位置: {normalize_drive_letter(str(fallback_path))}", level="WARNING")
+            print(f"成功将扫描结果保存到备用位置: {fallback_path}")
+            return fallback_path
+        except Exception as fallback_e:
+            log_manager.write_log(
+                f"致命错误: 尝试将扫描结果保存到备用位置 '{normalize_drive_letter(str(fallback_path))}' 也失败了！错误: {fallback_e}",
+                level="CRITICAL"
+            )
+            print(f"致命错误: 无法保存结果到任何位置！错误: {fallback_e}")
+            remove_partial_file(fallback_path, log_manager)
+            return Path("N/A_SAVE_FAILED")
+    finally:
+        if temp_path is not None:
+            remove_partial_file(temp_path, log_manager)
+
+def remove_partial_file(file_path: Path, log_manager: LogManager):
+    """
+    删除保存失败时留下的未完成文件。
+    """
+    if not file_path.exists():
+        return
+    try:
+        file_path.unlink()
+    except OSError as e:
+        log_manager.write_log(f"警告: 无法删除未完成的文件 '{normalize_drive_letter(str(file_path))}': {e}", level="WARNING")
+
 # --- Data Processor (RESTORED FROM V4.0) ---
 def detect_types(line: str, cleaned: str) -> str:
     """
@@ -998,51 +1081,8 @@ def main():
                 set_fixed_column_widths(worksheet, FIXED_COLUMN_WIDTH, scan_log_manager)
             
             # --- 主要修改点：尝试保存Excel文件，如果权限拒绝则保存到logs目录 ---
-            save_successful = False
-            actual_result_file_path = Path("N/A_SAVE_FAILED") # 默认标记为保存失败
-
-            for attempt in range(MAX_SAVE_RETRIES):
-                try:
-                    wb.save(str(current_excel_file))
-                    scan_log_manager.write_log(f"扫描结果已保存到: {normalize_drive_letter(str(current_excel_file))} (尝试 {attempt + 1}/{MAX_SAVE_RETRIES})", level="INFO")
-                    print(f"扫描结果已保存到: {current_excel_file}")
-                    actual_result_file_path = current_excel_file
-                    save_successful = True
-                    break # 成功保存，跳出重试循环
-                except PermissionError as e:
-                    scan_log_manager.write_log(
-                        f"警告: 无法将扫描结果保存到 '{normalize_drive_letter(str(current_excel_file))}'，原因: 权限拒绝！请确保该文件未被其他程序（如Excel）打开。尝试 {attempt + 1}/{MAX_SAVE_RETRIES}。错误: {e}", 
-                        level="WARNING"
-                    )
-                    print(f"警告: 无法保存结果到 {current_excel_file}！原因: 权限拒绝。尝试 {attempt + 1}/{MAX_SAVE_RETRIES}。等待 {RETRY_DELAY_SECONDS} 秒后重试...")
-                    time.sleep(RETRY_DELAY_SECONDS) # 等待一段时间后重试
-                except Exception as e: # 捕获其他保存错误
-                    scan_log_manager.write_log(
-                        f"错误: 将扫描结果保存到 '{normalize_drive_letter(str(current_excel_file))}' 失败: {e} (尝试 {attempt + 1}/{MAX_SAVE_RETRIES})", 
-                        level="ERROR"
-                    )
-                    print(f"错误: 无法保存结果到 {current_excel_file}. 错误: {e}")
-                    # 对于非权限错误，可能没有必要重试，直接跳出并转到备用
-                    break 
-            
-            if not save_successful: # 如果所有重试都失败了
-                scan_log_manager.write_log(
-                    f"严重警告: 经过 {MAX_SAVE_RETRIES} 次尝试后，仍无法将扫描结果保存到 '{normalize_drive_letter(str(current_excel_file))}'。尝试保存到备用位置。", 
-                    level="CRITICAL"
-                )
-                print(f"严重警告: 经过 {MAX_SAVE_RETRIES} 次尝试后，仍无法将扫描结果保存到 {current_excel_file}。尝试保存到备用位置...")
-                try:
-                    wb.save(str(fallback_excel_file))
-                    scan_log_manager.write_log(f"成功将扫描结果保存到备用位置: {normalize_drive_letter(str(fallback_excel_file))}", level="WARNING")
-                    print(f"成功将扫描结果保存到备用位置: {fallback_excel_file}")
-                    actual_result_file_path = fallback_excel_file # 更新实际保存路径
-                except Exception as fallback_e:
-                    scan_log_manager.write_log(
-                        f"致命错误: 尝试将扫描结果保存到备用位置 '{normalize_drive_letter(str(fallback_excel_file))}' 也失败了！错误: {fallback_e}", 
-                        level="CRITICAL"
-                    )
-                    print(f"致命错误: 无法保存结果到任何位置！错误: {fallback_e}")
-                    actual_result_file_path = Path("N/A_SAVE_FAILED") # 标记保存失败
+            # 工作簿只序列化一次，重试和备用位置都只移动已写好的临时文件
+            actual_result_file_path = save_workbook_with_retries(wb, current_excel_file, fallback_excel_file, scan_log_manager)
             # --- 修改结束 ---
 
             # 将本次扫描结果添加到内存中的历史记录
@@ -9,6 +9,24 @@ HISTORY_EXCEL_NAME = "scan_history.xlsx"
 # 注意：使用 r'' 前缀创建原始字符串，避免反斜杠转义问题
 CACHE_FOLDER_PATH_STR = r'C:\个人数据\pythonCode\反推图片信息\cache'
 
+# 后台收尾队列长度：最多有多少个已扫描完成、等待保存/复制的工作簿排队
+# (每个排队的工作簿都完整驻留在内存中，数值越大越占内存)
+FINALIZATION_QUEUE_SIZE = 1
+
+# 历史记录快照缓存的保留策略 (None 表示不限制该项)
+# 快照按内容去重存放在缓存文件夹的 blobs 子目录中，清单为 snapshot_manifest.json
+SNAPSHOT_KEEP_LAST = 50
+SNAPSHOT_MAX_BYTES = 512 * 1024 * 1024
+SNAPSHOT_MAX_AGE_DAYS = 90
+
+# 每个TXT文件最多读取的字节数，超出部分被截断 (见 utils/txt_reader.py)
+# 解码后的字符数不超过字节数，该值保证内容不超过 Excel 单元格 32767 字符的上限
+TXT_MAX_READ_BYTES = 32000
+
+# Tag别名文件 (放在脚本目录下，不存在时只统一大小写和空格/下划线)，格式见 core/tag_aliases.py
+# 编译后的别名表缓存在缓存文件夹中
+TAG_ALIAS_FILE_NAME = "tag_aliases.csv"
+
 # 定义R18相关词汇列表
 R18_KEYWORDS = [
     'sex', 'nude', 'pussy', 'penis', 'cum', 'nipples', 'vaginal', 'cum_in_pussy',
@@ -24,6 +42,12 @@ R18_KEYWORDS = [
     'breast_squeeze', 'straddling'
 ]
 
+# 关键词匹配方式 (见 core/data_processor.py)：
+#   substring : 默认，旧行为，关键词出现在Tag任意位置即命中
+#   exact     : 逐个Tag精确比较，含 * ? [ 的关键词按通配符匹配整个Tag；'oral' 不会命中 'floral'，
+#               但只展开了 EXACT_MODE_KEYWORD_PATTERNS 中的关键词族，'nude' 等不会命中 'completely_nude'
+TAG_MATCH_MODE = "substring"
+
 # 定义需要清洗掉的Tag关键词列表
 WORDS_TO_CLEAN_TAGS = [
     'censor', 'monochrome', 'greyscale', 'furry', 'animal_focus', 'no_human', 'background'
@@ -34,6 +58,17 @@ SENSITIVE_KEYWORDS_FOR_UNCENSORED = [
     'censor', 'nipple', 'pussy', 'penis', 'hetero', 'sex', 'anus'
 ]
 
+# exact 模式下代表一族Tag的关键词按以下通配符展开（substring 模式仍使用原关键词）
+# 例如 'background' 命中 blue_background，'sex' 命中 group_sex / sex_from_behind 但不命中 sexy
+EXACT_MODE_KEYWORD_PATTERNS = {
+    'background': ['background', '*_background'],
+    'censor': ['*censor*'],
+    'nipple': ['*nipple*'],
+    'pussy': ['*pussy*'],
+    'penis': ['*penis*'],
+    'sex': ['sex', 'sex_*', '*_sex', '*_sex_*'],
+}
+
 # 定义boy类型词汇
 BOY_KEYWORDS = ['1boy', '2boys', 'multiple_boys']
 
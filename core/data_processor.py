@@ -1,49 +1,196 @@
 # core/data_processor.py
-from typing import Tuple, List, Dict
+import re
+import sys
+import fnmatch
+from typing import Tuple, List, Dict, FrozenSet, Iterable, Optional
 from config import (
     R18_KEYWORDS, BOY_KEYWORDS, FURRY_KEYWORDS,
     MONOCHROME_GREYSCALE_KEYWORDS, SIMPLE_BACKGROUND_KEYWORDS,
-    WORDS_TO_CLEAN_TAGS, SENSITIVE_KEYWORDS_FOR_UNCENSORED
+    WORDS_TO_CLEAN_TAGS, SENSITIVE_KEYWORDS_FOR_UNCENSORED, TAG_MATCH_MODE,
+    EXACT_MODE_KEYWORD_PATTERNS
 )
+from core.prompt_tokenizer import tokenize_prompt
+from core.tag_aliases import TagCanonicalizer, normalize_tag
+
+TAG_MATCH_MODE_EXACT = "exact"
+TAG_MATCH_MODE_SUBSTRING = "substring"
+TAG_MATCH_MODES = (TAG_MATCH_MODE_EXACT, TAG_MATCH_MODE_SUBSTRING)
+_GLOB_CHARACTERS = frozenset('*?[')
+
+class KeywordMatcher:
+    """
+    编译后的关键词列表：普通关键词放入 frozenset，通配符关键词合并为一个正则，均只在编译时处理一次。
+    exact 模式逐个Tag精确比较；substring 模式保留旧行为（关键词出现在Tag任意位置即命中）。
+    """
+    def __init__(self, keywords: Iterable[str], match_mode: str = TAG_MATCH_MODE_EXACT):
+        if match_mode not in TAG_MATCH_MODES:
+            raise ValueError(f"Unknown tag match mode: {match_mode}")
+        self.match_mode = match_mode
+        normalized = [normalize_tag(keyword) for keyword in keywords if keyword.strip()]
+        plain_keywords = [keyword for keyword in normalized if _GLOB_CHARACTERS.isdisjoint(keyword)]
+        glob_keywords = [keyword for keyword in normalized if not _GLOB_CHARACTERS.isdisjoint(keyword)]
+        self.words: FrozenSet[str] = frozenset(plain_keywords)
+        self.substrings: Tuple[str, ...] = tuple(dict.fromkeys(plain_keywords))
+        self.glob_pattern: Optional[re.Pattern] = (
+            re.compile('|'.join(fnmatch.translate(keyword) for keyword in glob_keywords)) if glob_keywords else None)
+
+    def matches_tag(self, tag: str) -> bool:
+        """
+        tag 须已规范化 (normalize_tag)。
+        """
+        if self.match_mode == TAG_MATCH_MODE_EXACT:
+            if tag in self.words:
+                return True
+        elif any(word in tag for word in self.substrings):
+            return True
+        return self.glob_pattern is not None and self.glob_pattern.match(tag) is not None
+
+    def matches_any(self, tags: FrozenSet[str]) -> bool:
+        if self.match_mode == TAG_MATCH_MODE_EXACT:
+            if not self.words.isdisjoint(tags):
+                return True
+            return self.glob_pattern is not None and any(self.glob_pattern.match(tag) for tag in tags)
+        return any(self.matches_tag(tag) for tag in tags)
+
+def _keywords_for_mode(keywords: Iterable[str], match_mode: str) -> List[str]:
+    """
+    exact 模式下按 EXACT_MODE_KEYWORD_PATTERNS 展开代表一族Tag的关键词；substring 模式原样返回。
+    """
+    if match_mode != TAG_MATCH_MODE_EXACT:
+        return list(keywords)
+    return [pattern for keyword in keywords for pattern in EXACT_MODE_KEYWORD_PATTERNS.get(keyword, [keyword])]
+
+def _compile_keyword_matchers(match_mode: str) -> Tuple[List[Tuple[str, KeywordMatcher]], KeywordMatcher, KeywordMatcher]:
+    def compile_keywords(keywords: Iterable[str]) -> KeywordMatcher:
+        return KeywordMatcher(_keywords_for_mode(keywords, match_mode), match_mode)
+
+    type_matchers = [
+        ('R18', compile_keywords(R18_KEYWORDS)),
+        ('boy', compile_keywords(BOY_KEYWORDS)),
+        ('no_human', compile_keywords(['no_human'])),
+        ('furry', compile_keywords(FURRY_KEYWORDS)),
+        ('黑白原图', compile_keywords(MONOCHROME_GREYSCALE_KEYWORDS)),
+        ('简单背景', compile_keywords(SIMPLE_BACKGROUND_KEYWORDS)),
+    ]
+    return (type_matchers, compile_keywords(WORDS_TO_CLEAN_TAGS),
+            compile_keywords(SENSITIVE_KEYWORDS_FOR_UNCENSORED))
+
+_type_matchers, _clean_matcher, _sensitive_matcher = _compile_keyword_matchers(TAG_MATCH_MODE)
+
+def configure_tag_match_mode(match_mode: str):
+    """
+    切换关键词匹配方式 (exact / substring) 并重新编译关键词列表。应在扫描开始前调用一次。
+    """
+    global _type_matchers, _clean_matcher, _sensitive_matcher
+    _type_matchers, _clean_matcher, _sensitive_matcher = _compile_keyword_matchers(match_mode)
+    _ascii_tag_cache.clear()
+
+# Tag 规范化：默认只统一大小写和空格/下划线，configure_tag_aliases 加载别名表后同时映射别名
+_tag_canonicalizer = TagCanonicalizer()
+
+# --- ASCII bytes 快速路径 ---
+# 纯ASCII、单行且不含强调语法、参数或负向提示词标记的内容（绝大多数反推TXT）直接在 bytes 上处理：
+# bytes.translate 转小写、按 b',' 切分，每个不同的Tag只在第一次出现时解码、规范化、查别名并判断清洗/敏感，
+# 结果以共享的 str 对象缓存（按 bytes 键），之后同一个Tag不再为每个处理阶段分配新的字符串。
+# 其余内容（非ASCII、多行、含 ( [ { \ :）走 str 路径 (clean_tags / detect_types)。
+ASCII_TAG_CACHE_SIZE = 200000 # bytes Tag 缓存的条目上限，超过后清空重建
+_ASCII_LOWERCASE_TABLE = bytes.maketrans(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ', b'abcdefghijklmnopqrstuvwxyz')
+_ASCII_SLOW_PATH_PATTERN = re.compile(rb'[()\[\]{}\\:\n\r\x0b\x0c\x1c-\x1f]')
+_ascii_tag_cache: Dict[bytes, Tuple[str, bool, bool]] = {} # 小写 bytes Tag -> (规范名, 是否清洗, 是否敏感)
+
+def _lookup_ascii_tag(raw_tag: bytes) -> Tuple[str, bool, bool]:
+    canonical = sys.intern(_tag_canonicalizer.canonicalize(raw_tag.decode('ascii')))
+    tag_info = (canonical, _clean_matcher.matches_tag(canonical), _sensitive_matcher.matches_tag(canonical))
+    if len(_ascii_tag_cache) >= ASCII_TAG_CACHE_SIZE:
+        _ascii_tag_cache.clear()
+    _ascii_tag_cache[raw_tag] = tag_info
+    return tag_info
+
+def process_ascii_caption(data: bytes) -> Optional[Tuple[str, bool, str, List[str]]]:
+    """
+    bytes 快速路径。结果与 clean_tags(line) 和 detect_types(canonicalize_prompt(line)) 相同。
+    Args:
+        data (bytes): TXT 的原始字节 (CaptionText.ascii_data)。
+    Returns:
+        Optional[Tuple[str, bool, str, List[str]]]: (清洗后的Tag串, 是否含敏感词, 提示词类型, 清洗后的Tag列表)；
+            内容不适用快速路径时返回 None，调用方应改用 str 路径。
+    """
+    data = data.strip()
+    if not data or not data.isascii() or _ASCII_SLOW_PATH_PATTERN.search(data):
+        return None
+
+    tag_cache_get = _ascii_tag_cache.get
+    tags: List[str] = []
+    cleaned_tags: List[str] = []
+    has_sensitive = False
+    for raw_tag in data.translate(_ASCII_LOWERCASE_TABLE).split(b','):
+        raw_tag = raw_tag.strip()
+        if not raw_tag:
+            continue
+        tag_info = tag_cache_get(raw_tag) or _lookup_ascii_tag(raw_tag)
+        tags.append(tag_info[0])
+        if not tag_info[1]:
+            cleaned_tags.append(tag_info[0])
+        if tag_info[2]:
+            has_sensitive = True
+
+    # 与 clean_tags 相同：确保uncensored只添加一次
+    if has_sensitive and 'uncensored' not in cleaned_tags:
+        cleaned_tags.append('uncensored')
+    return ', '.join(cleaned_tags), has_sensitive, detect_types_for_tags(frozenset(tags)), cleaned_tags
+
+def configure_tag_aliases(alias_table: Dict[str, str]):
+    """
+    设置全局Tag别名表（load_alias_table 的结果）。应在扫描开始前调用一次。
+    """
+    global _tag_canonicalizer
+    _tag_canonicalizer = TagCanonicalizer(alias_table)
+    _ascii_tag_cache.clear()
+
+def canonicalize_tags(line: str) -> List[str]:
+    """
+    去除强调语法并把每个Tag替换为规范名。
+    """
+    canonicalize = _tag_canonicalizer.canonicalize
+    return [canonicalize(tag) for tag, _ in tokenize_prompt(line.strip())]
+
+def canonicalize_prompt(line: str) -> str:
+    """
+    返回规范化后逗号分隔的Tag串，供类型检测和负向Tag统计使用。
+    注意：规范名可能含括号，结果不应再次交给 clean_tags。
+    """
+    return ', '.join(canonicalize_tags(line))
 
 def detect_types(line: str) -> str:
     """
     根据预定义关键词检测并返回提示词类型。
+    line 为逗号分隔的Tag串（通常是 canonicalize_prompt 的结果），按 TAG_MATCH_MODE 逐个Tag匹配。
     """
-    types = []
-    lower_line = line.lower()
-
-    if any(word in lower_line for word in R18_KEYWORDS):
-        types.append('R18')
-    if any(boy_word in lower_line for boy_word in BOY_KEYWORDS):
-        types.append('boy')
-    if 'no_human' in lower_line:
-        types.append('no_human')
-    if any(word in lower_line for word in FURRY_KEYWORDS):
-        types.append('furry')
-    if any(word in lower_line for word in MONOCHROME_GREYSCALE_KEYWORDS):
-        types.append('黑白原图')
-    if any(word in lower_line for word in SIMPLE_BACKGROUND_KEYWORDS):
-        types.append('简单背景')
-        
+    return detect_types_for_tags(frozenset(tag for tag in (normalize_tag(raw_tag) for raw_tag in line.split(',')) if tag))
+
+def detect_types_for_tags(tag_set: FrozenSet[str]) -> str:
+    """
+    与 detect_types 相同，输入为已规范化的Tag集合。
+    """
+    types = [type_name for type_name, matcher in _type_matchers if matcher.matches_any(tag_set)]
     return ','.join(types)
 
 def clean_tags(line: str) -> Tuple[str, bool]:
     """
     清洗Tag，移除不需要的关键词，并检测是否包含敏感词。
     返回清洗后的Tag字符串和是否包含敏感词的布尔值。
+    强调语法 ((tag), (tag:1.2), [tag], 转义括号) 先由 tokenize_prompt 规范化，权重不保留在清洗结果中；
+    每个Tag再经过规范化和别名映射 (见 core/tag_aliases.py)。
     """
-    tags = [tag.strip() for tag in line.strip().split(',')]
-    
+    tags = canonicalize_tags(line)
+    normalized_tags = [normalize_tag(tag) for tag in tags]
+
     cleaned_tags = [
-        tag for tag in tags
-        if not any(word in tag.lower() for word in WORDS_TO_CLEAN_TAGS)
+        tag for tag, normalized_tag in zip(tags, normalized_tags)
+        if not _clean_matcher.matches_tag(normalized_tag)
     ]
 
-    has_sensitive = any(
-        any(word in tag.lower() for word in SENSITIVE_KEYWORDS_FOR_UNCENSORED)
-        for tag in tags
-    )
+    has_sensitive = _sensitive_matcher.matches_any(frozenset(normalized_tags))
     if has_sensitive:
         # 确保uncensored只添加一次，并且不与原有tag重复
         if 'uncensored' not in [t.lower() for t in cleaned_tags]:
@@ -51,4 +198,4 @@ def clean_tags(line: str) -> Tuple[str, bool]:
 
     # 过滤掉空字符串，并用逗号+空格连接
     cleaned_line = ', '.join(filter(None, cleaned_tags))
-    return cleaned_line, has_sensitive
\ No newline at end of file
+    return cleaned_line, has_sensitive
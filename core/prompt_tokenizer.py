@@ -0,0 +1,116 @@
+# core/prompt_tokenizer.py
+"""
+带权重的提示词分词器。
+
+把 A1111/NovelAI 风格的强调语法规范化为 (Tag, 权重) 对，再交给清洗和统计：
+    (red_hair:1.2)    -> ('red_hair', 1.2)
+    ((masterpiece))   -> ('masterpiece', 1.21)        每层 () 乘 1.1
+    [lowres]          -> ('lowres', 0.9091)           每层 [] 除以 1.1
+    {best_quality}    -> ('best_quality', 1.05)       每层 {} 乘 1.05 (NovelAI)
+    \\(artist\\)        -> ('(artist)', 1.0)            转义的括号是普通字符
+    (a, b:1.3)        -> ('a', 1.3), ('b', 1.3)       括号内的逗号仍然分隔Tag
+未配对的闭括号（例如 ":)" 这类表情Tag）按普通字符处理；未闭合的开括号作用到行尾（与 A1111 一致）。
+
+不含 ( [ { \\ 的行（绝大多数反推TXT）直接走 split(',') 快速路径；
+含强调语法的行由一个预编译的正则单遍切分，开销仍与行长度成正比。
+"""
+import re
+from typing import List, Tuple
+
+# --- Configuration ---
+ROUND_BRACKET_MULTIPLIER = 1.1
+SQUARE_BRACKET_MULTIPLIER = 1 / 1.1
+CURLY_BRACKET_MULTIPLIER = 1.05
+WEIGHT_DECIMALS = 4
+DEFAULT_WEIGHT = 1.0
+
+_BRACKET_MULTIPLIERS = {
+    '(': ROUND_BRACKET_MULTIPLIER,
+    '[': SQUARE_BRACKET_MULTIPLIER,
+    '{': CURLY_BRACKET_MULTIPLIER,
+}
+_CLOSING_BRACKETS = {')': '(', ']': '[', '}': '{'}
+_SYNTAX_PATTERN = re.compile(r'[(\[{\\]')
+
+_TOKEN_PATTERN = re.compile(r"""
+      \\(.)                                        # 1: 转义字符
+    | :\s*([+-]?(?:\d+(?:\.\d*)?|\.\d+))\s*\)      # 2: 显式权重 ":1.2)"
+    | ([(\[{])                                     # 3: 开括号
+    | ([)\]}])                                     # 4: 闭括号
+    | ([^\\()\[\]{}:]+|:)                          # 5: 普通文本（可含逗号，合并Tag时再切分）
+""", re.VERBOSE | re.DOTALL)
+
+
+def _multiply_range(segments: List[list], start: int, multiplier: float):
+    for index in range(start, len(segments)):
+        segments[index][1] *= multiplier
+
+
+def tokenize_prompt(line: str) -> List[Tuple[str, float]]:
+    """
+    把一行提示词切分为 (Tag, 权重) 列表，Tag 已去除强调语法并反转义，去除首尾空白，空Tag被丢弃。
+    一个Tag内部只有部分文字被强调时（例如 "a (b) c"），取最长一段文字的权重。
+    """
+    if not line:
+        return []
+    if _SYNTAX_PATTERN.search(line) is None:
+        return [(tag, DEFAULT_WEIGHT) for tag in (raw_tag.strip() for raw_tag in line.split(',')) if tag]
+
+    # segments: [文字, 权重, 是否按逗号切分]；连续的普通文本（包括逗号）只占一段，
+    # Python 层的循环次数只与语法符号的数量有关
+    segments: List[list] = []
+    open_brackets: List[Tuple[str, int]] = [] # (开括号, 起始段下标)
+    for match in _TOKEN_PATTERN.finditer(line):
+        escaped, explicit_weight, opening, closing, text = match.groups()
+        if escaped is not None:
+            segments.append([escaped, DEFAULT_WEIGHT, False])
+        elif explicit_weight is not None:
+            if open_brackets and open_brackets[-1][0] == '(':
+                _, start = open_brackets.pop()
+                _multiply_range(segments, start, float(explicit_weight))
+            else:
+                segments.append([match.group(0), DEFAULT_WEIGHT, False])
+        elif opening is not None:
+            open_brackets.append((opening, len(segments)))
+        elif closing is not None:
+            if open_brackets and open_brackets[-1][0] == _CLOSING_BRACKETS[closing]:
+                bracket, start = open_brackets.pop()
+                _multiply_range(segments, start, _BRACKET_MULTIPLIERS[bracket])
+            else:
+                segments.append([closing, DEFAULT_WEIGHT, False])
+        else:
+            segments.append([text, DEFAULT_WEIGHT, True])
+    for bracket, start in reversed(open_brackets):
+        _multiply_range(segments, start, _BRACKET_MULTIPLIERS[bracket])
+
+    weighted_tags: List[Tuple[str, float]] = []
+    tag_parts: List[str] = []
+    tag_weight = DEFAULT_WEIGHT
+    longest_part_length = 0
+
+    def finish_tag():
+        tag = ''.join(tag_parts).strip()
+        if tag:
+            weighted_tags.append((tag, round(tag_weight, WEIGHT_DECIMALS)))
+
+    for text, weight, splittable in segments:
+        if splittable and ',' in text:
+            first_piece, *middle_pieces, last_piece = text.split(',')
+            if len(first_piece.strip()) > longest_part_length:
+                tag_weight = weight
+            tag_parts.append(first_piece)
+            finish_tag()
+            # 同一段文本中间的Tag权重相同，批量加入
+            rounded_weight = round(weight, WEIGHT_DECIMALS)
+            weighted_tags.extend((tag, rounded_weight) for tag in (piece.strip() for piece in middle_pieces) if tag)
+            tag_parts = [last_piece]
+            longest_part_length = len(last_piece.strip())
+            tag_weight = weight if longest_part_length else DEFAULT_WEIGHT
+            continue
+        tag_parts.append(text)
+        part_length = len(text.strip())
+        if part_length > longest_part_length:
+            longest_part_length = part_length
+            tag_weight = weight
+    finish_tag()
+    return weighted_tags
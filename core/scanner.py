@@ -6,23 +6,28 @@ from pathlib import Path
 from typing import Tuple, Dict
 from openpyxl.worksheet.worksheet import Worksheet
 
-from core.data_processor import detect_types, clean_tags
+from config import TXT_MAX_READ_BYTES
+from core.data_processor import detect_types, clean_tags, canonicalize_prompt, process_ascii_caption
 from services.log_manager import LogManager
 from utils.file_operations import get_file_details
+from utils.txt_reader import read_caption_text, join_caption_lines
+from utils.prompt_parser import split_prompt
 
 def scan_files_and_extract_data(
     base_folder_path: Path,
     ws_matched: Worksheet,
     ws_no_txt: Worksheet,
     log_manager: LogManager
-) -> Tuple[int, int, int, Dict[str, int]]:
+) -> Tuple[int, int, int, Dict[str, int], Dict[str, int]]:
     """
     扫描指定文件夹下的文件，查找匹配的TXT文件，提取数据并写入Excel。
+    返回 (总文件数, 找到TXT数, 未找到TXT数, 正向Tag计数, 负向Tag计数)。
     """
     total_files_scanned = 0
     found_txt_count = 0
     not_found_txt_count = 0 # <-- 确保这里是 not_found_txt_count
     tag_counts = defaultdict(int)
+    negative_tag_counts = defaultdict(int)
 
     for root_str, _, files in os.walk(base_folder_path):
         root = Path(root_str)
@@ -47,6 +52,8 @@ def scan_files_and_extract_data(
             txt_absolute_path = ''
             found_txt = '否'
             cleaned_data_length = 0
+            negative_prompt = ''
+            generation_parameters = ''
 
             file_abs_path = file_path.resolve() # 获取文件的绝对路径 Path 对象
 
@@ -57,20 +64,43 @@ def scan_files_and_extract_data(
             if file_name_without_ext in current_txt_files:
                 txt_file_path = current_txt_files[file_name_without_ext]
                 try:
-                    with open(txt_file_path, 'r', encoding='utf-8') as f:
-                        for line in f:
-                            txt_content = line.strip()
-                            cleaned_data, _ = clean_tags(txt_content)
-                            cleaned_data_length = len(cleaned_data)
-                            prompt_type = detect_types(txt_content)
-                            txt_absolute_path = str(txt_file_path.resolve()) # 转为字符串
-                            found_txt = '是'
-                            found_txt_count += 1
+                    caption = read_caption_text(txt_file_path, TXT_MAX_READ_BYTES)
+                    if caption.is_binary:
+                        log_manager.write_log(f"TXT file looks binary, skipped: {txt_file_path}")
+                        txt_content = "Error reading TXT: binary content"
+                        found_txt = '否 (读取错误)'
+                        not_found_txt_count += 1
+                    elif not caption.text:
+                        log_manager.write_log(f"TXT file is empty: {txt_file_path}")
+                        not_found_txt_count += 1
+                    else:
+                        if caption.truncated:
+                            log_manager.write_log(f"Warning: TXT file {txt_file_path} exceeds {TXT_MAX_READ_BYTES} bytes, truncated.")
+                        txt_content = caption.text
+                        # 纯ASCII的单行Tag直接在 bytes 上处理，不适用时返回 None
+                        ascii_result = process_ascii_caption(caption.ascii_data) if caption.ascii_data else None
+                        if ascii_result is not None:
+                            cleaned_data, _, prompt_type, cleaned_tags = ascii_result
+                        else:
+                            # TXT内容保留多行结构；只有正向提示词参与清洗、类型检测和Tag统计，
+                            # 多行时合并为单行Tag串
+                            prompt_parts = split_prompt(txt_content)
+                            negative_prompt = canonicalize_prompt(join_caption_lines(prompt_parts.negative))
+                            generation_parameters = prompt_parts.parameters
+                            tag_line = join_caption_lines(prompt_parts.positive)
+                            cleaned_data, _ = clean_tags(tag_line)
+                            prompt_type = detect_types(canonicalize_prompt(tag_line))
+                            cleaned_tags = [tag.strip().lower() for tag in cleaned_data.split(', ') if tag]
+                        cleaned_data_length = len(cleaned_data)
+                        txt_absolute_path = str(txt_file_path.resolve()) # 转为字符串
+                        found_txt = '是'
+                        found_txt_count += 1
 
-                            for tag in cleaned_data.split(', '):
-                                if tag:
-                                    tag_counts[tag.strip().lower()] += 1
-                            break
+                        for tag in cleaned_tags:
+                            tag_counts[tag] += 1
+                        for tag in negative_prompt.split(','):
+                            if tag.strip():
+                                negative_tag_counts[tag.strip().lower()] += 1
                 except Exception as e:
                     log_manager.write_log(f"Error reading TXT file {txt_file_path}: {e}")
                     txt_content = f"Error reading TXT: {e}"
@@ -91,7 +121,9 @@ def scan_files_and_extract_data(
                     cleaned_data,
                     cleaned_data_length,
                     prompt_type,
-                    found_txt
+                    found_txt,
+                    negative_prompt,
+                    generation_parameters
                 ])
             else:
                 ws_no_txt.append([
@@ -101,4 +133,4 @@ def scan_files_and_extract_data(
                     file_ext,
                     found_txt
                 ])
-    return total_files_scanned, found_txt_count, not_found_txt_count, tag_counts # <-- 修正这里！
\ No newline at end of file
+    return total_files_scanned, found_txt_count, not_found_txt_count, tag_counts, negative_tag_counts
\ No newline at end of file
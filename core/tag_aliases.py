@@ -0,0 +1,142 @@
+# core/tag_aliases.py
+"""
+Tag 规范化与别名表。
+
+每个Tag先规范化（去除首尾空白、转小写、空格换成下划线，与 booru 的Tag写法一致），
+再查别名表映射到规范名，例如 "Red Hair" / "red_hair" -> "red_hair"，"1girls" -> "1girl"。
+清洗、类型检测和词频统计都使用规范化后的Tag。
+
+别名文件 (alias -> canonical) 支持：
+    - JSON：{"1girls": "1girl", ...}
+    - CSV ：两列 alias,canonical；或带表头的 booru 导出文件 (antecedent_name / consequent_name 列)
+启动时把别名文件编译成一个字典（链式别名 a -> b -> c 直接解析为 a -> c），
+并以 pickle 形式缓存到缓存文件夹；别名文件的大小和修改时间不变时直接加载缓存，无需重新解析。
+"""
+import os
+import csv
+import json
+import pickle
+import itertools
+from pathlib import Path
+from typing import Dict, Optional
+
+from services.log_manager import LogManager
+
+# --- Configuration ---
+TAG_ALIAS_CACHE_FILE_NAME = "tag_aliases.cache.pickle"
+TAG_ALIAS_CACHE_VERSION = 1
+_CSV_ALIAS_COLUMNS = (("antecedent_name", "consequent_name"), ("alias", "canonical"))
+
+
+def normalize_tag(tag: str) -> str:
+    """
+    Tag 的规范写法：去除首尾空白、转小写、空格换成下划线。
+    """
+    return tag.strip().lower().replace(' ', '_')
+
+
+def _read_alias_pairs(alias_file_path: Path) -> Dict[str, str]:
+    if alias_file_path.suffix.lower() == '.json':
+        with open(alias_file_path, 'r', encoding='utf-8-sig') as f:
+            raw_table = json.load(f)
+        if not isinstance(raw_table, dict):
+            raise ValueError("JSON 别名文件必须是 {别名: 规范名} 形式的对象")
+        return {str(alias): str(canonical) for alias, canonical in raw_table.items()}
+
+    raw_table: Dict[str, str] = {}
+    with open(alias_file_path, 'r', encoding='utf-8-sig', newline='') as f:
+        rows = csv.reader(f)
+        header = next(rows, None)
+        if header is None:
+            return raw_table
+        lower_header = [column.strip().lower() for column in header]
+        alias_index, canonical_index = 0, 1
+        for alias_column, canonical_column in _CSV_ALIAS_COLUMNS:
+            if alias_column in lower_header and canonical_column in lower_header:
+                alias_index = lower_header.index(alias_column)
+                canonical_index = lower_header.index(canonical_column)
+                break
+        else:
+            rows = itertools.chain([header], rows) # 没有可识别的表头时第一行也是数据
+        for row in rows:
+            if len(row) > max(alias_index, canonical_index):
+                raw_table[row[alias_index]] = row[canonical_index]
+    return raw_table
+
+
+def compile_alias_table(raw_table: Dict[str, str]) -> Dict[str, str]:
+    """
+    规范化别名和规范名，并把链式别名解析为最终的规范名（遇到环时停在环上）。
+    """
+    normalized: Dict[str, str] = {}
+    for alias, canonical in raw_table.items():
+        alias_key, canonical_key = normalize_tag(alias), normalize_tag(canonical)
+        if alias_key and canonical_key and alias_key != canonical_key:
+            normalized[alias_key] = canonical_key
+
+    compiled: Dict[str, str] = {}
+    for alias_key, canonical_key in normalized.items():
+        seen = {alias_key}
+        while canonical_key in normalized and canonical_key not in seen:
+            seen.add(canonical_key)
+            canonical_key = normalized[canonical_key]
+        if canonical_key != alias_key:
+            compiled[alias_key] = canonical_key
+    return compiled
+
+
+def load_alias_table(alias_file_path: Path, cache_folder_path: Optional[Path], log_manager: LogManager) -> Dict[str, str]:
+    """
+    加载编译后的别名表。缓存有效时直接读取缓存，否则解析别名文件并重写缓存。
+    Returns:
+        Dict[str, str]: 规范化的别名 -> 规范名；文件无法读取时返回空表。
+    """
+    try:
+        source_stat = alias_file_path.stat()
+    except OSError as e:
+        log_manager.write_log(f"Warning: Could not read tag alias file {alias_file_path}. Error: {e}")
+        print(f"警告: 无法读取Tag别名文件 {alias_file_path}。错误: {e}")
+        return {}
+    source_key = (str(alias_file_path.resolve()), source_stat.st_size, source_stat.st_mtime_ns)
+
+    cache_path = cache_folder_path / TAG_ALIAS_CACHE_FILE_NAME if cache_folder_path else None
+    if cache_path is not None and cache_path.exists():
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached.get("version") == TAG_ALIAS_CACHE_VERSION and tuple(cached.get("source", ())) == source_key:
+                log_manager.write_log(f"Loaded {len(cached['table'])} tag aliases from cache {cache_path}")
+                return cached["table"]
+        except Exception as e:
+            log_manager.write_log(f"Warning: Tag alias cache {cache_path} is unreadable, recompiling. Error: {e}")
+
+    try:
+        alias_table = compile_alias_table(_read_alias_pairs(alias_file_path))
+    except (OSError, ValueError, csv.Error) as e:
+        log_manager.write_log(f"Error: Could not parse tag alias file {alias_file_path}. Error: {e}")
+        print(f"错误: 解析Tag别名文件 {alias_file_path} 失败。错误: {e}")
+        return {}
+    log_manager.write_log(f"Compiled {len(alias_table)} tag aliases from {alias_file_path}")
+
+    if cache_path is not None:
+        temp_path = cache_path.with_name(cache_path.name + ".tmp")
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump({"version": TAG_ALIAS_CACHE_VERSION, "source": source_key, "table": alias_table},
+                            f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            log_manager.write_log(f"Warning: Could not write tag alias cache {cache_path}. Error: {e}")
+    return alias_table
+
+
+class TagCanonicalizer:
+    """
+    把Tag映射为规范名：规范化写法后查一次别名表。
+    """
+    def __init__(self, alias_table: Optional[Dict[str, str]] = None):
+        self.alias_table: Dict[str, str] = alias_table or {}
+
+    def canonicalize(self, tag: str) -> str:
+        normalized = tag.strip().lower().replace(' ', '_')
+        return self.alias_table.get(normalized, normalized)
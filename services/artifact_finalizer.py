@@ -0,0 +1,195 @@
+# services/artifact_finalizer.py
+import os
+import queue
+import subprocess
+import sys
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional
+
+from openpyxl import Workbook
+
+from services.log_manager import LogManager
+from services.history_manager import HistoryManager
+from services.snapshot_cache import SnapshotCache
+from utils.file_operations import publish_file
+
+
+@dataclass
+class FinalizationJob:
+    """
+    一个文件夹扫描完成后需要执行的收尾工作（保存、复制、更新历史记录、打开文件）。
+    """
+    folder_path: Path
+    workbook: Workbook
+    total_scanned: int
+    found_txt_count: int
+    not_found_txt_count: int
+    main_output_xlsx: Path
+    target_output_xlsx: Path
+    scan_log_file_path: Path
+    target_log_file: Path
+    scan_log_manager: LogManager
+    current_time_str: str
+
+
+@dataclass
+class FinalizationResult:
+    """
+    单个文件夹收尾工作的结果，errors 为空表示全部成功。
+    """
+    folder_path: Path
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def succeeded(self) -> bool:
+        return not self.errors
+
+
+class ArtifactFinalizer:
+    """
+    后台收尾阶段：扫描线程把 FinalizationJob 放入有界队列后立即开始扫描下一个文件夹，
+    由单个后台线程按提交顺序依次保存结果、复制到目标文件夹、更新历史记录并复制到缓存。
+    队列满时 submit 会阻塞，避免多个大工作簿同时堆积在内存中。
+    """
+    _STOP = object()
+
+    def __init__(self, history_manager: HistoryManager, history_file_path: Path,
+                 snapshot_cache: SnapshotCache, main_log_manager: LogManager, max_pending_jobs: int = 1):
+        self.history_manager = history_manager
+        self.history_file_path = history_file_path
+        self.snapshot_cache = snapshot_cache
+        self.main_log_manager = main_log_manager
+        self.results: List[FinalizationResult] = []
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, max_pending_jobs))
+        # 非守护线程：主线程异常退出时，已提交的保存/复制/历史记录写入也不会被中途杀掉
+        self._worker = threading.Thread(target=self._run, name="artifact-finalizer")
+        self._worker.start()
+
+    def submit(self, job: FinalizationJob):
+        """
+        提交一个收尾任务。队列已满时阻塞，直到后台线程腾出位置。
+        """
+        self._queue.put(job)
+
+    def close(self) -> List[FinalizationResult]:
+        """
+        等待所有已提交的任务完成并停止后台线程。
+        """
+        self._queue.put(self._STOP)
+        self._worker.join()
+        return self.results
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is self._STOP:
+                break
+            result = FinalizationResult(job.folder_path)
+            try:
+                self._finalize(job, result)
+            except Exception as e:
+                result.errors.append(f"Unexpected finalization error: {e}")
+                self.main_log_manager.write_log(f"Error: Unexpected error while finalizing {job.folder_path}: {e}")
+            self.results.append(result)
+
+    def _finalize(self, job: FinalizationJob, result: FinalizationResult):
+        scan_log_manager = job.scan_log_manager
+
+        # 9. 保存主输出文件
+        try:
+            job.workbook.save(str(job.main_output_xlsx))
+            print(f'合并完成，已保存至Python运行目录下的“反推历史记录”文件夹: {job.main_output_xlsx}')
+            scan_log_manager.write_log(f"Results saved to Python script history directory: {job.main_output_xlsx}")
+        except Exception as e:
+            scan_log_manager.write_log(f"Error: Could not save results to Python script history directory {job.main_output_xlsx}. Error: {e}")
+            print(f"错误: 无法保存结果到Python运行目录下的“反推历史记录”文件夹 {job.main_output_xlsx}。错误: {e}")
+            result.errors.append(f"Save failed: {e}")
+            scan_log_manager.close()
+            return
+        finally:
+            job.workbook = None # 尽早释放工作簿占用的内存
+
+        # 10. 复制一份到目标文件夹 (结果文件保存后不再改写，可以直接硬链接)
+        if publish_file(job.main_output_xlsx, job.target_output_xlsx, scan_log_manager):
+            print(f'一份副本已保存至目标文件夹: {job.target_output_xlsx}')
+        else:
+            result.errors.append(f"Copy of XLSX to {job.target_output_xlsx} failed")
+
+        # 11. 复制log文件到目标文件夹
+        # 在复制前确保日志文件已关闭并写入完成
+        scan_log_manager.close()
+        if job.scan_log_file_path.exists(): # 只有当日志文件实际存在时才尝试复制
+            if publish_file(job.scan_log_file_path, job.target_log_file, self.main_log_manager):
+                print(f'一份log副本已保存至目标文件夹: {job.target_log_file}')
+            else:
+                result.errors.append(f"Copy of scan log to {job.target_log_file} failed")
+        else:
+            self.main_log_manager.write_log(f"Warning: Scan specific log file did not exist to copy: {job.scan_log_file_path}")
+            print(f"警告: 本次扫描的日志文件 {job.scan_log_file_path} 不存在，未能复制到目标文件夹。")
+
+        # 12. 更新历史记录
+        try:
+            self.history_manager.update_history(
+                job.folder_path, job.total_scanned, job.found_txt_count, job.not_found_txt_count,
+                job.main_output_xlsx, job.scan_log_file_path # 传入的是单次扫描的log文件路径
+            )
+        except Exception as e:
+            self.main_log_manager.write_log(f"Error updating history for {job.folder_path}: {e}")
+            print(f"错误: 更新历史记录失败 for {job.folder_path}: {e}")
+            result.errors.append(f"History update failed: {e}")
+
+        # 13. 保存历史记录快照到缓存（按内容去重，内容未变化时不写入）
+        # 历史记录文件会被下一次 update_history 原地改写，快照必须是独立副本 (SnapshotCache 内部使用 copy_file，不做硬链接)
+        history_cache_file_path: Optional[Path] = None
+        if self.history_file_path.exists():
+            history_cache_file_path = self.snapshot_cache.store(self.history_file_path)
+            if history_cache_file_path:
+                print(f"历史记录快照已保存到缓存: {history_cache_file_path}")
+            else:
+                result.errors.append(f"Snapshot of history to cache {self.snapshot_cache.cache_folder} failed")
+        else:
+            self.main_log_manager.write_log(f"History file {self.history_file_path} does not exist, cannot copy to cache.")
+
+        # 14. 自动运行打开文件
+        self._open_files(job, history_cache_file_path)
+
+        print(f"文件夹 {job.folder_path} 扫描及处理结束。")
+        self.main_log_manager.write_log(f"Finished processing folder: {job.folder_path}")
+
+    def _open_files(self, job: FinalizationJob, history_cache_file_path: Optional[Path]):
+        try:
+            files_to_open = [job.main_output_xlsx] # 总是尝试打开主输出XLSX
+
+            # 只有当日志文件确实被创建了，并且目标存在，才尝试打开
+            if job.scan_log_file_path.exists():
+                files_to_open.append(job.scan_log_file_path)
+            else:
+                self.main_log_manager.write_log(f"Warning: Attempted to open non-existent scan log file: {job.scan_log_file_path}")
+                print(f"警告: 尝试打开不存在的扫描日志文件: {job.scan_log_file_path}")
+
+            # 快照数据块按内容共享，只打开它的副本
+            if history_cache_file_path and history_cache_file_path.exists():
+                history_copy_path = self.snapshot_cache.open_copy(history_cache_file_path)
+                if history_copy_path:
+                    files_to_open.append(history_copy_path)
+
+            for file_path_to_open in files_to_open:
+                if not file_path_to_open.exists():
+                    self.main_log_manager.write_log(f"Attempted to open non-existent file: {file_path_to_open}")
+                    print(f"警告: 尝试打开不存在的文件: {file_path_to_open}")
+                    continue
+
+                if sys.platform.startswith('win'): # Windows
+                    os.startfile(str(file_path_to_open))
+                elif sys.platform == 'darwin': # macOS
+                    subprocess.Popen(['open', str(file_path_to_open)])
+                else: # Linux/Unix
+                    subprocess.Popen(['xdg-open', str(file_path_to_open)])
+
+                print(f"自动打开: {file_path_to_open}")
+
+        except Exception as e:
+            self.main_log_manager.write_log(f"Error automatically opening files. Error: {e}")
+            print(f"无法自动打开文件或缓存历史记录。请手动检查。错误: {e}")
@@ -3,6 +3,7 @@ import datetime
 from pathlib import Path
 import os
 import sys
+import threading
 
 class LogManager:
     """
@@ -18,6 +19,7 @@ class LogManager:
             self.log_file_path = self.log_directory / log_file_name
         
         self.file_handle = None # 初始化文件句柄为None
+        self._lock = threading.Lock() # 主日志会被扫描线程和后台收尾线程同时写入
         self._open_log_file() # 尝试打开日志文件
 
     def _open_log_file(self):
@@ -38,6 +40,10 @@ class LogManager:
         timestamp = datetime.datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
         log_message = f"{timestamp} {message}\n"
         
+        with self._lock:
+            self._write_log_message(message, log_message)
+
+    def _write_log_message(self, message: str, log_message: str):
         if self.file_handle:
             try:
                 self.file_handle.write(log_message)
@@ -53,14 +59,15 @@ class LogManager:
 
     def close(self):
         """
-        关闭日志文件句柄。
+        关闭日志文件句柄。与 write_log 使用同一把锁，避免后台收尾线程写到一半时句柄被关闭。
         """
-        if self.file_handle:
-            try:
-                self.file_handle.close()
-                self.file_handle = None
-            except Exception as e:
-                print(f"Error closing log file {self.log_file_path}. Error: {e}")
+        with self._lock:
+            if self.file_handle:
+                try:
+                    self.file_handle.close()
+                    self.file_handle = None
+                except Exception as e:
+                    print(f"Error closing log file {self.log_file_path}. Error: {e}")
 
     def __del__(self):
         """
@@ -0,0 +1,262 @@
+# services/snapshot_cache.py
+"""
+按内容寻址的历史记录快照缓存：
+    <cache>/snapshot_manifest.json         快照清单（时间、摘要、数据块、大小、来源）
+    <cache>/blobs/<摘要前2位>/<摘要>.xlsx    快照内容，相同内容只存一份
+    <cache>/opened/<摘要前12位>.xlsx          交给用户打开的副本，数据块本身不直接打开
+内容与最新快照相同时不写入；按最近 N 个 / 总字节数 / 保留天数淘汰旧快照。
+"""
+import os
+import json
+import hashlib
+import zipfile
+import datetime
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+from services.log_manager import LogManager
+from utils.file_operations import copy_file
+
+SNAPSHOT_MANIFEST_FILE_NAME = "snapshot_manifest.json"
+SNAPSHOT_BLOB_FOLDER_NAME = "blobs"
+SNAPSHOT_OPENED_FOLDER_NAME = "opened"
+SNAPSHOT_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+LEGACY_SNAPSHOT_TIME_FORMAT = "%Y%m%d_%H%M%S"
+DEFAULT_KEEP_LAST_SNAPSHOTS = 50
+DEFAULT_MAX_SNAPSHOT_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_SNAPSHOT_AGE_DAYS = 90
+# openpyxl 每次保存都会写入新的修改时间，摘要中忽略这些与内容无关的成员
+VOLATILE_XLSX_MEMBERS = {"docProps/core.xml"}
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class SnapshotRetention:
+    """
+    快照保留策略。任一项为 None 或 0 表示不限制该项。
+    """
+    keep_last: Optional[int] = DEFAULT_KEEP_LAST_SNAPSHOTS
+    max_bytes: Optional[int] = DEFAULT_MAX_SNAPSHOT_BYTES
+    max_age_days: Optional[float] = DEFAULT_MAX_SNAPSHOT_AGE_DAYS
+
+
+def compute_snapshot_digest(file_path: Path) -> str:
+    """
+    计算快照内容摘要。xlsx 对排序后的成员名和解压内容求哈希（跳过易变的元数据），其他文件直接哈希。
+    """
+    digest = hashlib.sha256()
+    if zipfile.is_zipfile(file_path):
+        with zipfile.ZipFile(file_path) as archive:
+            for member_name in sorted(archive.namelist()):
+                if member_name in VOLATILE_XLSX_MEMBERS:
+                    continue
+                digest.update(member_name.encode('utf-8') + b'\0')
+                with archive.open(member_name) as member:
+                    for chunk in iter(lambda: member.read(HASH_CHUNK_SIZE), b''):
+                        digest.update(chunk)
+                digest.update(b'\0')
+        return digest.hexdigest()
+
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SnapshotCache:
+    """
+    历史记录快照缓存。retention 为 None 时使用默认的 SnapshotRetention()。
+    """
+    def __init__(self, cache_folder: Path, log_manager: LogManager,
+                 retention: Optional[SnapshotRetention] = None, legacy_snapshot_glob: Optional[str] = None):
+        self.cache_folder = cache_folder
+        self.log_manager = log_manager
+        self.retention = retention if retention is not None else SnapshotRetention()
+        self.legacy_snapshot_glob = legacy_snapshot_glob # 旧版按时间戳命名的快照，首次使用时导入并删除
+        self.manifest_path = cache_folder / SNAPSHOT_MANIFEST_FILE_NAME
+        self.blob_folder = cache_folder / SNAPSHOT_BLOB_FOLDER_NAME
+        self.opened_folder = cache_folder / SNAPSHOT_OPENED_FOLDER_NAME
+        self._lock = threading.Lock()
+
+    def _load_manifest(self) -> List[Dict[str, Any]]:
+        if not self.manifest_path.exists():
+            return []
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("snapshots", [])
+        except (OSError, ValueError) as e:
+            self.log_manager.write_log(f"Warning: Snapshot manifest {self.manifest_path} is unreadable, starting a new one. Error: {e}")
+            return []
+
+    def _save_manifest(self, snapshots: List[Dict[str, Any]]):
+        temp_path = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"snapshots": snapshots}, f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.manifest_path)
+
+    def _blob_path(self, digest: str, suffix: str) -> Path:
+        return self.blob_folder / digest[:2] / f"{digest}{suffix}"
+
+    def _make_entry(self, created: str, digest: str, blob_path: Path, size: int, source_path: Path) -> Dict[str, Any]:
+        return {
+            "created": created,
+            "digest": digest,
+            "blob": blob_path.relative_to(self.cache_folder).as_posix(),
+            "size": size,
+            "source": str(source_path),
+        }
+
+    def _import_legacy_snapshots(self, snapshots: List[Dict[str, Any]]) -> bool:
+        """
+        把旧版快照文件移入数据块目录（内容相同的只保留一份），返回清单是否有变动。
+        """
+        if not self.legacy_snapshot_glob:
+            return False
+        legacy_files = sorted(self.cache_folder.glob(self.legacy_snapshot_glob))
+        if not legacy_files:
+            return False
+
+        print(f"发现 {len(legacy_files)} 个旧版历史记录快照，正在导入快照缓存...")
+        imported: List[Dict[str, Any]] = []
+        for legacy_path in legacy_files:
+            try:
+                stem_parts = legacy_path.stem.rsplit("_", 2)
+                created = datetime.datetime.strptime("_".join(stem_parts[-2:]), LEGACY_SNAPSHOT_TIME_FORMAT)
+            except ValueError:
+                created = datetime.datetime.fromtimestamp(legacy_path.stat().st_mtime)
+            try:
+                digest = compute_snapshot_digest(legacy_path)
+                blob_path = self._blob_path(digest, legacy_path.suffix)
+                size = legacy_path.stat().st_size
+                if blob_path.exists():
+                    os.remove(legacy_path)
+                else:
+                    blob_path.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(legacy_path, blob_path)
+            except (OSError, zipfile.BadZipFile) as e:
+                self.log_manager.write_log(f"Warning: Could not import legacy snapshot {legacy_path}, keeping it. Error: {e}")
+                continue
+            imported.append(self._make_entry(created.strftime(SNAPSHOT_TIME_FORMAT), digest, blob_path, size, legacy_path))
+
+        # 旧快照都早于清单中的条目；连续相同的内容只保留第一次出现
+        imported.sort(key=lambda entry: entry["created"])
+        merged: List[Dict[str, Any]] = []
+        for entry in imported + snapshots:
+            if merged and merged[-1]["digest"] == entry["digest"]:
+                continue
+            merged.append(entry)
+        snapshots[:] = merged
+        return True
+
+    def _apply_retention(self, snapshots: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        从最新的快照往前保留，第一次超出任一限制时，更早的快照全部淘汰。最新快照始终保留。
+        """
+        keep_last = self.retention.keep_last
+        max_bytes = self.retention.max_bytes
+        max_age_days = self.retention.max_age_days
+        oldest_allowed = None
+        if max_age_days:
+            oldest_allowed = (datetime.datetime.now() - datetime.timedelta(days=max_age_days)).strftime(SNAPSHOT_TIME_FORMAT)
+
+        kept: List[Dict[str, Any]] = []
+        counted_blobs = set()
+        total_bytes = 0
+        for entry in reversed(snapshots):
+            extra_bytes = 0 if entry["blob"] in counted_blobs else entry.get("size", 0)
+            if kept:
+                if keep_last and len(kept) >= keep_last:
+                    break
+                if oldest_allowed and entry["created"] < oldest_allowed:
+                    break
+                if max_bytes and total_bytes + extra_bytes > max_bytes:
+                    break
+            kept.append(entry)
+            counted_blobs.add(entry["blob"])
+            total_bytes += extra_bytes
+        kept.reverse()
+        return kept
+
+    def _remove_unreferenced_blobs(self, snapshots: List[Dict[str, Any]]):
+        referenced = {entry["blob"] for entry in snapshots}
+        removed_count = 0
+        for blob_path in self.blob_folder.glob("*/*"):
+            if blob_path.relative_to(self.cache_folder).as_posix() in referenced:
+                continue
+            try:
+                os.remove(blob_path)
+                removed_count += 1
+            except OSError as e:
+                self.log_manager.write_log(f"Warning: Could not remove expired snapshot {blob_path}. Error: {e}")
+                continue
+            try:
+                blob_path.parent.rmdir() # 仅在分片目录已空时成功
+            except OSError:
+                pass
+        if removed_count:
+            self.log_manager.write_log(f"Removed {removed_count} expired history snapshot(s) from {self.blob_folder}")
+
+    def store(self, source_path: Path) -> Optional[Path]:
+        """
+        保存一份快照，返回数据块路径（内容未变化时返回已有快照）；失败返回 None。
+        """
+        with self._lock:
+            try:
+                self.cache_folder.mkdir(parents=True, exist_ok=True)
+                snapshots = self._load_manifest()
+                manifest_changed = self._import_legacy_snapshots(snapshots)
+
+                digest = compute_snapshot_digest(source_path)
+                blob_path = self._blob_path(digest, source_path.suffix)
+                if snapshots and snapshots[-1]["digest"] == digest and blob_path.exists():
+                    self.log_manager.write_log(f"History unchanged since last snapshot, skipped writing: {blob_path}")
+                else:
+                    if not blob_path.exists():
+                        blob_path.parent.mkdir(parents=True, exist_ok=True)
+                        temp_path = blob_path.with_name(blob_path.name + ".tmp")
+                        if not copy_file(source_path, temp_path, self.log_manager):
+                            return None
+                        os.replace(temp_path, blob_path)
+                    snapshots.append(self._make_entry(datetime.datetime.now().strftime(SNAPSHOT_TIME_FORMAT),
+                                                      digest, blob_path, blob_path.stat().st_size, source_path))
+                    manifest_changed = True
+                    self.log_manager.write_log(f"Stored history snapshot: {blob_path}")
+
+                if manifest_changed:
+                    kept = self._apply_retention(snapshots)
+                    self._save_manifest(kept)
+                    if len(kept) != len(snapshots):
+                        self._remove_unreferenced_blobs(kept)
+                return blob_path
+            except Exception as e:
+                self.log_manager.write_log(f"Error: Could not store history snapshot of {source_path}. Error: {e}")
+                print(f"错误: 无法保存历史记录快照 {source_path}。错误: {e}")
+                return None
+
+    def open_copy(self, blob_path: Path) -> Optional[Path]:
+        """
+        返回快照的独立副本供用户打开。数据块按内容共享，在 Excel 中修改它会同时改变所有引用它的快照，
+        因此只打开副本；同一内容复用已有副本，其他旧副本顺带删除（正在被打开的删除失败，忽略）。
+        """
+        with self._lock:
+            copy_path = self.opened_folder / f"{blob_path.stem[:12]}{blob_path.suffix}"
+            try:
+                self.opened_folder.mkdir(parents=True, exist_ok=True)
+                for old_copy_path in self.opened_folder.iterdir():
+                    if old_copy_path != copy_path:
+                        try:
+                            os.remove(old_copy_path)
+                        except OSError:
+                            pass
+                if copy_path.exists():
+                    return copy_path
+            except OSError as e:
+                self.log_manager.write_log(f"Error: Could not prepare snapshot copy folder {self.opened_folder}. Error: {e}")
+                return None
+            if not copy_file(blob_path, copy_path, self.log_manager):
+                return None
+            return copy_path
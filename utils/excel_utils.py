@@ -10,10 +10,10 @@ def create_main_workbook() -> Workbook:
     """
     return Workbook()
 
-def setup_excel_sheets() -> tuple[Workbook, Worksheet, Worksheet, Worksheet]:
+def setup_excel_sheets() -> tuple[Workbook, Worksheet, Worksheet, Worksheet, Worksheet]:
     """
-    设置Excel工作簿，创建所需的三个工作表并设置列头。
-    返回工作簿对象和三个工作表对象。
+    设置Excel工作簿，创建所需的四个工作表并设置列头。
+    返回工作簿对象和四个工作表对象。
     """
     wb = Workbook()
     ws_matched = wb.active
@@ -29,7 +29,9 @@ def setup_excel_sheets() -> tuple[Workbook, Worksheet, Worksheet, Worksheet]:
         '清洗后的数据',
         '清洗后的数据字数',
         '提示词类型',
-        '是否找到匹配TXT'
+        '是否找到匹配TXT',
+        '负向提示词',
+        '生成参数'
     ])
 
     ws_no_txt = wb.create_sheet("未匹配TXT文件", 1)
@@ -46,7 +48,13 @@ def setup_excel_sheets() -> tuple[Workbook, Worksheet, Worksheet, Worksheet]:
         'Tag',
         '出现次数'
     ])
-    return wb, ws_matched, ws_no_txt, ws_tag_frequency
+
+    ws_negative_tag_frequency = wb.create_sheet("负向 Tag 词频统计", 3)
+    ws_negative_tag_frequency.append([
+        'Tag',
+        '出现次数'
+    ])
+    return wb, ws_matched, ws_no_txt, ws_tag_frequency, ws_negative_tag_frequency
 
 def apply_hyperlink_style(ws: Worksheet, col_index: int):
     """
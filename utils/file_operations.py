@@ -48,20 +48,137 @@ def create_directory_if_not_exists(directory_path: Path, log_manager: Optional[L
             return False
     return True
 
-def copy_file(source_path: Path, destination_path: Path, log_manager: Optional[LogManager]) -> bool:
+# 发布策略名称（写入日志）
+PUBLISH_HARDLINK = "hardlink"
+PUBLISH_REFLINK = "reflink"
+PUBLISH_COPY_FILE_RANGE = "copy_file_range"
+PUBLISH_STREAMED_COPY = "streamed_copy"
+
+# Linux FICLONE ioctl (btrfs / xfs / bcachefs 等支持写时复制的文件系统)
+_FICLONE = 0x40049409
+
+
+def _replace_via_temp(destination_path: Path, create_temp) -> None:
     """
-    复制文件从源路径到目标路径。
+    先在目标目录生成临时文件，成功后再原子替换目标，失败时清理临时文件。
     """
+    temp_path = destination_path.with_name(f".{destination_path.name}.publish.tmp")
+    if temp_path.exists():
+        os.remove(temp_path)
     try:
-        shutil.copy2(str(source_path), str(destination_path)) # shutil.copy2 复制文件和元数据
-        if log_manager:
-            log_manager.write_log(f"Copied '{source_path}' to '{destination_path}'")
+        create_temp(temp_path)
+        os.replace(temp_path, destination_path)
+    except BaseException:
+        if temp_path.exists():
+            os.remove(temp_path)
+        raise
+
+
+def _try_hardlink(source_path: Path, destination_path: Path) -> bool:
+    """
+    同一文件系统上直接创建硬链接，不复制任何数据。
+    """
+    if not hasattr(os, "link"):
+        return False
+    try:
+        if os.stat(source_path).st_dev != os.stat(destination_path.parent).st_dev:
+            return False
+        if destination_path.exists() and os.path.samefile(source_path, destination_path):
+            return True # 已是同一文件的硬链接（rename 到同一 inode 不会生效，临时文件会残留）
+        _replace_via_temp(destination_path, lambda temp_path: os.link(source_path, temp_path))
+        return True
+    except OSError:
+        return False
+
+
+def _try_reflink(source_path: Path, destination_path: Path) -> bool:
+    """
+    写时复制克隆 (FICLONE)：数据块共享，任一方修改时才真正复制，目前仅 Linux 可用。
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    def _clone(temp_path: Path):
+        with open(source_path, 'rb') as src, open(temp_path, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+    try:
+        _replace_via_temp(destination_path, _clone)
+        shutil.copystat(str(source_path), str(destination_path))
+        return True
+    except OSError:
+        return False
+
+
+def _try_copy_file_range(source_path: Path, destination_path: Path) -> bool:
+    """
+    使用 copy_file_range 在内核中复制；在 NFS/SMB 等支持服务端复制的文件系统上不经过本机网络传输。
+    """
+    if not hasattr(os, "copy_file_range"):
+        return False
+
+    def _copy_range(temp_path: Path):
+        with open(source_path, 'rb') as src, open(temp_path, 'wb') as dst:
+            remaining = os.fstat(src.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                if copied == 0:
+                    raise OSError("copy_file_range returned 0 before end of file")
+                remaining -= copied
+
+    try:
+        _replace_via_temp(destination_path, _copy_range)
+        shutil.copystat(str(source_path), str(destination_path))
         return True
+    except OSError:
+        return False
+
+
+def publish_file(source_path: Path, destination_path: Path, log_manager: Optional[LogManager],
+                 allow_hardlink: bool = True) -> Optional[str]:
+    """
+    将文件发布到目标路径，按开销从低到高依次尝试：
+    硬链接（同一文件系统） -> reflink 写时复制 -> copy_file_range -> 流式复制 (shutil.copy2)。
+    Args:
+        source_path (Path): 源文件路径。
+        destination_path (Path): 目标文件路径，已存在时会被替换。
+        log_manager (Optional[LogManager]): 日志管理器实例，可选。
+        allow_hardlink (bool): 源文件之后若会被原地改写（例如历史记录文件），必须传 False，
+            否则目标文件会随源文件一起变化。
+    Returns:
+        Optional[str]: 实际使用的策略名称；全部失败时返回 None。
+    """
+    strategies = []
+    if allow_hardlink:
+        strategies.append((PUBLISH_HARDLINK, _try_hardlink))
+    strategies.append((PUBLISH_REFLINK, _try_reflink))
+    strategies.append((PUBLISH_COPY_FILE_RANGE, _try_copy_file_range))
+
+    try:
+        for strategy_name, strategy in strategies:
+            if strategy(source_path, destination_path):
+                break
+        else:
+            strategy_name = PUBLISH_STREAMED_COPY
+            shutil.copy2(str(source_path), str(destination_path)) # shutil.copy2 复制文件和元数据
+        if log_manager:
+            log_manager.write_log(f"Published '{source_path}' to '{destination_path}' via {strategy_name}")
+        return strategy_name
     except Exception as e:
         if log_manager:
             log_manager.write_log(f"Error copying file from '{source_path}' to '{destination_path}': {e}")
         print(f"错误: 无法复制文件从 '{source_path}' 到 '{destination_path}'。错误: {e}")
-        return False
+        return None
+
+
+def copy_file(source_path: Path, destination_path: Path, log_manager: Optional[LogManager]) -> bool:
+    """
+    复制文件从源路径到目标路径。
+    目标始终是独立的副本（不使用硬链接），但会优先使用 reflink / copy_file_range 避免重复传输数据。
+    """
+    return publish_file(source_path, destination_path, log_manager, allow_hardlink=False) is not None
 
 def get_file_details(file_path: Path) -> tuple[str, str]:
     """
@@ -0,0 +1,68 @@
+# utils/prompt_parser.py
+"""
+正向/负向提示词拆分。
+
+支持 A1111 (stable-diffusion-webui) 风格的参数导出：
+    正向提示词（可多行）
+    Negative prompt: 负向提示词（可多行）
+    Steps: 20, Sampler: Euler a, CFG scale: 7, Seed: 1234, Size: 512x768, ...
+普通的单行/多行反推Tag文件没有这些标记，全部内容都是正向提示词。
+
+按行单遍扫描，每行只做一次前缀判断（不使用可能回溯的正则），单个文件的开销与内容长度成正比。
+"""
+from dataclasses import dataclass
+from typing import FrozenSet, List
+
+# --- Configuration ---
+NEGATIVE_PROMPT_MARKER = "negative prompt:"
+# 以这些键开头 ("键: 值") 的行被视为参数行，参数段一直持续到文件末尾
+PARAMETER_TRAILER_KEYS: FrozenSet[str] = frozenset({
+    'steps', 'sampler', 'schedule type', 'cfg scale', 'seed', 'size', 'model', 'model hash',
+    'vae', 'vae hash', 'denoising strength', 'clip skip', 'ensd', 'hires upscale', 'hires steps',
+    'hires upscaler', 'variation seed', 'variation seed strength', 'lora hashes', 'ti hashes', 'version',
+})
+
+
+@dataclass
+class PromptParts:
+    """
+    拆分后的提示词，各部分保留原有的行结构（换行符连接）。
+    """
+    positive: str = ""
+    negative: str = ""
+    parameters: str = ""
+
+
+def _is_parameter_line(line: str) -> bool:
+    key, separator, _ = line.partition(':')
+    return bool(separator) and key.strip().lower() in PARAMETER_TRAILER_KEYS
+
+
+def split_prompt(text: str) -> PromptParts:
+    """
+    把反推/生成文本拆分为正向提示词、负向提示词和生成参数。
+    Args:
+        text (str): TXT内容（txt_reader 读取后的多行文本）。
+    Returns:
+        PromptParts: 拆分结果；没有负向提示词或参数时对应部分为空字符串。
+    """
+    if not text:
+        return PromptParts()
+
+    sections: List[List[str]] = [[], [], []] # 正向、负向、参数
+    section_index = 0
+    marker_length = len(NEGATIVE_PROMPT_MARKER)
+    for line in text.split('\n'):
+        if section_index < 2:
+            if section_index == 0 and line[:marker_length].lower() == NEGATIVE_PROMPT_MARKER:
+                section_index = 1
+                line = line[marker_length:].strip()
+                if not line:
+                    continue
+            elif _is_parameter_line(line):
+                section_index = 2
+        sections[section_index].append(line)
+
+    return PromptParts(positive='\n'.join(sections[0]),
+                       negative='\n'.join(sections[1]),
+                       parameters='\n'.join(sections[2]))
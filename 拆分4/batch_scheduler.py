@@ -0,0 +1,175 @@
+# batch_scheduler.py
+"""
+批量任务调度：根据历史记录估算每个文件夹的扫描耗时，按设备 (st_dev) 分组。
+不同设备上的文件夹并发处理，同一设备上的文件夹顺序处理（避免同一块磁盘上的随机I/O互相争抢），
+每组内部以及组与组之间都按“耗时最长优先”排列，使最大的共享盘尽早开始，不再决定整个批次的结束时间。
+"""
+import os
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Callable
+
+from file_system_utils import normalize_drive_letter
+
+# --- Configuration ---
+DEFAULT_MAX_PARALLEL_DEVICES = 4
+DEFAULT_SECONDS_PER_FILE = 0.005   # 历史记录中没有任何耗时数据时使用的经验值
+QUICK_COUNT_ENTRY_LIMIT = 200000   # 快速目录计数最多统计的条目数，超出即视为足够大
+
+
+@dataclass
+class FolderCost:
+    """
+    单个文件夹的调度信息。
+    """
+    folder_path: Path
+    estimated_seconds: float
+    device_id: int
+    estimate_source: str
+
+
+@dataclass
+class DeviceGroup:
+    """
+    同一设备上需要顺序处理的文件夹。
+    """
+    device_id: int
+    folders: List[FolderCost] = field(default_factory=list)
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(fc.estimated_seconds for fc in self.folders)
+
+
+def _history_path_key(value: Any) -> Optional[str]:
+    """
+    将历史记录中的路径（可能是 Path、普通字符串或 file:// 超链接形式）统一为可比较的键。
+    """
+    if not value:
+        return None
+    path_str = str(value)
+    if path_str.startswith("file://"):
+        path_str = path_str[len("file://"):]
+    elif path_str.startswith("file:"):
+        path_str = path_str[len("file:"):]
+    return os.path.normcase(os.path.normpath(normalize_drive_letter(path_str)))
+
+
+def _as_number(value: Any) -> Optional[float]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number >= 0 else None
+
+
+def _quick_entry_count(folder_path: Path, limit: int = QUICK_COUNT_ENTRY_LIMIT) -> int:
+    """
+    只用 os.scandir 统计目录条目数（不读取任何文件内容），达到上限即停止。
+    """
+    count = 0
+    stack = [str(folder_path)]
+    while stack and count < limit:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    count += 1
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return count
+
+
+def estimate_folder_costs(folders: List[Path], history_data: List[Dict[str, Any]], logger_obj) -> List[FolderCost]:
+    """
+    估算每个文件夹的耗时。
+    优先级：
+        1. 历史记录中该文件夹最近一次的扫描耗时。
+        2. 历史记录中该文件夹最近一次的总文件数 × 历史平均每文件耗时。
+        3. 快速目录计数 × 历史平均每文件耗时。
+    Args:
+        folders (List[Path]): 待处理的文件夹。
+        history_data (List[Dict[str, Any]]): HistoryManager.history_data。
+        logger_obj: 日志管理器实例。
+    Returns:
+        List[FolderCost]: 与 folders 顺序相同的估算结果。
+    """
+    latest_entry_by_folder: Dict[str, Dict[str, Any]] = {}
+    total_seconds = 0.0
+    total_files = 0.0
+    for entry in history_data:
+        key = _history_path_key(entry.get("folder_path"))
+        if key:
+            latest_entry_by_folder[key] = entry # 后出现的条目更新，覆盖旧条目
+        duration = _as_number(entry.get("scan_duration_seconds"))
+        files = _as_number(entry.get("total_files"))
+        if duration and files:
+            total_seconds += duration
+            total_files += files
+    seconds_per_file = total_seconds / total_files if total_files else DEFAULT_SECONDS_PER_FILE
+
+    costs: List[FolderCost] = []
+    for folder_path in folders:
+        try:
+            device_id = os.stat(folder_path).st_dev
+        except OSError:
+            device_id = -1
+
+        entry = latest_entry_by_folder.get(_history_path_key(folder_path), {})
+        duration = _as_number(entry.get("scan_duration_seconds"))
+        files = _as_number(entry.get("total_files"))
+        if duration is not None:
+            cost = FolderCost(folder_path, duration, device_id, "历史耗时")
+        elif files is not None:
+            cost = FolderCost(folder_path, files * seconds_per_file, device_id, "历史文件数")
+        else:
+            cost = FolderCost(folder_path, _quick_entry_count(folder_path) * seconds_per_file, device_id, "目录计数")
+        logger_obj.info(
+            f"调度估算: '{normalize_drive_letter(str(folder_path))}' 约 {cost.estimated_seconds:.1f} 秒 "
+            f"(依据: {cost.estimate_source}, 设备: {cost.device_id})"
+        )
+        costs.append(cost)
+    return costs
+
+
+def build_device_groups(costs: List[FolderCost]) -> List[DeviceGroup]:
+    """
+    按设备分组，组内按耗时降序；组之间按总耗时降序（最长处理时间优先）。
+    """
+    groups: Dict[int, DeviceGroup] = {}
+    for cost in costs:
+        groups.setdefault(cost.device_id, DeviceGroup(cost.device_id)).folders.append(cost)
+    for group in groups.values():
+        group.folders.sort(key=lambda fc: fc.estimated_seconds, reverse=True)
+    return sorted(groups.values(), key=lambda g: g.total_seconds, reverse=True)
+
+
+def run_device_groups(groups: List[DeviceGroup], process_folder: Callable[[Path], Any],
+                      logger_obj, max_parallel_devices: int = DEFAULT_MAX_PARALLEL_DEVICES):
+    """
+    每个设备组由一个工作线程顺序处理；最多 max_parallel_devices 个设备同时进行。
+    process_folder 内部的异常会被记录，但不会影响其他文件夹。
+    """
+    def _run_group(group: DeviceGroup):
+        for cost in group.folders:
+            try:
+                process_folder(cost.folder_path)
+            except Exception as e:
+                logger_obj.error(f"处理文件夹 {normalize_drive_letter(str(cost.folder_path))} 时发生未捕获的错误: {e}")
+
+    if not groups:
+        return
+    worker_count = max(1, min(max_parallel_devices, len(groups)))
+    logger_obj.info(f"批量调度: {sum(len(g.folders) for g in groups)} 个文件夹分布在 {len(groups)} 个设备上，并发设备数 {worker_count}。")
+    if worker_count == 1:
+        for group in groups:
+            _run_group(group)
+        return
+    with ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="scan-device") as executor:
+        for future in [executor.submit(_run_group, group) for group in groups]:
+            future.result()
@@ -0,0 +1,122 @@
+# caption_grep.py
+"""
+无索引的并行反推文本搜索 (grep)。
+
+不生成任何工作簿、不写扫描目录：按扫描器相同的遍历和跳过规则 (SKIP_SCAN_FOLDERS 等) 收集 TXT 文件，
+分块交给线程池并行读取，直接在字节上匹配字面量或正则表达式，匹配结果以“图片路径<TAB>TXT路径”逐行流式输出。
+
+- 按字节匹配，不做解码；模式包含非ASCII字符时同时匹配其 UTF-8 和 GBK 编码
+  （与 TxtMetadataProcessor 的 utf-8 -> gbk 回退顺序一致）。
+- 图片与TXT的配对规则与扫描器一致：文件名 (stem) 相同，不区分大小写。
+- 与扫描器相同，每个TXT最多读取 TXT_MAX_READ_BYTES 字节，超大的损坏文件不会被整个读入内存。
+"""
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from file_system_utils import normalize_drive_letter, validate_directory
+from scanner import Scanner, ScannerConstants
+from txt_reader import TXT_MAX_READ_BYTES
+
+# --- Configuration ---
+DEFAULT_GREP_WORKERS = min(32, (os.cpu_count() or 1) * 4) # 网络共享上以I/O等待为主，线程数可以多于CPU核数
+GREP_CHUNK_SIZE = 256                                     # 每个任务读取的TXT文件数
+
+
+def compile_matcher(pattern: str, use_regex: bool = False, ignore_case: bool = False) -> Callable[[bytes], bool]:
+    """
+    把模式编译为字节匹配函数。
+    """
+    encoded_patterns = [pattern.encode('utf-8')]
+    if not pattern.isascii():
+        try:
+            gbk_pattern = pattern.encode('gbk')
+            if gbk_pattern != encoded_patterns[0]:
+                encoded_patterns.append(gbk_pattern)
+        except UnicodeEncodeError:
+            pass
+
+    if not use_regex and not ignore_case:
+        if len(encoded_patterns) == 1:
+            needle = encoded_patterns[0]
+            return lambda data: needle in data
+        return lambda data: any(needle in data for needle in encoded_patterns)
+
+    flags = re.IGNORECASE if ignore_case else 0
+    sources = encoded_patterns if use_regex else [re.escape(p) for p in encoded_patterns]
+    compiled = re.compile(b"|".join(b"(?:" + source + b")" for source in sources), flags)
+    return lambda data: compiled.search(data) is not None
+
+
+def _grep_chunk(txt_paths: List[Path], matcher: Callable[[bytes], bool]) -> Tuple[List[Path], List[Tuple[Path, str]]]:
+    """
+    读取并匹配一组TXT文件。
+    Returns:
+        Tuple[List[Path], List[Tuple[Path, str]]]: (匹配的TXT文件, 读取失败的文件及原因)
+    """
+    matched: List[Path] = []
+    failed: List[Tuple[Path, str]] = []
+    for txt_path in txt_paths:
+        try:
+            with open(txt_path, 'rb') as f:
+                data = f.read(TXT_MAX_READ_BYTES)
+        except OSError as e:
+            failed.append((txt_path, str(e)))
+            continue
+        if matcher(data):
+            matched.append(txt_path)
+    return matched, failed
+
+
+def grep_captions(folders: List[Path], matcher: Callable[[bytes], bool], logger_obj,
+                  workers: int = DEFAULT_GREP_WORKERS) -> Iterator[Tuple[List[Path], Path]]:
+    """
+    在多个文件夹中搜索TXT文件，按文件夹和遍历顺序逐个产出匹配结果。
+    Yields:
+        Tuple[List[Path], Path]: (与该TXT同名的图片列表（可能为空）, TXT路径)
+    """
+    scanner = Scanner(logger_obj=logger_obj, data_writer=None)
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="caption-grep") as executor:
+        for folder_path in folders:
+            files_to_scan, txt_files = scanner.collect_files(folder_path)
+            images_by_stem: Dict[str, List[Path]] = {}
+            for file_path in files_to_scan:
+                images_by_stem.setdefault(file_path.stem.lower(), []).append(file_path)
+
+            chunks = [txt_files[i:i + GREP_CHUNK_SIZE] for i in range(0, len(txt_files), GREP_CHUNK_SIZE)]
+            # executor.map 会立即提交所有分块，但按提交顺序返回结果，先完成的分块可以先输出
+            for matched, failed in executor.map(_grep_chunk, chunks, [matcher] * len(chunks)):
+                for txt_path, reason in failed:
+                    logger_obj.warning(f"读取TXT文件 {normalize_drive_letter(str(txt_path))} 失败: {reason}")
+                for txt_path in matched:
+                    yield images_by_stem.get(txt_path.stem.lower(), []), txt_path
+
+
+def run_caption_grep(folders: List[Path], pattern: str, logger_obj, use_regex: bool = False,
+                     ignore_case: bool = False, workers: int = DEFAULT_GREP_WORKERS) -> int:
+    """
+    命令行入口：每个匹配输出一行“图片路径<TAB>TXT路径”（没有同名图片时图片路径为 N/A）。
+    退出码与 grep 相同：0 有匹配，1 无匹配，2 参数错误。
+    """
+    valid_folders = [folder_path for folder_path in folders if validate_directory(folder_path, logger_obj)]
+    if not valid_folders:
+        print("错误: 没有可搜索的有效文件夹。", file=sys.stderr)
+        return 2
+    try:
+        matcher = compile_matcher(pattern, use_regex, ignore_case)
+    except re.error as e:
+        print(f"错误: 正则表达式无效: {e}", file=sys.stderr)
+        return 2
+
+    match_count = 0
+    for image_paths, txt_path in grep_captions(valid_folders, matcher, logger_obj, workers):
+        txt_display = normalize_drive_letter(str(txt_path))
+        for image_path in image_paths or [None]:
+            image_display = normalize_drive_letter(str(image_path)) if image_path else ScannerConstants.FileStatus.PROMPT_TYPE_NA.value
+            print(f"{image_display}\t{txt_display}", flush=True)
+        match_count += 1
+    print(f"共 {match_count} 个TXT文件匹配。", file=sys.stderr)
+    return 0 if match_count else 1
@@ -0,0 +1,139 @@
+# caption_search.py
+"""
+反推文本全文检索 (SQLite FTS5)。
+
+caption_fts 是扫描目录 files 表的外部内容 (external content) FTS5 索引，覆盖原始TXT内容和清洗后的内容，
+由 files 表上的触发器维护：扫描器每批 upsert 的行在同一个事务中同步写入索引，无需单独的建索引步骤；
+内容未变化的行在重新扫描时不会被重新索引。
+
+- SQLite >= 3.34 使用 trigram 分词器：支持任意子串（包括部分Tag名和中文）检索，查询词至少3个字符。
+- 更早的版本退回 unicode61 分词器（下划线视为单词的一部分），支持词、短语和前缀 (red_*) 检索。
+- SQLite 未编译 FTS5 时全文检索不可用，扫描目录其他功能不受影响。
+"""
+import sys
+import time
+import sqlite3
+from pathlib import Path
+from typing import List, Tuple
+
+# --- Configuration ---
+CAPTION_FTS_TABLE_NAME = "caption_fts"
+TRIGRAM_MIN_SQLITE_VERSION = (3, 34, 0)
+SNIPPET_TOKEN_COUNT = 48          # trigram 分词时每个“词”只有一个字符，窗口需要大一些 (上限 64)
+DEFAULT_SEARCH_LIMIT = 20
+
+_TRIGGER_STATEMENTS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS files_caption_fts_insert AFTER INSERT ON files BEGIN
+        INSERT INTO caption_fts (rowid, txt_content, cleaned_data) VALUES (new.file_id, new.txt_content, new.cleaned_data);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS files_caption_fts_delete AFTER DELETE ON files BEGIN
+        INSERT INTO caption_fts (caption_fts, rowid, txt_content, cleaned_data)
+        VALUES ('delete', old.file_id, old.txt_content, old.cleaned_data);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS files_caption_fts_update AFTER UPDATE OF txt_content, cleaned_data ON files
+    WHEN old.txt_content IS NOT new.txt_content OR old.cleaned_data IS NOT new.cleaned_data BEGIN
+        INSERT INTO caption_fts (caption_fts, rowid, txt_content, cleaned_data)
+        VALUES ('delete', old.file_id, old.txt_content, old.cleaned_data);
+        INSERT INTO caption_fts (rowid, txt_content, cleaned_data) VALUES (new.file_id, new.txt_content, new.cleaned_data);
+    END
+    """,
+)
+
+
+def _fts_tokenizer() -> str:
+    if sqlite3.sqlite_version_info >= TRIGRAM_MIN_SQLITE_VERSION:
+        return "trigram"
+    return "unicode61 tokenchars '_'"
+
+
+def ensure_caption_fts(connection: sqlite3.Connection, logger_obj) -> bool:
+    """
+    创建全文索引和同步触发器（已存在则跳过）。首次创建时用 files 表中已有的行填充索引。调用方负责事务。
+    Returns:
+        bool: 全文索引可用返回True；SQLite 不支持 FTS5 时返回False。
+    """
+    exists = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (CAPTION_FTS_TABLE_NAME,)).fetchone()
+    if not exists:
+        try:
+            connection.execute(
+                f"CREATE VIRTUAL TABLE {CAPTION_FTS_TABLE_NAME} USING fts5("
+                f"txt_content, cleaned_data, content='files', content_rowid='file_id', tokenize=\"{_fts_tokenizer()}\")")
+        except sqlite3.OperationalError as e:
+            logger_obj.warning(f"当前 SQLite 不支持 FTS5，全文检索不可用: {e}")
+            return False
+        connection.execute(f"INSERT INTO {CAPTION_FTS_TABLE_NAME} ({CAPTION_FTS_TABLE_NAME}) VALUES ('rebuild')")
+        logger_obj.info(f"已创建反推文本全文索引 (分词器: {_fts_tokenizer()})。")
+    for statement in _TRIGGER_STATEMENTS:
+        connection.execute(statement)
+    return True
+
+
+def _quote_as_phrase(query: str) -> str:
+    return '"' + query.replace('"', '""') + '"'
+
+
+class CaptionSearch:
+    """
+    只读的全文检索接口。
+    """
+    def __init__(self, db_path: Path):
+        if not db_path.exists():
+            raise FileNotFoundError(f"扫描目录数据库不存在: {db_path}")
+        self.connection = sqlite3.connect(f"{db_path.resolve().as_uri()}?mode=ro", uri=True)
+
+    def close(self):
+        self.connection.close()
+
+    def search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> List[Tuple[float, str, str, str]]:
+        """
+        按 bm25 相关度排序检索。query 使用 FTS5 查询语法（短语、AND/OR/NOT、前缀）；
+        语法无效时（例如包含 - 或 : 等符号）按整体短语重新检索。
+        Returns:
+            List[Tuple[float, str, str, str]]: (相关度得分, 图片路径, TXT路径, 摘要)，得分越小越相关。
+        """
+        sql = (
+            f"SELECT bm25({CAPTION_FTS_TABLE_NAME}), files.file_path, files.txt_path, "
+            f"snippet({CAPTION_FTS_TABLE_NAME}, -1, '[', ']', '…', {SNIPPET_TOKEN_COUNT}) "
+            f"FROM {CAPTION_FTS_TABLE_NAME} JOIN files ON files.file_id = {CAPTION_FTS_TABLE_NAME}.rowid "
+            f"WHERE {CAPTION_FTS_TABLE_NAME} MATCH ? ORDER BY bm25({CAPTION_FTS_TABLE_NAME})"
+        )
+        params: Tuple = (query,)
+        if limit > 0:
+            sql += " LIMIT ?"
+            params += (limit,)
+        try:
+            return self.connection.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            if "syntax error" not in str(e) and "no such column" not in str(e):
+                raise
+            return self.connection.execute(sql, (_quote_as_phrase(query),) + params[1:]).fetchall()
+
+
+def run_caption_search(db_path: Path, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> int:
+    """
+    命令行检索入口：按相关度打印 图片路径、TXT路径和摘要，返回进程退出码。
+    """
+    try:
+        caption_search = CaptionSearch(db_path)
+    except (FileNotFoundError, sqlite3.Error) as e:
+        print(f"错误: 无法打开扫描目录数据库: {e}", file=sys.stderr)
+        return 1
+    try:
+        start_time = time.perf_counter()
+        results = caption_search.search(query, limit)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        for score, file_path, txt_path, snippet_text in results:
+            print(f"{score:.2f}\t{file_path}\t{txt_path or ''}\t{' '.join(snippet_text.split())}")
+        print(f"共显示 {len(results)} 条结果 (检索耗时 {elapsed_ms:.1f} ms)", file=sys.stderr)
+        return 0
+    except sqlite3.Error as e:
+        print(f"错误: 全文检索失败: {e}", file=sys.stderr)
+        return 1
+    finally:
+        caption_search.close()
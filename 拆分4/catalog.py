@@ -0,0 +1,253 @@
+# catalog.py
+"""
+全局扫描目录 (SQLite)。
+
+所有文件夹的扫描结果（每个 ProcessedFileData 一行）写入同一个 SQLite 数据库，
+按文件绝对路径 upsert，重复扫描同一文件夹只会更新已有行；
+文件夹扫描完成后，删除本次扫描中已不存在的文件对应的行，并重建该文件夹的 Tag 倒排列表 (见 tag_index.py)。
+反推文本的全文索引由触发器随每批写入同步更新 (见 caption_search.py)。
+
+- 数据库使用 WAL 模式，查询不会被正在进行的写入阻塞。
+- 行先在内存中缓冲，每 batch_size 行在一个事务中批量写入。
+- 批量调度器可能在多个线程中同时写入，所有数据库操作共用一个连接并加锁。
+"""
+import sqlite3
+import datetime
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple, Any
+
+from file_system_utils import normalize_drive_letter
+from scanner import ScannerConstants, ProcessedFileData, DataWriter
+from tag_index import TAG_INDEX_SCHEMA_STATEMENTS, rebuild_folder_postings
+from caption_search import ensure_caption_fts
+
+# --- Configuration ---
+CATALOG_FILE_NAME = "scan_catalog.db"
+DEFAULT_CATALOG_BATCH_SIZE = 1000
+SQLITE_BUSY_TIMEOUT_SECONDS = 30.0
+CATALOG_SCHEMA_VERSION = 2 # 行的内容或表结构变化时递增，文件夹指纹据此判断旧的目录记录是否仍可复用
+
+_SCHEMA_STATEMENTS = (
+    """
+    CREATE TABLE IF NOT EXISTS files (
+        file_id             INTEGER PRIMARY KEY,
+        file_path           TEXT NOT NULL UNIQUE,
+        scan_folder         TEXT NOT NULL,
+        root_path           TEXT NOT NULL,
+        file_name           TEXT NOT NULL,
+        file_extension      TEXT NOT NULL,
+        txt_path            TEXT,
+        txt_content         TEXT,
+        cleaned_data        TEXT,
+        cleaned_data_length INTEGER NOT NULL DEFAULT 0,
+        prompt_type         TEXT,
+        negative_prompt     TEXT,
+        generation_parameters TEXT,
+        found_txt_flag      TEXT NOT NULL,
+        is_matched          INTEGER NOT NULL,
+        error_count         INTEGER NOT NULL DEFAULT 0,
+        scan_token          TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_files_scan_folder ON files (scan_folder)",
+    "CREATE INDEX IF NOT EXISTS idx_files_root_path ON files (root_path)",
+    "CREATE INDEX IF NOT EXISTS idx_files_extension ON files (file_extension)",
+    "CREATE INDEX IF NOT EXISTS idx_files_prompt_type ON files (prompt_type)",
+    "CREATE INDEX IF NOT EXISTS idx_files_is_matched ON files (is_matched)",
+    """
+    CREATE TABLE IF NOT EXISTS scan_folders (
+        scan_folder         TEXT PRIMARY KEY,
+        last_scan_time      TEXT NOT NULL,
+        total_files         INTEGER NOT NULL,
+        found_txt_count     INTEGER NOT NULL,
+        not_found_txt_count INTEGER NOT NULL
+    )
+    """,
+)
+
+# 旧版数据库中 files 表缺少的列，打开时补上 (列名, 类型)
+_ADDED_FILE_COLUMNS = (
+    ("negative_prompt", "TEXT"),
+    ("generation_parameters", "TEXT"),
+)
+
+_UPSERT_FILE_SQL = """
+    INSERT INTO files (file_path, scan_folder, root_path, file_name, file_extension, txt_path, txt_content,
+                       cleaned_data, cleaned_data_length, prompt_type, negative_prompt, generation_parameters,
+                       found_txt_flag, is_matched, error_count, scan_token)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(file_path) DO UPDATE SET
+        scan_folder = excluded.scan_folder,
+        root_path = excluded.root_path,
+        file_name = excluded.file_name,
+        file_extension = excluded.file_extension,
+        txt_path = excluded.txt_path,
+        txt_content = excluded.txt_content,
+        cleaned_data = excluded.cleaned_data,
+        cleaned_data_length = excluded.cleaned_data_length,
+        prompt_type = excluded.prompt_type,
+        negative_prompt = excluded.negative_prompt,
+        generation_parameters = excluded.generation_parameters,
+        found_txt_flag = excluded.found_txt_flag,
+        is_matched = excluded.is_matched,
+        error_count = excluded.error_count,
+        scan_token = excluded.scan_token
+"""
+
+
+def catalog_folder_key(folder_path: Path) -> str:
+    """
+    目录中记录扫描根文件夹使用的键，与行中的文件路径一样使用解析后的绝对路径。
+    """
+    return normalize_drive_letter(str(folder_path.resolve()))
+
+
+class ScanCatalog:
+    """
+    SQLite 扫描目录。
+    """
+    def __init__(self, db_path: Path, logger_obj):
+        self.db_path = db_path
+        self.logger_obj = logger_obj
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(db_path), timeout=SQLITE_BUSY_TIMEOUT_SECONDS,
+                                           check_same_thread=False)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL") # WAL 下 NORMAL 已可保证一致性，只是断电时可能丢失最后一个事务
+            with self._connection:
+                for statement in _SCHEMA_STATEMENTS + TAG_INDEX_SCHEMA_STATEMENTS:
+                    self._connection.execute(statement)
+                self._add_missing_columns()
+                self.full_text_enabled = ensure_caption_fts(self._connection, logger_obj)
+        self.logger_obj.info(f"扫描目录数据库: {normalize_drive_letter(str(db_path))}")
+
+    def _add_missing_columns(self):
+        existing_columns = {row[1] for row in self._connection.execute("PRAGMA table_info(files)")}
+        for column_name, column_type in _ADDED_FILE_COLUMNS:
+            if column_name not in existing_columns:
+                self._connection.execute(f"ALTER TABLE files ADD COLUMN {column_name} {column_type}")
+
+    def upsert_rows(self, rows: List[Tuple[Any, ...]]):
+        """
+        在一个事务中批量写入行。
+        """
+        if not rows:
+            return
+        with self._lock, self._connection:
+            self._connection.executemany(_UPSERT_FILE_SQL, rows)
+
+    def finish_folder(self, scan_folder: str, scan_token: str, total_files: int,
+                      found_txt_count: int, not_found_txt_count: int, prune: bool = True) -> int:
+        """
+        文件夹扫描结束后调用：删除本次扫描未再出现的文件（prune 为 False 时保留），
+        更新文件夹汇总并重建该文件夹的 Tag 倒排列表。
+        Returns:
+            int: 删除的过期行数。
+        """
+        removed_count = 0
+        with self._lock, self._connection:
+            if prune:
+                removed_count = self._connection.execute(
+                    "DELETE FROM files WHERE scan_folder = ? AND scan_token <> ?", (scan_folder, scan_token)).rowcount
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO scan_folders VALUES (?, ?, ?, ?, ?)",
+                    (scan_folder, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                     total_files, found_txt_count, not_found_txt_count))
+            rebuild_folder_postings(self._connection, scan_folder)
+        if removed_count:
+            self.logger_obj.info(f"扫描目录: 已删除 '{scan_folder}' 中 {removed_count} 个不再存在的文件记录。")
+        return removed_count
+
+    def folder_summary(self, scan_folder: str) -> Optional[Tuple[int, int, int]]:
+        """
+        文件夹最近一次完整扫描的 (总文件数, 找到TXT文件数, 未找到TXT文件数)；目录中没有该文件夹时返回 None。
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT total_files, found_txt_count, not_found_txt_count FROM scan_folders WHERE scan_folder = ?",
+                (scan_folder,)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class CatalogDataWriter:
+    """
+    DataWriter 实现：把每一行缓冲后批量写入 ScanCatalog。
+    可以串联下一个 DataWriter（例如 ExcelDataWriter），同一行同时写入两处；不串联时不生成Excel。
+    """
+    def __init__(self, catalog: ScanCatalog, scan_folder: str, scan_token: str, logger_obj,
+                 next_writer: Optional[DataWriter] = None, batch_size: int = DEFAULT_CATALOG_BATCH_SIZE):
+        """
+        Args:
+            catalog (ScanCatalog): 目标数据库。
+            logger_obj: 日志管理器实例（文件夹专属的 logger）。
+            scan_folder (str): 扫描根文件夹的键 (catalog_folder_key)。
+            scan_token (str): 本次扫描的标识，finish_folder 据此删除未再出现的文件。
+            next_writer (Optional[DataWriter]): 同时写入的下一个数据写入器。
+            batch_size (int): 每批写入的行数。
+        """
+        self.catalog = catalog
+        self.scan_folder = scan_folder
+        self.scan_token = scan_token
+        self.logger_obj = logger_obj
+        self.next_writer = next_writer
+        self.batch_size = max(1, batch_size)
+        self._pending_rows: List[Tuple[Any, ...]] = []
+
+    def _add_row(self, processed_data: ProcessedFileData, is_matched: bool):
+        if processed_data.processing_errors and self.next_writer is None:
+            # 有下一个写入器时由它记录错误，避免同一错误记录两次
+            full_error_message = "; ".join([f"{err.error_type}: {err.message}" for err in processed_data.processing_errors])
+            self.logger_obj.warning(f"文件 '{normalize_drive_letter(processed_data.file_absolute_path)}' 处理中遇到错误：{full_error_message}")
+        file_path = processed_data.file_absolute_path
+        self._pending_rows.append((
+            file_path,
+            self.scan_folder,
+            processed_data.root_resolved_path,
+            Path(file_path).name,
+            processed_data.file_extension.lower(),
+            None if processed_data.txt_absolute_path == ScannerConstants.FileStatus.PROMPT_TYPE_NA.value else processed_data.txt_absolute_path,
+            processed_data.txt_content,
+            processed_data.cleaned_data,
+            processed_data.cleaned_data_length,
+            processed_data.prompt_type,
+            processed_data.negative_prompt,
+            processed_data.generation_parameters,
+            processed_data.found_txt_flag,
+            1 if is_matched else 0,
+            len(processed_data.processing_errors),
+            self.scan_token,
+        ))
+        if len(self._pending_rows) >= self.batch_size:
+            self.flush()
+
+    def write_matched_data(self, processed_data: ProcessedFileData):
+        self._add_row(processed_data, True)
+        if self.next_writer is not None:
+            self.next_writer.write_matched_data(processed_data)
+
+    def write_no_txt_data(self, processed_data: ProcessedFileData):
+        self._add_row(processed_data, False)
+        if self.next_writer is not None:
+            self.next_writer.write_no_txt_data(processed_data)
+
+    def flush(self):
+        rows, self._pending_rows = self._pending_rows, []
+        self.catalog.upsert_rows(rows)
+
+    def finish(self, total_files: int, found_txt_count: int, not_found_txt_count: int):
+        """
+        写入剩余的行并完成该文件夹在目录中的更新。
+        扫描中途出错（处理的行数少于文件总数）时只写入已有的行，不删除旧记录，避免误删未扫描到的文件。
+        """
+        self.flush()
+        scan_complete = found_txt_count + not_found_txt_count >= total_files
+        if not scan_complete:
+            self.logger_obj.warning(f"扫描目录: '{self.scan_folder}' 未完整扫描，保留旧记录。")
+        self.catalog.finish_folder(self.scan_folder, self.scan_token, total_files,
+                                   found_txt_count, not_found_txt_count, prune=scan_complete)
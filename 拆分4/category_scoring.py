@@ -0,0 +1,227 @@
+# category_scoring.py
+"""
+按Tag权重给提示词类别打分。
+
+“提示词类型”列是布尔标签，一个偶然出现的关键词就会给整张图打上类型；评分则把每个Tag对各类别的权重相加，
+得分达到类别阈值时才算命中，结果作为额外的列写入“匹配文件”工作表：
+    <类别>评分  —— 每个类别一列，清洗后内容中每个不同的Tag对该类别的权重之和
+    评分类型    —— 得分达到阈值的类别，逗号分隔；都未达到时为 N/A
+
+权重文件 (本地文件，默认脚本目录下的 tag_category_weights.csv)：
+    - CSV：category,tag,weight 三列（表头可省略）；tag 为空的行设置该类别的阈值，例如
+          R18,sex,2.0
+          R18,oral,0.5
+          R18,,1.5
+    - JSON：{"R18": {"threshold": 1.5, "weights": {"sex": 2.0, "oral": 0.5}}, ...}
+未设置阈值的类别使用 DEFAULT_CATEGORY_THRESHOLD。Tag 与清洗后内容一样按规范写法比较（小写、空格换成下划线）。
+
+评分按批进行：一批反推内容先转换为稀疏的 Tag 矩阵，再与 Tag×类别 的权重矩阵相乘。
+安装了 scipy 时使用稀疏矩阵乘法，只有 numpy 时按类别用 bincount 累加，二者都没有时退回纯 Python 逐Tag累加。
+"""
+import csv
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from scanner import ProcessedFileData, DataWriter, ScannerConstants, extract_tags
+from tag_aliases import normalize_tag
+
+try:
+    import numpy
+    NUMPY_AVAILABLE = True
+except ImportError:
+    numpy = None
+    NUMPY_AVAILABLE = False
+
+try:
+    from scipy import sparse
+    SCIPY_AVAILABLE = NUMPY_AVAILABLE
+except ImportError:
+    sparse = None
+    SCIPY_AVAILABLE = False
+
+# --- Configuration ---
+CATEGORY_WEIGHTS_FILE_NAME = "tag_category_weights.csv"
+DEFAULT_CATEGORY_THRESHOLD = 1.0
+DEFAULT_SCORE_BATCH_SIZE = 4096
+SCORE_DECIMALS = 4
+SCORE_COLUMN_SUFFIX = "评分"
+SCORED_TYPE_HEADER = "评分类型"
+
+
+def _read_category_weights(weights_file_path: Path) -> Tuple[Dict[str, Dict[str, float]], Dict[str, float]]:
+    weights: Dict[str, Dict[str, float]] = {}
+    thresholds: Dict[str, float] = {}
+    if weights_file_path.suffix.lower() == '.json':
+        with open(weights_file_path, 'r', encoding='utf-8-sig') as f:
+            raw_table = json.load(f)
+        if not isinstance(raw_table, dict):
+            raise ValueError("JSON 权重文件必须是 {类别: {\"threshold\": 阈值, \"weights\": {Tag: 权重}}} 形式的对象")
+        for category, settings in raw_table.items():
+            if not isinstance(settings, dict):
+                raise ValueError(f"类别 '{category}' 的设置必须是对象")
+            weights[str(category)] = {str(tag): float(weight) for tag, weight in settings.get("weights", {}).items()}
+            if settings.get("threshold") is not None:
+                thresholds[str(category)] = float(settings["threshold"])
+        return weights, thresholds
+
+    with open(weights_file_path, 'r', encoding='utf-8-sig', newline='') as f:
+        for line_number, row in enumerate(csv.reader(f), 1):
+            if len(row) < 3 or not row[0].strip():
+                continue
+            category, tag, weight_text = row[0].strip(), row[1], row[2].strip()
+            if line_number == 1 and category.lower() == 'category':
+                continue # 表头
+            try:
+                weight = float(weight_text)
+            except ValueError:
+                raise ValueError(f"第 {line_number} 行的权重不是数字: {weight_text}")
+            if tag.strip():
+                weights.setdefault(category, {})[tag] = weight
+            else:
+                weights.setdefault(category, {})
+                thresholds[category] = weight
+    return weights, thresholds
+
+
+class CategoryScorer:
+    """
+    编译后的类别权重：Tag -> 行号的字典和 Tag×类别 的权重矩阵（无 numpy 时为每个Tag的稀疏权重列表）。
+    """
+    def __init__(self, category_weights: Dict[str, Dict[str, float]],
+                 thresholds: Optional[Dict[str, float]] = None,
+                 default_threshold: float = DEFAULT_CATEGORY_THRESHOLD):
+        self.categories: List[str] = list(category_weights)
+        thresholds = thresholds or {}
+        self.thresholds: List[float] = [thresholds.get(category, default_threshold) for category in self.categories]
+
+        # 同一个Tag在一个类别中出现多次（例如大小写不同）时取最后一个权重
+        tag_weights: Dict[str, Dict[int, float]] = {}
+        for column, category in enumerate(self.categories):
+            for tag, weight in category_weights[category].items():
+                normalized = normalize_tag(tag)
+                if normalized and weight:
+                    tag_weights.setdefault(normalized, {})[column] = weight
+        self._tag_rows: Dict[str, int] = {tag: row for row, tag in enumerate(tag_weights)}
+        self._sparse_rows: List[List[Tuple[int, float]]] = [list(columns.items()) for columns in tag_weights.values()]
+        self._weight_matrix = None
+        if NUMPY_AVAILABLE:
+            self._weight_matrix = numpy.zeros((len(self._sparse_rows), len(self.categories)), dtype=numpy.float64)
+            for row, columns in enumerate(self._sparse_rows):
+                for column, weight in columns:
+                    self._weight_matrix[row, column] = weight
+
+    @property
+    def headers(self) -> List[str]:
+        """
+        追加到“匹配文件”工作表的列标题：评分类型，然后每个类别一列得分。
+        """
+        return [SCORED_TYPE_HEADER] + [f"{category}{SCORE_COLUMN_SUFFIX}" for category in self.categories]
+
+    @property
+    def weighted_tag_count(self) -> int:
+        return len(self._tag_rows)
+
+    @property
+    def backend(self) -> str:
+        if SCIPY_AVAILABLE:
+            return "scipy"
+        return "numpy" if NUMPY_AVAILABLE else "python"
+
+    def score_batch(self, captions: Sequence[Iterable[str]]) -> List[List[float]]:
+        """
+        计算一批反推内容的类别得分。
+        Args:
+            captions (Sequence[Iterable[str]]): 每条反推内容的Tag（须已规范化），重复的Tag只计一次。
+        Returns:
+            List[List[float]]: 每条内容一行，每个类别一列。
+        """
+        tag_rows = self._tag_rows
+        indptr: List[int] = [0]
+        indices: List[int] = []
+        for tags in captions:
+            indices.extend({tag_rows[tag] for tag in tags if tag in tag_rows})
+            indptr.append(len(indices))
+        caption_count, category_count = len(captions), len(self.categories)
+
+        if not indices or not category_count:
+            return [[0.0] * category_count for _ in range(caption_count)]
+        if SCIPY_AVAILABLE:
+            caption_matrix = sparse.csr_matrix(
+                (numpy.ones(len(indices)), numpy.asarray(indices), numpy.asarray(indptr)),
+                shape=(caption_count, len(self._sparse_rows)))
+            scores = numpy.asarray(caption_matrix @ self._weight_matrix)
+        elif NUMPY_AVAILABLE:
+            counts = numpy.diff(numpy.asarray(indptr))
+            caption_ids = numpy.repeat(numpy.arange(caption_count), counts)
+            selected_weights = self._weight_matrix[numpy.asarray(indices)]
+            scores = numpy.empty((caption_count, category_count))
+            for column in range(category_count):
+                scores[:, column] = numpy.bincount(caption_ids, weights=selected_weights[:, column], minlength=caption_count)
+        else:
+            result: List[List[float]] = []
+            for start, end in zip(indptr, indptr[1:]):
+                row_scores = [0.0] * category_count
+                for row in indices[start:end]:
+                    for column, weight in self._sparse_rows[row]:
+                        row_scores[column] += weight
+                result.append([round(score, SCORE_DECIMALS) for score in row_scores])
+            return result
+        return numpy.round(scores, SCORE_DECIMALS).tolist()
+
+    def scored_types(self, scores: Sequence[float]) -> str:
+        """
+        得分达到阈值的类别，逗号分隔；都未达到时返回 N/A。
+        """
+        types = [category for category, score, threshold in zip(self.categories, scores, self.thresholds)
+                 if score >= threshold]
+        return ','.join(types) if types else ScannerConstants.FileStatus.PROMPT_TYPE_NA.value
+
+
+def load_category_scorer(weights_file_path: Path, logger_obj,
+                         default_threshold: float = DEFAULT_CATEGORY_THRESHOLD) -> Optional[CategoryScorer]:
+    """
+    读取权重文件并编译评分器。文件无法读取或没有任何类别时返回 None（不输出评分列）。
+    """
+    try:
+        category_weights, thresholds = _read_category_weights(weights_file_path)
+    except (OSError, ValueError, csv.Error) as e:
+        logger_obj.error(f"错误: 解析类别权重文件 '{weights_file_path}' 失败: {e}")
+        return None
+    if not category_weights:
+        logger_obj.warning(f"警告: 类别权重文件 '{weights_file_path}' 中没有任何类别，不输出评分列。")
+        return None
+    scorer = CategoryScorer(category_weights, thresholds, default_threshold)
+    logger_obj.info(f"已加载 {len(scorer.categories)} 个评分类别 ({scorer.weighted_tag_count} 个带权重的Tag，"
+                    f"计算方式: {scorer.backend}): {weights_file_path}")
+    return scorer
+
+
+class ScoringDataWriter:
+    """
+    DataWriter 实现：缓冲匹配的行，每满 batch_size 行批量计算一次类别得分，写入 scored_types / category_scores 后
+    按原顺序交给下一个数据写入器。未匹配的行没有得分，直接转发。扫描结束后必须调用 flush。
+    """
+    def __init__(self, scorer: CategoryScorer, next_writer: DataWriter, batch_size: int = DEFAULT_SCORE_BATCH_SIZE):
+        self.scorer = scorer
+        self.next_writer = next_writer
+        self.batch_size = max(1, batch_size)
+        self._pending_rows: List[ProcessedFileData] = []
+
+    def write_matched_data(self, processed_data: ProcessedFileData):
+        self._pending_rows.append(processed_data)
+        if len(self._pending_rows) >= self.batch_size:
+            self.flush()
+
+    def write_no_txt_data(self, processed_data: ProcessedFileData):
+        self.next_writer.write_no_txt_data(processed_data)
+
+    def flush(self):
+        rows, self._pending_rows = self._pending_rows, []
+        if not rows:
+            return
+        captions = [[normalize_tag(tag) for tag in extract_tags(row.cleaned_data)] for row in rows]
+        for row, scores in zip(rows, self.scorer.score_batch(captions)):
+            row.scored_types = self.scorer.scored_types(scores)
+            row.category_scores = scores
+            self.next_writer.write_matched_data(row)
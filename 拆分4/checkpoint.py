@@ -0,0 +1,316 @@
+# checkpoint.py
+"""
+扫描检查点与批量任务台账。
+
+- ScanCheckpoint：单个文件夹扫描过程中定期保存扫描游标和已处理的行（Tag计数恢复时从重放的行重新统计），
+  程序崩溃或重启后可以从最后一个检查点继续，结果与一次性跑完完全一致。
+- BatchLedger：记录批量任务中已完成的文件夹及其历史记录条目，
+  恢复运行时跳过已完成的文件夹，并把它们的历史记录条目重新加入 HistoryManager。
+
+所有状态文件都先写入临时文件再通过 os.replace 原子替换，断电时不会留下半个JSON。
+"""
+import os
+import json
+import time
+import datetime
+import hashlib
+import threading
+import dataclasses
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Iterator
+
+from file_system_utils import normalize_drive_letter, generate_folder_prefix
+
+# --- Configuration ---
+CHECKPOINT_FOLDER_NAME = "checkpoints"
+BATCH_LEDGER_FILE_NAME = "batch_ledger.json"
+DEFAULT_CHECKPOINT_INTERVAL_FILES = 2000   # 每处理多少个文件保存一次检查点
+DEFAULT_CHECKPOINT_INTERVAL_SECONDS = 60.0 # 或者距离上次保存超过多少秒
+CHECKPOINT_FORMAT_VERSION = 3 # 2: 行数据包含错误记录；3: 不再保存Tag计数
+
+
+def _write_json_atomically(target_path: Path, data: Dict[str, Any]):
+    """
+    先写入同目录的临时文件并 fsync，再原子替换目标文件。
+    """
+    temp_path = target_path.with_name(target_path.name + ".tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, target_path)
+
+
+def _encode_row_value(value: Any) -> Any:
+    """
+    json.dumps 的 default：错误记录中的时间写成 ISO 格式字符串。
+    """
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"无法写入检查点的值类型: {type(value).__name__}")
+
+
+def compute_file_list_digest(file_paths: List[Path]) -> str:
+    """
+    计算待扫描文件列表的摘要。恢复时只有文件列表（及顺序）完全一致，检查点才可用。
+    """
+    digest = hashlib.sha1()
+    for file_path in file_paths:
+        digest.update(str(file_path).encode('utf-8', 'surrogatepass'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _folder_key(folder_path: Path) -> str:
+    """
+    检查点文件名：可读的文件夹前缀 + 完整路径哈希，避免同名文件夹互相覆盖。
+    """
+    full_path = normalize_drive_letter(str(folder_path.resolve()))
+    path_hash = hashlib.md5(full_path.encode('utf-8')).hexdigest()[:12]
+    return f"{generate_folder_prefix(folder_path)}_{path_hash}"
+
+
+class ScanCheckpoint:
+    """
+    单个文件夹的扫描检查点。
+    由两个文件组成：
+        <key>.rows.jsonl  —— 已处理行的追加日志（每行一个 ProcessedFileData，包括其错误记录）
+        <key>.state.json  —— 扫描游标、计数以及 rows 文件中有效数据的字节长度
+    state 文件总是在 rows 数据 fsync 之后才替换，因此 state 指向的行一定已完整落盘；
+    state 之后多写出的行在恢复时会被截断丢弃。
+    """
+    def __init__(self, checkpoint_dir: Path, folder_path: Path, logger_obj,
+                 interval_files: int = DEFAULT_CHECKPOINT_INTERVAL_FILES,
+                 interval_seconds: float = DEFAULT_CHECKPOINT_INTERVAL_SECONDS):
+        self.folder_path = folder_path
+        self.logger_obj = logger_obj
+        self.interval_files = max(1, interval_files)
+        self.interval_seconds = interval_seconds
+        key = _folder_key(folder_path)
+        self.state_path = checkpoint_dir / f"{key}.state.json"
+        self.rows_path = checkpoint_dir / f"{key}.rows.jsonl"
+
+        self.scan_timestamp: Optional[str] = None
+        self.resume_state: Optional[Dict[str, Any]] = None
+        self._pending_rows: List[str] = []
+        self._rows_count = 0
+        self._rows_bytes = 0
+        self._files_since_save = 0
+        self._last_save_time = time.monotonic()
+
+    def open(self, resume: bool, default_scan_timestamp: str) -> str:
+        """
+        打开检查点。resume 为 True 且存在有效检查点时载入它，否则丢弃旧检查点重新开始。
+        Returns:
+            str: 本次扫描使用的时间戳。恢复时沿用上次的时间戳，使输出文件名保持不变。
+        """
+        self.resume_state = self._load_state() if resume else None
+        if self.resume_state is None:
+            self.discard()
+            self.scan_timestamp = default_scan_timestamp
+        else:
+            self.scan_timestamp = self.resume_state["scan_timestamp"]
+            self._rows_count = self.resume_state["rows_count"]
+            self._rows_bytes = self.resume_state["rows_bytes"]
+            self.logger_obj.info(
+                f"发现文件夹 '{normalize_drive_letter(str(self.folder_path))}' 的检查点: "
+                f"已处理 {self.resume_state['cursor']} 个文件，将从此处继续。"
+            )
+        return self.scan_timestamp
+
+    def _load_state(self) -> Optional[Dict[str, Any]]:
+        if not self.state_path.exists() or not self.rows_path.exists():
+            return None
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get("version") != CHECKPOINT_FORMAT_VERSION:
+                self.logger_obj.warning(f"警告: 检查点格式版本不匹配，忽略: {normalize_drive_letter(str(self.state_path))}")
+                return None
+            if state.get("folder_path") != normalize_drive_letter(str(self.folder_path.resolve())):
+                return None
+            if self.rows_path.stat().st_size < state["rows_bytes"]:
+                self.logger_obj.warning(f"警告: 检查点行数据不完整，忽略: {normalize_drive_letter(str(self.rows_path))}")
+                return None
+            return state
+        except Exception as e:
+            self.logger_obj.warning(f"警告: 读取检查点 '{normalize_drive_letter(str(self.state_path))}' 失败，将重新扫描。错误: {e}")
+            return None
+
+    def restore(self, file_list_digest: str) -> Optional[Dict[str, Any]]:
+        """
+        在文件列表收集完成后调用。若文件列表与检查点一致，截断 rows 文件中未被 state 确认的部分
+        并返回检查点状态；否则丢弃检查点，返回 None。
+        """
+        if self.resume_state is None:
+            return None
+        if self.resume_state["file_list_digest"] != file_list_digest:
+            self.logger_obj.warning(
+                f"警告: 文件夹 '{normalize_drive_letter(str(self.folder_path))}' 的文件列表自检查点以来已变化，"
+                f"无法沿用检查点，将从头扫描。"
+            )
+            self.resume_state = None
+            self._rows_count = 0
+            self._rows_bytes = 0
+            self._remove_files()
+            return None
+        with open(self.rows_path, 'r+b') as f:
+            f.truncate(self._rows_bytes)
+        return self.resume_state
+
+    def iter_saved_rows(self) -> Iterator[Dict[str, Any]]:
+        """
+        按原始顺序逐行读取检查点中已确认的行数据。错误记录是字典列表，时间为 ISO 格式字符串。
+        """
+        with open(self.rows_path, 'r', encoding='utf-8') as f:
+            for _ in range(self._rows_count):
+                yield json.loads(f.readline())
+
+    def record_row(self, row_data: Any):
+        """
+        缓存一条新处理的行（ProcessedFileData），在下一次 save 时写盘。
+        """
+        row_dict = dataclasses.asdict(row_data)
+        self._pending_rows.append(json.dumps(row_dict, ensure_ascii=False, default=_encode_row_value) + "\n")
+        self._files_since_save += 1
+
+    def is_due(self) -> bool:
+        return (self._files_since_save >= self.interval_files or
+                time.monotonic() - self._last_save_time >= self.interval_seconds)
+
+    def save(self, cursor: int, file_list_digest: str, found_txt_count: int,
+             not_found_txt_count: int):
+        """
+        把缓存的行追加写入 rows 文件并 fsync，然后原子更新 state 文件。
+        """
+        try:
+            if self._pending_rows:
+                encoded = "".join(self._pending_rows).encode('utf-8')
+                with open(self.rows_path, 'ab') as f:
+                    f.write(encoded)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._rows_bytes += len(encoded)
+                self._rows_count += len(self._pending_rows)
+                self._pending_rows = []
+            _write_json_atomically(self.state_path, {
+                "version": CHECKPOINT_FORMAT_VERSION,
+                "folder_path": normalize_drive_letter(str(self.folder_path.resolve())),
+                "scan_timestamp": self.scan_timestamp,
+                "file_list_digest": file_list_digest,
+                "cursor": cursor,
+                "found_txt_count": found_txt_count,
+                "not_found_txt_count": not_found_txt_count,
+                "rows_count": self._rows_count,
+                "rows_bytes": self._rows_bytes,
+            })
+            self.logger_obj.debug(f"已保存扫描检查点: 已处理 {cursor} 个文件。")
+        except Exception as e:
+            # 检查点只是保险措施，写入失败不应中断扫描
+            self.logger_obj.warning(f"警告: 保存扫描检查点 '{normalize_drive_letter(str(self.state_path))}' 失败: {e}")
+        self._files_since_save = 0
+        self._last_save_time = time.monotonic()
+
+    def _remove_files(self):
+        for path in (self.state_path, self.rows_path):
+            try:
+                if path.exists():
+                    os.remove(path)
+            except OSError as e:
+                self.logger_obj.warning(f"警告: 无法删除检查点文件 '{normalize_drive_letter(str(path))}': {e}")
+
+    def discard(self):
+        """
+        删除检查点文件。在扫描结果成功保存后，或不需要恢复时调用。
+        """
+        self._pending_rows = []
+        self._rows_count = 0
+        self._rows_bytes = 0
+        self.resume_state = None
+        self._remove_files()
+
+
+def _encode_entry_value(value: Any) -> Any:
+    if isinstance(value, Path):
+        return {"__path__": str(value)}
+    return value
+
+
+def _decode_entry_value(value: Any) -> Any:
+    if isinstance(value, dict) and "__path__" in value:
+        return Path(value["__path__"])
+    return value
+
+
+class BatchLedger:
+    """
+    批量任务台账：记录当前批次（由 batchPath.txt 中的文件夹列表确定）中已经完成的文件夹，
+    以及每个文件夹对应的历史记录条目。每完成一个文件夹立即落盘。
+    批量调度器可能在多个线程中同时完成文件夹，因此写入操作加锁。
+    """
+    def __init__(self, ledger_path: Path, folders_to_scan: List[Path], logger_obj):
+        self.ledger_path = ledger_path
+        self.logger_obj = logger_obj
+        signature_source = "\n".join(normalize_drive_letter(str(p)) for p in folders_to_scan)
+        self.batch_signature = hashlib.sha1(signature_source.encode('utf-8')).hexdigest()
+        self.completed: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _folder_id(folder_path: Path) -> str:
+        return normalize_drive_letter(str(folder_path))
+
+    def open(self, resume: bool) -> int:
+        """
+        resume 为 True 时载入与当前批次一致的台账；否则清空台账。
+        Returns:
+            int: 已完成的文件夹数量。
+        """
+        self.completed = {}
+        if not resume:
+            self.clear()
+            return 0
+        if not self.ledger_path.exists():
+            return 0
+        try:
+            with open(self.ledger_path, 'r', encoding='utf-8') as f:
+                ledger_data = json.load(f)
+            if ledger_data.get("batch_signature") != self.batch_signature:
+                self.logger_obj.warning("警告: 批量路径列表已变化，上次的批量台账不再适用，将重新处理所有文件夹。")
+                return 0
+            self.completed = ledger_data.get("completed", {})
+        except Exception as e:
+            self.logger_obj.warning(f"警告: 读取批量台账 '{normalize_drive_letter(str(self.ledger_path))}' 失败: {e}")
+            self.completed = {}
+        return len(self.completed)
+
+    def is_completed(self, folder_path: Path) -> bool:
+        return self._folder_id(folder_path) in self.completed
+
+    def get_history_entry(self, folder_path: Path) -> Dict[str, Any]:
+        encoded_entry = self.completed[self._folder_id(folder_path)]
+        return {key: _decode_entry_value(value) for key, value in encoded_entry.items()}
+
+    def mark_completed(self, folder_path: Path, history_entry: Dict[str, Any]):
+        with self._lock:
+            self.completed[self._folder_id(folder_path)] = {
+                key: _encode_entry_value(value) for key, value in history_entry.items()
+            }
+            try:
+                _write_json_atomically(self.ledger_path, {
+                    "batch_signature": self.batch_signature,
+                    "completed": self.completed,
+                })
+            except Exception as e:
+                self.logger_obj.warning(f"警告: 更新批量台账 '{normalize_drive_letter(str(self.ledger_path))}' 失败: {e}")
+
+    def clear(self):
+        """
+        整个批次成功结束（历史记录已保存）后删除台账。
+        """
+        self.completed = {}
+        try:
+            if self.ledger_path.exists():
+                os.remove(self.ledger_path)
+        except OSError as e:
+            self.logger_obj.warning(f"警告: 无法删除批量台账 '{normalize_drive_letter(str(self.ledger_path))}': {e}")
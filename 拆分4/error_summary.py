@@ -0,0 +1,85 @@
+# error_summary.py
+"""
+扫描错误的有界汇总。
+
+编码错误或权限问题大面积出现时，逐条保存错误记录会随文件数无限增长。ScanErrorAggregator 只保存：
+    - 每种错误类型的计数；
+    - (错误类型, 目录) 的计数，最多 max_directories 个不同的键，之后新出现的目录合并计入“(其他目录)”；
+    - 一个容量为 max_samples 的蓄水池抽样 (reservoir sampling)，任意多的错误中每条被保留的概率相同。
+占用的内存与错误总数无关。扫描结束时的日志汇总和结果工作簿中的“错误汇总”工作表都从这里生成。
+"""
+import os
+import random
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+# --- Configuration ---
+DEFAULT_ERROR_SAMPLE_SIZE = 200        # 保留的错误示例条数
+DEFAULT_MAX_ERROR_DIRECTORIES = 1000   # 单独计数的 (错误类型, 目录) 组合上限
+OTHER_DIRECTORIES_LABEL = "(其他目录)"
+
+
+class ScanErrorAggregator:
+    """
+    按类型/目录计数并抽样保留错误记录（ErrorRecord 或任何带 error_type / message / file_path 属性的对象）。
+    """
+    def __init__(self, max_samples: int = DEFAULT_ERROR_SAMPLE_SIZE,
+                 max_directories: int = DEFAULT_MAX_ERROR_DIRECTORIES):
+        self.max_samples = max(0, max_samples)
+        self.max_directories = max(0, max_directories)
+        self._random = random.Random()
+        self.clear()
+
+    def clear(self):
+        self.total = 0
+        self._type_counts: Counter = Counter()
+        self._directory_counts: Dict[Tuple[str, str], int] = {}
+        self._samples: List[Tuple[int, Any]] = [] # (到达序号, 错误记录)
+
+    def __len__(self) -> int:
+        return self.total
+
+    def add(self, error_record: Any, directory: Optional[str] = None):
+        """
+        登记一条错误。directory 为 None 时取 file_path 所在的目录（目录级错误应直接传入该目录）。
+        """
+        self.total += 1
+        self._type_counts[error_record.error_type] += 1
+
+        if directory is None:
+            directory = os.path.dirname(error_record.file_path) if error_record.file_path else ""
+        key = (error_record.error_type, directory)
+        if key not in self._directory_counts and len(self._directory_counts) >= self.max_directories:
+            key = (error_record.error_type, OTHER_DIRECTORIES_LABEL)
+        self._directory_counts[key] = self._directory_counts.get(key, 0) + 1
+
+        if len(self._samples) < self.max_samples:
+            self._samples.append((self.total, error_record))
+        elif self.max_samples:
+            replace_index = self._random.randrange(self.total)
+            if replace_index < self.max_samples:
+                self._samples[replace_index] = (self.total, error_record)
+
+    def extend(self, error_records: List[Any], directory: Optional[str] = None):
+        for error_record in error_records:
+            self.add(error_record, directory)
+
+    def type_counts(self) -> List[Tuple[str, int]]:
+        """
+        (错误类型, 次数)，按次数从高到低。
+        """
+        return self._type_counts.most_common()
+
+    def directory_counts(self, limit: Optional[int] = None) -> List[Tuple[str, str, int]]:
+        """
+        (错误类型, 目录, 次数)，按次数从高到低，最多 limit 条。
+        """
+        rows = sorted(((error_type, directory, count) for (error_type, directory), count in self._directory_counts.items()),
+                      key=lambda row: row[2], reverse=True)
+        return rows[:limit] if limit is not None else rows
+
+    def samples(self) -> List[Any]:
+        """
+        抽样保留的错误记录，按出现顺序排列。
+        """
+        return [error_record for _, error_record in sorted(self._samples, key=lambda sample: sample[0])]
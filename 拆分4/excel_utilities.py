@@ -1,15 +1,36 @@
 # excel_utilities.py
+import os
+import time
+import shutil
+from pathlib import Path
 from openpyxl import Workbook
 from openpyxl.worksheet.worksheet import Worksheet
 from typing import Tuple, Optional, List, Dict # 导入 List 和 Dict
 from openpyxl.styles import Font
 from openpyxl.utils import get_column_letter
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils.exceptions import WorkbookAlreadySaved
+
+from file_system_utils import normalize_drive_letter
 
 HYPERLINK_FONT = Font(color="0000FF", underline="single")
 
 # 定义固定列宽（以字符为单位）
 FIXED_COLUMN_WIDTH = 20
 
+# 扫描结果工作簿的工作表名称与标题（main.py 与监视模式共用，保证两者输出格式一致）
+MATCHED_SHEET_NAME = "匹配文件"
+UNMATCHED_SHEET_NAME = "未匹配文件"
+TAG_FREQUENCY_SHEET_NAME = "Tag词频统计"
+NEGATIVE_TAG_FREQUENCY_SHEET_NAME = "负向Tag词频统计"
+MATCHED_HEADERS: List[str] = ["文件夹路径", "文件绝对路径", "文件链接", "文件扩展名",
+                              "TXT文件绝对路径", "TXT文件内容", "清洗后内容", "内容长度",
+                              "提示词类型", "找到TXT", "负向提示词", "生成参数"]
+UNMATCHED_HEADERS: List[str] = ["文件夹路径", "文件绝对路径", "文件链接", "文件扩展名", "找到TXT"]
+TAG_FREQUENCY_HEADERS: List[str] = ["Tag", "出现次数"]
+ERROR_SUMMARY_SHEET_NAME = "错误汇总"
+ERROR_SUMMARY_MAX_DIRECTORY_ROWS = 500 # “错误汇总”中按目录列出的计数最多行数
+
 # --- Excel Utilities (Modified for more generality) ---
 
 def create_empty_workbook() -> Workbook: # 重命名，更清晰
@@ -44,6 +65,183 @@ def create_sheet_with_headers(
     ws.append(headers)
     return ws
 
+def create_scan_result_workbook(extra_matched_headers: Optional[List[str]] = None) -> Tuple[Workbook, Worksheet, Worksheet, Worksheet, Worksheet]:
+    """
+    创建扫描结果工作簿，包含“匹配文件”、“未匹配文件”、“Tag词频统计”和“负向Tag词频统计”四个工作表。
+    Args:
+        extra_matched_headers (Optional[List[str]]): 追加在“匹配文件”标题之后的列（例如类别评分列）。
+    Returns:
+        Tuple[Workbook, Worksheet, Worksheet, Worksheet, Worksheet]: 工作簿以及四个工作表对象。
+    """
+    wb = create_empty_workbook()
+    ws_matched = create_sheet_with_headers(wb, MATCHED_SHEET_NAME, MATCHED_HEADERS + list(extra_matched_headers or []), 0)
+    ws_no_txt = create_sheet_with_headers(wb, UNMATCHED_SHEET_NAME, UNMATCHED_HEADERS, 1)
+    ws_tag_frequency = create_sheet_with_headers(wb, TAG_FREQUENCY_SHEET_NAME, TAG_FREQUENCY_HEADERS, 2)
+    ws_negative_tag_frequency = create_sheet_with_headers(wb, NEGATIVE_TAG_FREQUENCY_SHEET_NAME, TAG_FREQUENCY_HEADERS, 3)
+    return wb, ws_matched, ws_no_txt, ws_tag_frequency, ws_negative_tag_frequency
+
+
+def write_tag_frequency(worksheet: Worksheet, tag_counts: Dict[str, int]):
+    """
+    按出现次数从高到低写入Tag词频。
+    """
+    for tag, count in sorted(tag_counts.items(), key=lambda item: item[1], reverse=True):
+        worksheet.append([tag, count])
+
+
+def write_error_summary(workbook: Workbook, error_aggregator) -> Optional[Worksheet]:
+    """
+    把扫描错误汇总 (error_summary.ScanErrorAggregator) 写入末尾的“错误汇总”工作表：
+    先是按类型的计数，然后是按 类型+目录 的计数，最后是抽样保留的错误示例。没有错误时不创建工作表。
+    Returns:
+        Optional[Worksheet]: 新建的工作表；没有错误时为 None。
+    """
+    if not error_aggregator.total:
+        return None
+    ws = create_sheet_with_headers(workbook, ERROR_SUMMARY_SHEET_NAME, ["错误类型", "次数"])
+    for error_type, count in error_aggregator.type_counts():
+        ws.append([error_type, count])
+    ws.append(["合计", error_aggregator.total])
+
+    ws.append([])
+    ws.append(["错误类型", "目录", "次数"])
+    for error_type, directory, count in error_aggregator.directory_counts(ERROR_SUMMARY_MAX_DIRECTORY_ROWS):
+        ws.append([error_type, directory, count])
+
+    ws.append([])
+    ws.append(["时间", "错误类型", "文件", "消息", "详情"])
+    for error in error_aggregator.samples():
+        ws.append([error.timestamp.strftime("%Y-%m-%d %H:%M:%S"), error.error_type,
+                   error.file_path or "", error.message, error.details or ""])
+    return ws
+
+
+def convert_to_write_only_workbook(workbook: Workbook, column_width: int) -> Tuple[Workbook, List[Worksheet]]:
+    """
+    把工作簿按原顺序复制为 write_only 工作簿（内存预算的降级措施）：之后追加的行直接写入临时文件，不再常驻内存。
+    超链接随单元格一起复制；write_only 工作表的列宽必须在写入第一行之前设置，因此这里统一设为 column_width。
+    每复制完一个工作表就把它从原工作簿中移除，调用方不应再使用原工作簿。
+    注意：write_only 工作簿只能序列化一次。save_workbook_with_retries 正常情况下只序列化一次；
+    只有写入临时文件中途失败时才会再次保存到备用位置，这时 write_only 工作簿可能已无法保存 (WorkbookAlreadySaved)。
+    Returns:
+        Tuple[Workbook, List[Worksheet]]: 新工作簿以及与原工作表顺序一致的新工作表。
+    """
+    stream_workbook = Workbook(write_only=True)
+    stream_sheets: List[Worksheet] = []
+    for worksheet in list(workbook.worksheets):
+        stream_sheet = stream_workbook.create_sheet(worksheet.title)
+        for col_idx in range(1, worksheet.max_column + 1):
+            stream_sheet.column_dimensions[get_column_letter(col_idx)].width = column_width
+        for row in worksheet.iter_rows():
+            stream_sheet.append([_copy_to_write_only_cell(stream_sheet, cell) for cell in row])
+        workbook.remove(worksheet)
+        stream_sheets.append(stream_sheet)
+    return stream_workbook, stream_sheets
+
+def _copy_to_write_only_cell(stream_sheet: Worksheet, cell):
+    if cell.hyperlink is None:
+        return cell.value
+    stream_cell = WriteOnlyCell(stream_sheet, cell.value)
+    stream_cell.hyperlink = cell.hyperlink.target
+    stream_cell.font = HYPERLINK_FONT
+    return stream_cell
+
+def create_write_only_cell(
+    worksheet: Worksheet,
+    location: Optional[str],
+    display_text: str,
+    logger_obj,
+    source_description: str = "未知来源"
+) -> WriteOnlyCell:
+    """
+    为 write_only 工作表构造带超链接和样式的单元格（与 set_hyperlink_and_style 的效果相同），随行一起 append。
+    """
+    cell = WriteOnlyCell(worksheet)
+    set_hyperlink_and_style(cell, location, display_text, logger_obj, source_description)
+    return cell
+
+
+def excel_lock_file_path(file_path: Path) -> Path:
+    """
+    Excel 打开工作簿时在同一目录创建的锁文件 (~$文件名)。锁文件存在说明目标正被占用，重试替换没有意义。
+    """
+    return file_path.with_name("~$" + file_path.name)
+
+def save_workbook_with_retries(
+    workbook: Workbook,
+    target_path: Path,
+    fallback_path: Path,
+    logger_obj,
+    max_retries: int,
+    retry_delay_seconds: float
+) -> Optional[Path]:
+    """
+    保存工作簿：只序列化一次。
+        1. 序列化到目标目录中的临时文件 (~文件名.tmp)；
+        2. 用 os.replace 原子替换为目标文件，目标被占用 (PermissionError) 时只重试这一步；
+           检测到 Excel 锁文件时不再等待，直接转到备用位置；
+        3. 仍然失败时把临时文件移动到 fallback_path（跨磁盘时为复制后删除）。
+    目标目录无法写入临时文件时（例如磁盘已满）删除写了一半的临时文件，再直接序列化到备用位置；
+    write_only 工作簿如果在第一次序列化中途失败，可能无法再次保存，此时放弃并返回 None。
+    Returns:
+        Optional[Path]: 实际保存的路径；目标和备用位置都失败时为 None。
+    """
+    temp_path = target_path.with_name(f"~{target_path.name}.tmp")
+    try:
+        workbook.save(str(temp_path))
+    except Exception as e:
+        logger_obj.error(f"错误: 无法在 '{normalize_drive_letter(str(target_path.parent))}' 中写入临时结果文件: {e}。尝试直接保存到备用位置。")
+        _remove_partial_file(temp_path, logger_obj)
+        temp_path = None
+
+    try:
+        if temp_path is not None:
+            lock_file_path = excel_lock_file_path(target_path)
+            for attempt in range(max_retries):
+                if lock_file_path.exists():
+                    logger_obj.warning(f"警告: 检测到锁文件 '{normalize_drive_letter(str(lock_file_path))}'，结果文件 '{normalize_drive_letter(str(target_path))}' 正被其他程序（如Excel）打开，不再重试。")
+                    break
+                try:
+                    os.replace(temp_path, target_path)
+                    logger_obj.info(f"扫描结果已保存到: {normalize_drive_letter(str(target_path))} (尝试 {attempt + 1}/{max_retries})")
+                    return target_path
+                except PermissionError as e:
+                    logger_obj.warning(f"警告: 无法将扫描结果保存到 '{normalize_drive_letter(str(target_path))}'，原因: 权限拒绝！请确保该文件未被其他程序（如Excel）打开。尝试 {attempt + 1}/{max_retries}。错误: {e}")
+                    if attempt + 1 < max_retries:
+                        time.sleep(retry_delay_seconds)
+                except OSError as e:
+                    logger_obj.error(f"错误: 将扫描结果保存到 '{normalize_drive_letter(str(target_path))}' 失败: {e} (尝试 {attempt + 1}/{max_retries})")
+                    break
+            logger_obj.critical(f"严重警告: 无法将扫描结果保存到 '{normalize_drive_letter(str(target_path))}'。尝试保存到备用位置。")
+
+        try:
+            if temp_path is not None:
+                shutil.move(str(temp_path), str(fallback_path))
+            else:
+                workbook.save(str(fallback_path))
+            logger_obj.warning(f"成功将扫描结果保存到备用位置: {normalize_drive_letter(str(fallback_path))}")
+            return fallback_path
+        except WorkbookAlreadySaved:
+            logger_obj.critical(f"致命错误: 流式写入 (write_only) 的工作簿在写入临时文件时已被序列化，无法再保存到备用位置 "
+                                f"'{normalize_drive_letter(str(fallback_path))}'，本次扫描结果未能保存。")
+            _remove_partial_file(fallback_path, logger_obj)
+            return None
+        except Exception as fallback_e:
+            logger_obj.critical(f"致命错误: 尝试将扫描结果保存到备用位置 '{normalize_drive_letter(str(fallback_path))}' 也失败了！错误: {fallback_e}")
+            _remove_partial_file(fallback_path, logger_obj)
+            return None
+    finally:
+        if temp_path is not None:
+            _remove_partial_file(temp_path, logger_obj)
+
+def _remove_partial_file(file_path: Path, logger_obj):
+    if not file_path.exists():
+        return
+    try:
+        file_path.unlink()
+    except OSError as e:
+        logger_obj.warning(f"警告: 无法删除未完成的文件 '{normalize_drive_letter(str(file_path))}': {e}")
+
 
 # --- 辅助函数 ---
 # 将 set_hyperlink_and_style 函数粘贴到这里
@@ -1,55 +1,141 @@
 import os
 import sys
-import time
+import html
+import datetime
+import threading
 import subprocess
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from file_system_utils import normalize_drive_letter
 
 
-def open_output_files_automatically(file_paths: List[Path], logger_obj):
+def _resolve_openable_path(file_path: Path) -> Path:
     """
-    根据用户设置自动打开生成的输出文件（Excel和Log文件）。
-    Args:
-        file_paths (List[Path]): 包含要打开的文件路径的列表。
-        logger_obj (logger): Loguru logger 实例。
+    返回实际可打开的路径。Loguru 轮转压缩后的日志文件 (.txt -> .zip) 会被替换为压缩文件路径。
     """
-    if os.getenv("DISABLE_AUTO_OPEN", "0") == "1":
-        logger_obj.info("已禁用自动打开文件功能。")
-        return
+    if file_path.suffix == '.txt' and not file_path.exists():
+        zip_path = file_path.with_suffix('.zip')
+        if zip_path.exists():
+            return zip_path
+    return file_path
+
+
+def _launch_viewer(normalized_path: str):
+    """
+    启动系统默认程序打开文件，不等待查看器返回。
+    """
+    if sys.platform == "win32":
+        os.startfile(normalized_path)
+    else:
+        opener = 'open' if sys.platform == "darwin" else 'xdg-open'
+        subprocess.Popen([opener, normalized_path],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
 
-    # 定义延迟时间 (秒)
-    OPEN_FILE_DELAY_SECONDS = 2 # 你建议的2秒延迟
 
+def _open_files_worker(file_paths: List[Path], logger_obj):
     for file_path in file_paths:
-        # --- 主要修改点 START ---
-        # 在尝试打开文件前增加延迟
-        logger_obj.debug(f"尝试打开文件 '{normalize_drive_letter(str(file_path))}' 前，等待 {OPEN_FILE_DELAY_SECONDS} 秒。")
-        time.sleep(OPEN_FILE_DELAY_SECONDS)
-        # --- 主要修改点 END ---
-
-        actual_path_to_open = file_path
-        # 特殊处理 Loguru 压缩后的日志文件
-        if file_path.suffix == '.txt' and not file_path.exists():
-            zip_path = file_path.with_suffix('.zip')
-            if zip_path.exists():
-                actual_path_to_open = zip_path
-                logger_obj.info(f"日志文件 '{normalize_drive_letter(str(file_path))}' 不存在，尝试打开压缩文件: {normalize_drive_letter(str(zip_path))}")
+        actual_path_to_open = _resolve_openable_path(file_path)
+        if actual_path_to_open != file_path:
+            logger_obj.info(f"日志文件 '{normalize_drive_letter(str(file_path))}' 不存在，尝试打开压缩文件: {normalize_drive_letter(str(actual_path_to_open))}")
 
         if not actual_path_to_open.exists():
             logger_obj.warning(f"警告: 无法自动打开文件 '{normalize_drive_letter(str(actual_path_to_open))}'，因为文件不存在。")
             continue
 
+        normalized_path = normalize_drive_letter(str(actual_path_to_open))
         try:
-            normalized_path = normalize_drive_letter(str(actual_path_to_open))
             logger_obj.info(f"自动打开: {normalized_path}")
-            if sys.platform == "win32":
-                os.startfile(normalized_path)
-            elif sys.platform == "darwin": # macOS
-                subprocess.run(['open', normalized_path], check=True)
-            else: # Linux
-                subprocess.run(['xdg-open', normalized_path], check=True)
+            _launch_viewer(normalized_path)
         except FileNotFoundError:
             logger_obj.error(f"错误: 无法找到打开文件 '{normalized_path}' 的应用程序。请手动打开。")
         except Exception as e:
-            logger_obj.error(f"错误: 自动打开文件 '{normalized_path}' 时发生意外错误: {e}")
\ No newline at end of file
+            logger_obj.error(f"错误: 自动打开文件 '{normalized_path}' 时发生意外错误: {e}")
+
+
+def open_output_files_automatically(file_paths: List[Path], logger_obj) -> Optional[threading.Thread]:
+    """
+    根据用户设置自动打开生成的输出文件（Excel和Log文件）。
+    原理：打开操作在后台线程中执行，查看器以独立进程启动且不等待其退出，
+         因此调用方（扫描循环）永远不会因为查看器而阻塞。
+    Args:
+        file_paths (List[Path]): 包含要打开的文件路径的列表。
+        logger_obj (logger): Loguru logger 实例。
+    Returns:
+        Optional[threading.Thread]: 执行打开操作的后台线程；禁用自动打开或列表为空时返回 None。
+    """
+    if os.getenv("DISABLE_AUTO_OPEN", "0") == "1":
+        logger_obj.info("已禁用自动打开文件功能。")
+        return None
+    if not file_paths:
+        return None
+
+    # 非守护线程：主程序退出前会等待启动命令发出，但不会等待查看器本身
+    launcher_thread = threading.Thread(target=_open_files_worker, args=(list(file_paths), logger_obj),
+                                       name="file-opener")
+    launcher_thread.start()
+    return launcher_thread
+
+
+class ArtifactCollector:
+    """
+    收集批量任务中每个文件夹产生的输出文件（结果Excel、扫描日志等），
+    批次结束时汇总为一个索引文件，只打开这一个文件。
+    批量调度器可能在多个线程中同时添加，因此加锁。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._artifacts: List[Tuple[str, str, Path]] = []
+
+    def add(self, group_name: str, label: str, file_path: Optional[Path]):
+        """
+        Args:
+            group_name (str): 分组名称，通常是扫描的文件夹路径。
+            label (str): 文件说明，例如“结果XLSX”。
+            file_path (Optional[Path]): 文件路径，为 None 时忽略。
+        """
+        if file_path is None:
+            return
+        with self._lock:
+            self._artifacts.append((group_name, label, file_path))
+
+    def write_summary(self, summary_path: Path, logger_obj) -> bool:
+        """
+        生成 HTML 索引文件，按分组列出所有输出文件的链接。
+        Returns:
+            bool: 写入成功返回True。
+        """
+        with self._lock:
+            artifacts = list(self._artifacts)
+
+        # 并发处理时同一文件夹的文件可能交错添加，按分组首次出现的顺序归并
+        grouped_artifacts: Dict[str, List[Tuple[str, Path]]] = {}
+        for group_name, label, file_path in artifacts:
+            grouped_artifacts.setdefault(group_name, []).append((label, file_path))
+
+        sections: List[str] = []
+        for group_name, group_items in grouped_artifacts.items():
+            sections.append(f"<h2>{html.escape(group_name)}</h2>\n<ul>")
+            for label, file_path in group_items:
+                actual_path = _resolve_openable_path(file_path)
+                display_path = html.escape(normalize_drive_letter(str(actual_path)))
+                if actual_path.exists():
+                    sections.append(f'<li>{html.escape(label)}: <a href="{html.escape(actual_path.resolve().as_uri())}">{display_path}</a></li>')
+                else:
+                    sections.append(f"<li>{html.escape(label)}: {display_path} (文件不存在)</li>")
+            sections.append("</ul>")
+
+        generated_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        content = (
+            "<!DOCTYPE html>\n<html lang=\"zh-CN\">\n<head><meta charset=\"utf-8\"><title>扫描结果汇总</title></head>\n<body>\n"
+            f"<h1>扫描结果汇总</h1>\n<p>生成时间: {generated_time}，共 {len(artifacts)} 个文件。</p>\n"
+            + "\n".join(sections) +
+            "\n</body>\n</html>\n"
+        )
+        try:
+            summary_path.write_text(content, encoding='utf-8')
+            logger_obj.info(f"已生成结果汇总索引: {normalize_drive_letter(str(summary_path))}")
+            return True
+        except Exception as e:
+            logger_obj.error(f"错误: 无法写入结果汇总索引 '{normalize_drive_letter(str(summary_path))}': {e}")
+            return False
@@ -111,6 +111,15 @@ def get_file_details(file_path: Path) -> Tuple[str, str]:
     """
     return file_path.stem, file_path.suffix
 
+def split_file_name(file_name: str) -> Tuple[str, str]:
+    """
+    与 get_file_details 相同的拆分规则（Path.stem / Path.suffix），直接作用于文件名字符串，不创建 Path 对象。
+    """
+    dot_index = file_name.rfind('.')
+    if 0 < dot_index < len(file_name) - 1:
+        return file_name[:dot_index], file_name[dot_index:]
+    return file_name, ''
+
 # --- Utility Function to Normalize Drive Letter ---
 def normalize_drive_letter(path_str: str) -> str:
     """
@@ -0,0 +1,88 @@
+# file_table.py
+"""
+紧凑的文件列表。
+
+收集阶段只记录字符串，不为每个文件创建 Path 对象：
+    - 目录表：每个目录的路径字符串只保存一次，文件通过整数目录编号 (array('I')) 引用它；
+    - 文件名列表：与目录编号一一对应。
+需要 Path 时 (按下标或切片访问) 再临时构造，构造结果与 Path(os.scandir 条目的 path) 相同。
+每个目录解析后的绝对路径 (resolved_directory) 也只计算一次并缓存，同一目录下所有行共用同一个字符串对象。
+
+FileTable 实现了 Sequence[Path]，原来接收 List[Path] 的代码（遍历、len、切片）无需修改。
+"""
+import os
+from array import array
+from pathlib import Path
+from collections.abc import Sequence
+from typing import Dict, Iterator, List, Optional, Union
+
+from file_system_utils import normalize_drive_letter
+
+# --- Configuration ---
+DIRECTORY_ID_TYPECODE = 'I' # 无符号 32 位目录编号
+
+
+class FileTable(Sequence):
+    """
+    目录表 + 文件名列表。按追加顺序保存文件，下标与扫描顺序一致。
+    """
+    __slots__ = ('directories', '_directory_ids', '_resolved_directories', '_file_directory_ids', '_file_names')
+
+    def __init__(self):
+        self.directories: List[str] = []
+        self._directory_ids: Dict[str, int] = {}
+        self._resolved_directories: List[Optional[str]] = []
+        self._file_directory_ids = array(DIRECTORY_ID_TYPECODE)
+        self._file_names: List[str] = []
+
+    def add_directory(self, directory: str) -> int:
+        """
+        登记一个目录，返回它的编号。同一个目录字符串多次登记返回同一个编号。
+        """
+        directory_id = self._directory_ids.get(directory)
+        if directory_id is None:
+            directory_id = len(self.directories)
+            self._directory_ids[directory] = directory_id
+            self.directories.append(directory)
+            self._resolved_directories.append(None)
+        return directory_id
+
+    def append(self, directory_id: int, file_name: str):
+        self._file_directory_ids.append(directory_id)
+        self._file_names.append(file_name)
+
+    def __len__(self) -> int:
+        return len(self._file_names)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Path, List[Path]]:
+        if isinstance(index, slice):
+            return [self.path(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("FileTable index out of range")
+        return self.path(index)
+
+    def __iter__(self) -> Iterator[Path]:
+        directories = self.directories
+        for directory_id, file_name in zip(self._file_directory_ids, self._file_names):
+            yield Path(os.path.join(directories[directory_id], file_name))
+
+    def path(self, index: int) -> Path:
+        return Path(os.path.join(self.directories[self._file_directory_ids[index]], self._file_names[index]))
+
+    def file_name(self, index: int) -> str:
+        return self._file_names[index]
+
+    def directory_id(self, index: int) -> int:
+        return self._file_directory_ids[index]
+
+    def resolved_directory(self, directory_id: int) -> str:
+        """
+        目录解析后的绝对路径（已统一盘符大小写），每个目录只解析一次。
+        """
+        resolved = self._resolved_directories[directory_id]
+        if resolved is None:
+            resolved = normalize_drive_letter(str(Path(self.directories[directory_id]).resolve()))
+            self._resolved_directories[directory_id] = resolved
+        return resolved
@@ -0,0 +1,165 @@
+# folder_fingerprint.py
+"""
+文件夹指纹：不读取任何文件内容，只对目录做 stat 的廉价变化检测。
+
+每个目录的摘要由以下内容计算 (Merkle 树)：
+    - 目录自身的修改时间 (st_mtime_ns)：新增、删除、重命名条目都会改变它；
+    - 目录的条目数；
+    - 每个子目录的 (名称, 摘要)，按名称排序。
+整个文件夹的指纹是根目录的摘要再加上扫描设置的摘要（匹配方式、类型规则、别名表、类别权重文件、扫描目录的结构版本），
+设置变化时即使文件夹没有变化也会重新扫描。
+
+注意：原地修改文件内容（不经过“写临时文件再替换”）不会改变目录的修改时间，这类修改无法被指纹发现，
+需要时用 --rescan 强制重新扫描。
+"""
+import os
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from file_system_utils import normalize_drive_letter
+
+# --- Configuration ---
+FOLDER_FINGERPRINT_VERSION = 1
+UNREADABLE_DIRECTORY_MARKER = b"unreadable"
+
+
+def _directory_digest(child_digests: List[Tuple[str, bytes]], entry_count: int,
+                      mtime_ns: int, readable: bool) -> bytes:
+    digest = hashlib.sha1()
+    digest.update(f"{mtime_ns}:{entry_count}".encode('ascii'))
+    if not readable:
+        digest.update(UNREADABLE_DIRECTORY_MARKER)
+    for child_name, child_digest in sorted(child_digests):
+        digest.update(b'\0')
+        digest.update(child_name.encode('utf-8', 'surrogatepass'))
+        digest.update(child_digest)
+    return digest.digest()
+
+
+def compute_folder_fingerprint(folder_path: Path, settings_digest: str = "") -> Optional[str]:
+    """
+    计算文件夹指纹（只做 os.scandir 和目录 stat）。
+    与扫描器一样跟随指向目录的符号链接，已访问过的目录不再重复进入，避免循环。
+    Args:
+        folder_path (Path): 要计算的文件夹。
+        settings_digest (str): 扫描设置的摘要 (scan_settings_digest)，一起计入指纹。
+    Returns:
+        Optional[str]: 十六进制指纹；根目录本身无法访问时返回 None。
+    """
+    root = str(folder_path)
+    try:
+        root_stat = os.stat(root)
+    except OSError:
+        return None
+
+    visited = {(root_stat.st_dev, root_stat.st_ino)}
+    # 栈中每一项: [目录路径, 名称, mtime_ns, 条目数, 是否可读, 待处理的子目录, 已完成的子目录摘要]
+    stack: List[list] = [[root, "", root_stat.st_mtime_ns, 0, True, None, []]]
+    root_digest = b""
+    while stack:
+        frame = stack[-1]
+        if frame[5] is None:
+            subdirectories: List[Tuple[str, str]] = []
+            try:
+                with os.scandir(frame[0]) as entries:
+                    for entry in entries:
+                        frame[3] += 1
+                        try:
+                            if entry.is_dir():
+                                subdirectories.append((entry.name, entry.path))
+                        except OSError:
+                            continue
+            except OSError:
+                frame[4] = False
+            frame[5] = subdirectories
+
+        if frame[5]:
+            child_name, child_path = frame[5].pop()
+            try:
+                child_stat = os.stat(child_path)
+            except OSError:
+                frame[6].append((child_name, UNREADABLE_DIRECTORY_MARKER))
+                continue
+            child_key = (child_stat.st_dev, child_stat.st_ino)
+            if child_key in visited:
+                continue
+            visited.add(child_key)
+            stack.append([child_path, child_name, child_stat.st_mtime_ns, 0, True, None, []])
+            continue
+
+        stack.pop()
+        frame_digest = _directory_digest(frame[6], frame[3], frame[2], frame[4])
+        if stack:
+            stack[-1][6].append((frame[1], frame_digest))
+        else:
+            root_digest = frame_digest
+
+    fingerprint = hashlib.sha1(f"v{FOLDER_FINGERPRINT_VERSION}:{settings_digest}:".encode('utf-8'))
+    fingerprint.update(root_digest)
+    return fingerprint.hexdigest()
+
+
+def scan_settings_digest(tag_processing_settings: Any, category_weights_file_path: Optional[Path] = None,
+                         catalog_schema_version: int = 0) -> str:
+    """
+    扫描设置的摘要：Tag处理设置 (TagProcessingSettings)、类别权重文件的内容和扫描目录的结构版本 (CATALOG_SCHEMA_VERSION)。
+    """
+    digest = hashlib.sha1(f"catalog-schema:{catalog_schema_version}:".encode('ascii'))
+    digest.update(repr((tag_processing_settings.match_mode,
+                        sorted(tag_processing_settings.extra_type_rules.items()),
+                        sorted(tag_processing_settings.alias_table.items()))).encode('utf-8', 'surrogatepass'))
+    if category_weights_file_path is not None:
+        try:
+            digest.update(category_weights_file_path.read_bytes())
+        except OSError:
+            digest.update(UNREADABLE_DIRECTORY_MARKER)
+    return digest.hexdigest()
+
+
+def history_entry_path(value: Any) -> Optional[Path]:
+    """
+    历史记录中的路径可能是 Path、普通字符串或 file:// 超链接形式（从历史Excel加载时），统一转换为本地路径。
+    """
+    if not value:
+        return None
+    path_str = str(value)
+    if path_str.startswith("file://"):
+        path_str = path_str[len("file://"):]
+    elif path_str.startswith("file:"):
+        path_str = path_str[len("file:"):]
+    return Path(path_str)
+
+
+def _history_folder_key(value: Any) -> Optional[str]:
+    path = history_entry_path(value)
+    if path is None:
+        return None
+    return os.path.normcase(os.path.normpath(normalize_drive_letter(str(path))))
+
+
+class FingerprintIndex:
+    """
+    各文件夹在历史记录中最近一次的条目。批量开始前由 HistoryManager.history_data 构建一次，
+    扫描线程只读取，不需要加锁。
+    """
+    def __init__(self, history_data: List[Dict[str, Any]]):
+        self._latest_entries: Dict[str, Dict[str, Any]] = {}
+        for entry in history_data:
+            key = _history_folder_key(entry.get("folder_path"))
+            if key:
+                self._latest_entries[key] = entry # 后出现的条目覆盖旧条目
+
+    def find_reusable_entry(self, folder_path: Path, fingerprint: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        指纹与最近一次扫描相同且那次的结果Excel仍然存在时返回那条历史记录，否则返回 None。
+        """
+        if not fingerprint:
+            return None
+        entry = self._latest_entries.get(_history_folder_key(folder_path))
+        if entry is None or entry.get("folder_fingerprint") != fingerprint:
+            return None
+        result_path = history_entry_path(entry.get("result_xlsx_abs_path"))
+        if result_path is None or result_path.suffix.lower() != ".xlsx" or not result_path.exists():
+            return None
+        return entry
@@ -0,0 +1,364 @@
+# folder_watcher.py
+"""
+监视模式：对正在被反推程序写入的文件夹进行一次全量扫描后，持续订阅文件系统事件，
+只重新处理发生变化的图片/TXT对，增量维护Tag词频，并按防抖间隔刷新结果Excel。
+
+事件来源优先使用 watchdog（Windows 上为 ReadDirectoryChangesW，Linux 上为 inotify），
+未安装 watchdog 时退回到基于 stat 快照的轮询。
+"""
+import os
+import time
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+from file_system_utils import normalize_drive_letter, get_file_details
+from excel_utilities import create_scan_result_workbook, write_tag_frequency, set_fixed_column_widths, FIXED_COLUMN_WIDTH
+from scanner import (
+    Scanner,
+    ScannerConfig,
+    DefaultTagAggregator,
+    ExcelDataWriter,
+    ProcessedFileData,
+    extract_tags,
+)
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+    WATCHDOG_AVAILABLE = False
+
+# --- Configuration ---
+DEFAULT_DEBOUNCE_SECONDS = 5.0  # 最后一个事件之后静默多久才刷新结果
+POLL_INTERVAL_SECONDS = 1.0     # 主循环（以及轮询模式下快照）的间隔
+
+
+class _CollectingDataWriter:
+    """
+    DataWriter 实现：不直接写入Excel，而是按文件绝对路径收集处理结果，
+    以便后续对单个文件进行替换或删除。
+    """
+    def __init__(self):
+        self.rows: Dict[str, ProcessedFileData] = {}
+
+    def write_matched_data(self, data: ProcessedFileData):
+        self.rows[data.file_absolute_path] = data
+
+    def write_no_txt_data(self, data: ProcessedFileData):
+        self.rows[data.file_absolute_path] = data
+
+
+class PendingChanges:
+    """
+    线程安全的待处理路径集合，记录最后一次事件的时间用于防抖。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths: Set[str] = set()
+        self._last_event_time = 0.0
+
+    def add(self, path_str: str):
+        with self._lock:
+            self._paths.add(path_str)
+            self._last_event_time = time.monotonic()
+
+    def is_ready(self, debounce_seconds: float) -> bool:
+        with self._lock:
+            return bool(self._paths) and time.monotonic() - self._last_event_time >= debounce_seconds
+
+    def drain(self) -> Set[str]:
+        with self._lock:
+            paths, self._paths = self._paths, set()
+            return paths
+
+
+class _WatchdogHandler(FileSystemEventHandler):
+    def __init__(self, pending: PendingChanges):
+        super().__init__()
+        self.pending = pending
+
+    def on_any_event(self, event):
+        self.pending.add(event.src_path)
+        dest_path = getattr(event, "dest_path", None)
+        if dest_path:
+            self.pending.add(dest_path)
+
+
+class WatchdogEventSource:
+    """
+    基于 watchdog 的事件来源，事件由观察者线程推送到 PendingChanges。
+    """
+    def __init__(self, base_folder_path: Path, pending: PendingChanges):
+        self.base_folder_path = base_folder_path
+        self.pending = pending
+        self._observer = Observer()
+
+    def start(self):
+        self._observer.schedule(_WatchdogHandler(self.pending), str(self.base_folder_path), recursive=True)
+        self._observer.start()
+
+    def poll(self):
+        pass # 事件由观察者线程推送，无需主动轮询
+
+    def stop(self):
+        self._observer.stop()
+        self._observer.join()
+
+
+class PollingEventSource:
+    """
+    未安装 watchdog 时的退路：每次 poll 只做 stat 级别的目录遍历，
+    与上一次快照对比 (mtime, size)，将新增、修改、删除的文件加入 PendingChanges。
+    """
+    def __init__(self, base_folder_path: Path, pending: PendingChanges, config: ScannerConfig):
+        self.base_folder_path = base_folder_path
+        self.pending = pending
+        self.config = config
+        self._snapshot: Dict[str, Tuple[int, int]] = {}
+
+    def _take_snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snapshot: Dict[str, Tuple[int, int]] = {}
+        stack = [str(self.base_folder_path)]
+        while stack:
+            current_dir = stack.pop()
+            try:
+                with os.scandir(current_dir) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if entry.name not in self.config.skip_folders:
+                                    stack.append(entry.path)
+                            elif entry.is_file():
+                                st = entry.stat()
+                                snapshot[entry.path] = (st.st_mtime_ns, st.st_size)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return snapshot
+
+    def start(self):
+        self._snapshot = self._take_snapshot()
+
+    def poll(self):
+        new_snapshot = self._take_snapshot()
+        for path_str, signature in new_snapshot.items():
+            if self._snapshot.get(path_str) != signature:
+                self.pending.add(path_str)
+        for path_str in self._snapshot.keys() - new_snapshot.keys():
+            self.pending.add(path_str)
+        self._snapshot = new_snapshot
+
+    def stop(self):
+        pass
+
+
+class LiveScanIndex:
+    """
+    监视模式下的内存索引：保存每个图片文件的处理结果及其贡献的标签，
+    文件变化时只撤销旧贡献并重新处理该文件，保证Tag词频始终与磁盘一致。
+    """
+    def __init__(self, base_folder_path: Path, logger_obj, config: Optional[ScannerConfig] = None):
+        self.base_folder_path = base_folder_path
+        self.logger_obj = logger_obj
+        self.config = config or ScannerConfig()
+        self.tag_aggregator = DefaultTagAggregator()
+        self.collector = _CollectingDataWriter()
+        self.scanner = Scanner(logger_obj=logger_obj, data_writer=self.collector,
+                               config=self.config, tag_aggregator=self.tag_aggregator)
+        self.txt_by_stem: Dict[str, Path] = {}
+        self.images_by_stem: Dict[str, Set[str]] = defaultdict(set)
+
+    @property
+    def rows(self) -> Dict[str, ProcessedFileData]:
+        return self.collector.rows
+
+    @staticmethod
+    def _row_key(path: Path) -> str:
+        return normalize_drive_letter(str(path.resolve()))
+
+    def initial_scan(self) -> Tuple[int, int, int]:
+        """
+        执行一次全量扫描，建立索引。
+        Returns:
+            Tuple[int, int, int]: (总文件数, 找到TXT数, 未找到TXT数)
+        """
+        total_files, found_txt_count, not_found_txt_count, _ = \
+            self.scanner.scan_files_and_extract_data(self.base_folder_path)
+        self.txt_by_stem = dict(self.scanner.txt_files_map)
+        for key in self.rows:
+            stem, _ = get_file_details(Path(key))
+            self.images_by_stem[stem.lower()].add(key)
+        return total_files, found_txt_count, not_found_txt_count
+
+    def _is_skipped_path(self, path: Path) -> bool:
+        return any(sf in path.parts for sf in self.config.skip_folders)
+
+    def _reprocess_image(self, key: str):
+        image_path = Path(key)
+        stem_key = get_file_details(image_path)[0].lower()
+
+        old_data = self.rows.pop(key, None)
+        if old_data is not None:
+            self.tag_aggregator.remove_tags(extract_tags(old_data.cleaned_data))
+            self.scanner.negative_tag_aggregator.remove_tags(extract_tags(old_data.negative_prompt))
+
+        if not image_path.is_file():
+            self.images_by_stem[stem_key].discard(key)
+            return
+
+        processed_data = self.scanner._process_file_metadata(image_path, self.txt_by_stem.get(stem_key))
+        self.rows[key] = processed_data
+        self.images_by_stem[stem_key].add(key)
+
+    def apply_changes(self, changed_paths: Set[str]) -> int:
+        """
+        根据变化的路径集合更新索引。
+        - TXT 变化：更新 stem -> TXT 映射，并重新处理所有同名图片。
+        - 图片变化：重新处理该图片（已删除则移除其行并撤销其标签）。
+        - 目录变化：新目录下的文件全部加入；已删除目录下的已知行全部重新检查。
+        Returns:
+            int: 重新处理的图片数量。
+        """
+        affected_keys: Set[str] = set()
+        pending_paths = [Path(p) for p in changed_paths]
+
+        while pending_paths:
+            path = pending_paths.pop()
+            if self._is_skipped_path(path):
+                continue
+
+            if path.is_dir():
+                for root_str, dir_names, file_names in os.walk(path):
+                    dir_names[:] = [d for d in dir_names if d not in self.config.skip_folders]
+                    pending_paths.extend(Path(root_str) / f for f in file_names)
+                continue
+
+            key = self._row_key(path)
+            stem, ext = get_file_details(path)
+            ext_lower = ext.lower()
+            stem_key = stem.lower()
+
+            if ext_lower == '.txt':
+                if path.is_file():
+                    self.txt_by_stem[stem_key] = path
+                elif stem_key in self.txt_by_stem and self._row_key(self.txt_by_stem[stem_key]) == key:
+                    del self.txt_by_stem[stem_key]
+                affected_keys.update(self.images_by_stem.get(stem_key, ()))
+            elif ext_lower in self.config.skip_extensions:
+                continue
+            elif path.is_file() or key in self.rows:
+                affected_keys.add(key)
+            else:
+                # 可能是已删除的目录：重新检查其下所有已知文件
+                prefix = key.rstrip("\\/") + os.sep
+                affected_keys.update(k for k in self.rows if k.startswith(prefix))
+
+        for key in affected_keys:
+            self._reprocess_image(key)
+
+        # 监视期间错误记录只用于即时日志，避免长时间运行时无限增长
+        self.scanner.error_aggregator.clear()
+        return len(affected_keys)
+
+    def write_workbook(self, output_excel_path: Path) -> bool:
+        """
+        根据当前索引重建结果Excel。先写临时文件再替换，避免查看者读到写了一半的文件。
+        Returns:
+            bool: 保存成功返回True；若目标被占用等原因失败返回False（下次刷新时重试）。
+        """
+        wb, ws_matched, ws_no_txt, ws_tag_frequency, ws_negative_tag_frequency = create_scan_result_workbook()
+        excel_data_writer = ExcelDataWriter(ws_matched, ws_no_txt, self.logger_obj)
+        for processed_data in self.rows.values():
+            if processed_data.is_matched_flag:
+                excel_data_writer.write_matched_data(processed_data)
+            else:
+                excel_data_writer.write_no_txt_data(processed_data)
+
+        write_tag_frequency(ws_tag_frequency, self.tag_aggregator.get_counts())
+        write_tag_frequency(ws_negative_tag_frequency, self.scanner.negative_tag_aggregator.get_counts())
+
+        for worksheet in [ws_matched, ws_no_txt, ws_tag_frequency, ws_negative_tag_frequency]:
+            set_fixed_column_widths(worksheet, FIXED_COLUMN_WIDTH, self.logger_obj)
+
+        temp_excel_path = output_excel_path.with_name(f"~{output_excel_path.name}.tmp")
+        try:
+            wb.save(str(temp_excel_path))
+            os.replace(temp_excel_path, output_excel_path)
+        except PermissionError as e:
+            self.logger_obj.warning(f"警告: 结果文件 '{normalize_drive_letter(str(output_excel_path))}' 被占用，将在下次刷新时重试。错误: {e}")
+            return False
+        except Exception as e:
+            self.logger_obj.error(f"错误: 刷新结果文件 '{normalize_drive_letter(str(output_excel_path))}' 失败: {e}")
+            return False
+        finally:
+            # 保存或替换失败时删除临时文件，目标长时间被占用时不会在每次刷新后堆积
+            if temp_excel_path.exists():
+                try:
+                    os.remove(temp_excel_path)
+                except OSError as e:
+                    self.logger_obj.warning(f"警告: 无法删除临时结果文件 '{normalize_drive_letter(str(temp_excel_path))}': {e}")
+
+        # 已写入并输出过的行内错误不再在下次刷新时重复记录
+        for processed_data in self.rows.values():
+            processed_data.processing_errors = ()
+        return True
+
+
+def run_watch_mode(base_folder_path: Path, output_excel_path: Path, logger_obj,
+                   debounce_seconds: float = DEFAULT_DEBOUNCE_SECONDS):
+    """
+    监视模式主循环：全量扫描一次并写出结果，之后只处理变化的文件，直到按 Ctrl+C 退出。
+    Args:
+        base_folder_path (Path): 要监视的文件夹。
+        output_excel_path (Path): 结果Excel路径，每次刷新都会覆盖该文件。
+        logger_obj: Loguru logger 实例。
+        debounce_seconds (float): 最后一个文件事件之后等待多少秒才刷新结果。
+    """
+    live_index = LiveScanIndex(base_folder_path, logger_obj)
+    total_files, found_txt_count, not_found_txt_count = live_index.initial_scan()
+    logger_obj.info(f"监视模式初始扫描完成: 总文件数 {total_files}, 找到TXT {found_txt_count}, 未找到TXT {not_found_txt_count}")
+    needs_refresh = not live_index.write_workbook(output_excel_path)
+    if not needs_refresh:
+        logger_obj.info(f"结果已写入: {normalize_drive_letter(str(output_excel_path))}")
+
+    pending = PendingChanges()
+    if WATCHDOG_AVAILABLE:
+        event_source = WatchdogEventSource(base_folder_path, pending)
+        logger_obj.info("监视模式: 使用 watchdog 订阅文件系统事件。")
+    else:
+        event_source = PollingEventSource(base_folder_path, pending, live_index.config)
+        logger_obj.info(f"监视模式: 未安装 watchdog，退回到每 {POLL_INTERVAL_SECONDS} 秒一次的 stat 轮询。")
+    event_source.start()
+    logger_obj.info(f"开始监视 {normalize_drive_letter(str(base_folder_path))}，防抖间隔 {debounce_seconds} 秒。按 Ctrl+C 退出。")
+
+    def _flush():
+        changed_paths = pending.drain()
+        reprocessed_count = live_index.apply_changes(changed_paths) if changed_paths else 0
+        if reprocessed_count:
+            logger_obj.info(f"检测到 {len(changed_paths)} 个路径变化，重新处理了 {reprocessed_count} 个图片文件。")
+        return reprocessed_count
+
+    try:
+        while True:
+            time.sleep(POLL_INTERVAL_SECONDS)
+            event_source.poll()
+            if pending.is_ready(debounce_seconds):
+                if _flush():
+                    needs_refresh = True
+            if needs_refresh:
+                needs_refresh = not live_index.write_workbook(output_excel_path)
+                if not needs_refresh:
+                    logger_obj.info(f"结果已刷新: {normalize_drive_letter(str(output_excel_path))} (共 {len(live_index.rows)} 行)")
+    except KeyboardInterrupt:
+        logger_obj.info("收到退出信号，正在处理剩余变化并写出最终结果...")
+    finally:
+        event_source.stop()
+        if _flush() or needs_refresh:
+            live_index.write_workbook(output_excel_path)
+        logger_obj.info("监视模式已结束。")
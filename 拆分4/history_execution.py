@@ -3,6 +3,7 @@
 import os
 import sys
 import datetime
+import threading
 from pathlib import Path
 from typing import Dict, List, Any, Optional, Tuple
 
@@ -10,7 +11,8 @@ from typing import Dict, List, Any, Optional, Tuple
 from openpyxl import Workbook, load_workbook
 from openpyxl.utils.exceptions import InvalidFileException
 
-from file_system_utils import normalize_drive_letter, create_directory_if_not_exists, copy_file
+from file_system_utils import normalize_drive_letter, create_directory_if_not_exists
+from snapshot_cache import SnapshotCache, SnapshotRetention
 
 # 导入辅助函数和常量
 from excel_utilities import set_hyperlink_and_style, set_fixed_column_widths
@@ -20,6 +22,7 @@ from excel_utilities import FIXED_COLUMN_WIDTH
 # 这些常量可以移到主配置文件中，这里保留是为了模块内部可见性
 HISTORY_FOLDER_NAME = "操作记录" # 可以考虑移除，因为路径是传入的
 HISTORY_EXCEL_NAME = "operation_records.xlsx" # 可以考虑移除，因为路径是传入的
+LEGACY_CACHED_SNAPSHOT_GLOB = "operation_history_cached_*.xlsx" # 旧版按时间戳逐个复制的快照文件
 
 # 移除 _handle_history_caching 函数，其逻辑将移入 HistoryManager 类中
 # 从这里删除了原 _handle_history_caching 函数
@@ -36,7 +39,8 @@ class HistoryManager:
                  field_definitions: List[Dict[str, Any]],
                  sheet_name: str = "操作记录",
                  cache_folder_path: Optional[Path] = None, # 新增参数
-                 files_to_open_at_end: Optional[List[Path]] = None # 新增参数
+                 files_to_open_at_end: Optional[List[Path]] = None, # 新增参数
+                 snapshot_retention: Optional[SnapshotRetention] = None
                 ):
         """
         初始化HistoryManager。
@@ -53,6 +57,7 @@ class HistoryManager:
             sheet_name (str, optional): Excel工作表的名称，默认为"操作记录"。
             cache_folder_path (Optional[Path]): 缓存历史记录Excel文件的目录。如果为None则不进行缓存。
             files_to_open_at_end (Optional[List[Path]]): 引用外部列表，用于存储最终需要自动打开的文件路径。
+            snapshot_retention (Optional[SnapshotRetention]): 缓存快照的保留策略，None 时使用默认策略。
         """
         self.history_file_path = history_file_path
         self.logger_obj = logger_obj
@@ -74,6 +79,13 @@ class HistoryManager:
         # 新增：缓存相关属性
         self.cache_folder_path = cache_folder_path
         self.files_to_open_at_end = files_to_open_at_end if files_to_open_at_end is not None else []
+        self.snapshot_cache: Optional[SnapshotCache] = None
+        if cache_folder_path:
+            self.snapshot_cache = SnapshotCache(cache_folder_path, logger_obj, snapshot_retention,
+                                                legacy_snapshot_glob=LEGACY_CACHED_SNAPSHOT_GLOB)
+
+        # --parallel-devices 时多个扫描线程同时添加记录，添加和保存都要持有此锁
+        self._lock = threading.Lock()
 
         self._load_history_from_excel()
 
@@ -174,7 +186,8 @@ class HistoryManager:
         if 'timestamp' not in entry_data:
             entry_data['timestamp'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        self.history_data.append(entry_data)
+        with self._lock:
+            self.history_data.append(entry_data)
         self.logger_obj.info(f"操作记录成功添加至内存: 条目数据: {entry_data.get('timestamp', '未知时间')}")
 
     def _prepare_excel_for_saving(self) -> Optional[Tuple[Workbook, Any]]:
@@ -269,26 +282,24 @@ class HistoryManager:
 
     def _create_cached_snapshot(self, final_history_excel_path: Path) -> None:
         """
-        原理：将保存成功的主历史记录Excel文件复制到缓存目录，作为快照。
-        实现过程：检查缓存目录是否存在，生成带时间戳的文件名，然后执行复制操作。
+        原理：将保存成功的主历史记录Excel文件存入按内容寻址的快照缓存。
+        实现过程：检查缓存目录是否存在，交给 SnapshotCache 计算内容摘要；
+                 内容未变化时不写入，变化时保存新数据块并按保留策略淘汰旧快照。
         主要改动点：这是原 _handle_history_caching 函数的核心逻辑，现在作为类方法。
         """
-        if self.cache_folder_path:
+        if self.snapshot_cache:
             if create_directory_if_not_exists(self.cache_folder_path, self.logger_obj):
-                current_timestamp_for_cache = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                # 保持文件名一致性，使用scan_history_cached_前缀，因为这是扫描项目的历史记录
-                cached_history_file_name = f"operation_history_cached_{current_timestamp_for_cache}.xlsx"                
-                cached_history_file_path = self.cache_folder_path / cached_history_file_name
-
-                self.logger_obj.info(f"开始复制历史记录到缓存文件夹: {normalize_drive_letter(str(cached_history_file_path))}")
-                copy_cache_success = copy_file(final_history_excel_path, cached_history_file_path, self.logger_obj)
-
-                if copy_cache_success:
-                    self.logger_obj.info("历史记录已成功复制到缓存文件夹。")
-                    if self.files_to_open_at_end is not None:
-                        self.files_to_open_at_end.append(cached_history_file_path)
+                self.logger_obj.info(f"开始保存历史记录快照到缓存文件夹: {normalize_drive_letter(str(self.cache_folder_path))}")
+                cached_history_file_path = self.snapshot_cache.store(final_history_excel_path)
+
+                if cached_history_file_path:
+                    self.logger_obj.info("历史记录快照已保存到缓存文件夹。")
+                    # 快照数据块按内容共享，只打开它的副本
+                    history_copy_path = self.snapshot_cache.open_copy(cached_history_file_path)
+                    if history_copy_path and self.files_to_open_at_end is not None:
+                        self.files_to_open_at_end.append(history_copy_path)
                 else:
-                    self.logger_obj.error("历史记录复制到缓存文件夹失败。")
+                    self.logger_obj.error("历史记录快照保存到缓存文件夹失败。")
             else:
                 self.logger_obj.error(f"无法创建缓存文件夹: {normalize_drive_letter(str(self.cache_folder_path))}，将无法复制历史记录。")
         else:
@@ -301,30 +312,31 @@ class HistoryManager:
         Returns:
             bool: 如果保存成功返回True，否则返回False。
         """
-        self.logger_obj.info(f"开始将内存中的数据记录保存到Excel: {normalize_drive_letter(str(self.history_file_path))}")
+        with self._lock:
+            self.logger_obj.info(f"开始将内存中的数据记录保存到Excel: {normalize_drive_letter(str(self.history_file_path))}")
 
-        excel_preparation = self._prepare_excel_for_saving()
-        if excel_preparation is None:
-            return False
+            excel_preparation = self._prepare_excel_for_saving()
+            if excel_preparation is None:
+                return False
 
-        wb, ws = excel_preparation
+            wb, ws = excel_preparation
 
-        try:
-            self._write_history_data_to_sheet(ws)
+            try:
+                self._write_history_data_to_sheet(ws)
 
-            # 设置所有列宽
-            set_fixed_column_widths(ws, FIXED_COLUMN_WIDTH, self.logger_obj)
+                # 设置所有列宽
+                set_fixed_column_widths(ws, FIXED_COLUMN_WIDTH, self.logger_obj)
 
-            wb.save(str(self.history_file_path))
-            self.logger_obj.info(f"成功将数据记录保存到Excel: {normalize_drive_letter(str(self.history_file_path))}")
+                wb.save(str(self.history_file_path))
+                self.logger_obj.info(f"成功将数据记录保存到Excel: {normalize_drive_letter(str(self.history_file_path))}")
 
-            # 调用内部缓存方法
-            self._create_cached_snapshot(self.history_file_path) # 成功保存后，立即生成缓存快照
+                # 调用内部缓存方法
+                self._create_cached_snapshot(self.history_file_path) # 成功保存后，立即生成缓存快照
 
-            return True
-        except PermissionError as e:
-            self.logger_obj.error(f"错误: 没有权限写入记录文件 '{normalize_drive_letter(str(self.history_file_path))}'，或文件被占用。请关闭文件。详情: {e}")
-            return False
-        except Exception as e:
-            self.logger_obj.error(f"错误: 将数据记录保存到Excel失败 {normalize_drive_letter(str(self.history_file_path))}: 未知错误: {e}")
-            return False
+                return True
+            except PermissionError as e:
+                self.logger_obj.error(f"错误: 没有权限写入记录文件 '{normalize_drive_letter(str(self.history_file_path))}'，或文件被占用。请关闭文件。详情: {e}")
+                return False
+            except Exception as e:
+                self.logger_obj.error(f"错误: 将数据记录保存到Excel失败 {normalize_drive_letter(str(self.history_file_path))}: 未知错误: {e}")
+                return False
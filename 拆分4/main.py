@@ -2,6 +2,7 @@
 
 import os
 import sys
+import argparse
 import datetime
 import time
 from pathlib import Path
@@ -13,30 +14,79 @@ from my_logger import setup_logger
 
 # 从 excel_utilities 导入相关函数和常量
 from excel_utilities import FIXED_COLUMN_WIDTH
-from excel_utilities import create_empty_workbook, create_sheet_with_headers, set_column_widths, set_hyperlink_and_style, set_fixed_column_widths
+from excel_utilities import set_fixed_column_widths
+from excel_utilities import create_scan_result_workbook, write_tag_frequency, write_error_summary, convert_to_write_only_workbook
+from excel_utilities import save_workbook_with_retries
 
 
 from file_system_utils import (
     generate_folder_prefix,
+    validate_directory,
     read_batch_paths,
     normalize_drive_letter,
-    create_directory_if_not_exists,
-    copy_file
+    create_directory_if_not_exists
 )
 
 # 从重构后的 scanner.py 导入函数
-from scanner import scan_files_and_extract_data, ExcelDataWriter
+from scanner import scan_files_and_extract_data, ExcelDataWriter, DefaultTagAggregator
+from error_summary import ScanErrorAggregator
 
 # 导入 HistoryManager 和历史记录相关常量。注意：_handle_history_caching 已从这里移除导入
 from history_execution import HistoryManager, HISTORY_FOLDER_NAME, HISTORY_EXCEL_NAME
 
 # 导入自动打开文件的函数
-from file_opener import open_output_files_automatically
+from file_opener import open_output_files_automatically, ArtifactCollector
+
+# 监视模式
+from folder_watcher import run_watch_mode, DEFAULT_DEBOUNCE_SECONDS
+
+# 检查点与批量台账
+from checkpoint import (
+    ScanCheckpoint,
+    BatchLedger,
+    CHECKPOINT_FOLDER_NAME,
+    BATCH_LEDGER_FILE_NAME,
+    DEFAULT_CHECKPOINT_INTERVAL_FILES
+)
+
+# 历史记录快照缓存
+from snapshot_cache import SnapshotRetention
+
+# 全局扫描目录 (SQLite)
+from catalog import ScanCatalog, CatalogDataWriter, catalog_folder_key, CATALOG_FILE_NAME, CATALOG_SCHEMA_VERSION
+from tag_index import run_tag_query, DEFAULT_QUERY_LIMIT
+from caption_search import run_caption_search
+from caption_grep import run_caption_grep, DEFAULT_GREP_WORKERS
+
+# Tag 规范化与别名表
+from tag_aliases import load_alias_table, TAG_ALIAS_FILE_NAME
+from tag_processing import configure_tag_aliases, configure_tag_match_mode, configure_type_rules, TAG_MATCH_MODE, TAG_MATCH_MODES
+from tag_rules import TagQueryError, parse_type_rule_argument
+from category_scoring import load_category_scorer, ScoringDataWriter, CATEGORY_WEIGHTS_FILE_NAME
+from tag_batch import configure_tag_workers, DEFAULT_TAG_WORKERS
+from tag_processing import shrink_tag_caches, get_tag_processing_settings
+from memory_budget import MemoryGovernor, MemoryBudgetScope, DEFAULT_MEMORY_BUDGET_MB, DEGRADE_PRIORITY_CACHES, DEGRADE_PRIORITY_RESULT_ROWS
+
+# 文件夹指纹：未变化的文件夹直接复用上次的结果
+from folder_fingerprint import compute_folder_fingerprint, scan_settings_digest, history_entry_path, FingerprintIndex
+
+# 批量调度
+from batch_scheduler import (
+    estimate_folder_costs,
+    build_device_groups,
+    run_device_groups,
+    DEFAULT_MAX_PARALLEL_DEVICES
+)
 
 # --- Configuration ---
 OUTPUT_FOLDER_NAME = "反推记录"
 CACHE_FOLDER_NAME = "cache"
 
+# 历史记录快照保留策略 (None 表示不限制该项)
+SNAPSHOT_KEEP_LAST = 50
+SNAPSHOT_MAX_BYTES = 512 * 1024 * 1024
+SNAPSHOT_MAX_AGE_DAYS = 90
+
 
 # 文件保存重试参数
 MAX_SAVE_RETRIES = 5
@@ -49,11 +99,113 @@ log_output_folder = script_dir / "logs" # 或者根据你的配置路径
 # _handle_history_caching 函数定义已从这里删除，并移动到 history_execution.py 中
 
 
-def main():
+def parse_arguments(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    解析命令行参数。不带参数运行时保持原有行为：读取 batchPath.txt 批量扫描。
+    """
+    parser = argparse.ArgumentParser(description="扫描图片与同名TXT反推结果并生成Excel。")
+    parser.add_argument("--watch", metavar="FOLDER", type=Path, default=None,
+                        help="监视模式：全量扫描该文件夹一次后持续监听文件变化，增量刷新结果Excel。")
+    parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE_SECONDS,
+                        help=f"监视模式下最后一次文件变化后等待多少秒再刷新结果 (默认 {DEFAULT_DEBOUNCE_SECONDS})。")
+    parser.add_argument("--resume", action="store_true",
+                        help="从上次中断的批量任务继续：跳过已完成的文件夹，未完成的文件夹从最后一个检查点继续扫描。")
+    parser.add_argument("--checkpoint-interval", type=int, default=DEFAULT_CHECKPOINT_INTERVAL_FILES,
+                        help=f"每处理多少个文件保存一次扫描检查点 (默认 {DEFAULT_CHECKPOINT_INTERVAL_FILES})。")
+    parser.add_argument("--parallel-devices", type=int, default=DEFAULT_MAX_PARALLEL_DEVICES,
+                        help=f"批量模式下最多同时处理多少个不同设备上的文件夹 (默认 {DEFAULT_MAX_PARALLEL_DEVICES})，设为1则完全顺序执行。")
+    parser.add_argument("--catalog", metavar="DB_PATH", type=Path, default=None,
+                        help=f"扫描目录数据库路径 (默认: 历史记录文件夹下的 {CATALOG_FILE_NAME})。")
+    parser.add_argument("--no-excel", action="store_true",
+                        help="只写入扫描目录数据库，不生成每个文件夹的结果Excel。")
+    parser.add_argument("--tag-query", metavar="EXPR", default=None,
+                        help='在扫描目录的Tag倒排索引中查询后退出，例如 "1girl AND red_hair AND NOT monochrome"；'
+                             '支持 AND/OR/NOT、括号以及前缀匹配 (red_*)。')
+    parser.add_argument("--search", metavar="QUERY", default=None,
+                        help='在反推文本（原始TXT内容和清洗后内容）中全文检索后退出，按相关度排序并输出摘要；'
+                             '支持短语 ("red hair")、AND/OR/NOT 以及部分Tag名或中文子串。')
+    parser.add_argument("--grep", metavar="PATTERN", default=None,
+                        help="不建索引、不生成Excel，直接并行搜索TXT文件内容，逐行输出匹配的 图片路径<TAB>TXT路径 后退出。")
+    parser.add_argument("--in", dest="grep_folders", metavar="FOLDER", type=Path, action="append", default=None,
+                        help="--grep 搜索的文件夹，可重复指定；未指定时使用 batchPath.txt 中的文件夹。")
+    parser.add_argument("--regex", action="store_true", help="--grep 的模式按正则表达式匹配（默认按字面量）。")
+    parser.add_argument("--ignore-case", action="store_true", help="--grep 匹配时忽略大小写。")
+    parser.add_argument("--workers", type=int, default=DEFAULT_GREP_WORKERS,
+                        help=f"--grep 并行读取TXT文件的线程数 (默认 {DEFAULT_GREP_WORKERS})。")
+    parser.add_argument("--tag-aliases", metavar="FILE", type=Path, default=None,
+                        help=f"Tag别名文件 (CSV: 别名,规范名 或 booru 导出的 antecedent_name/consequent_name；JSON: {{别名: 规范名}})。"
+                             f"默认使用脚本目录下的 {TAG_ALIAS_FILE_NAME}（存在时）。")
+    parser.add_argument("--match-mode", choices=TAG_MATCH_MODES, default=TAG_MATCH_MODE,
+                        help=f"类型检测和Tag清洗的关键词匹配方式 (默认 {TAG_MATCH_MODE})：exact 逐个Tag精确匹配（支持 * ? 通配符），"
+                             f"substring 关键词出现在Tag任意位置即命中（旧行为）。")
+    parser.add_argument("--type-rule", dest="type_rules", metavar="NAME=EXPR", action="append", default=None,
+                        help="追加或覆盖一个提示词类型规则，可重复使用，例如 --type-rule \"R18(有码)=@R18 AND NOT uncensored\"。"
+                             "表达式语法与 --tag-query 相同，@类型名 引用排在前面的类型。")
+    parser.add_argument("--tag-workers", type=int, default=DEFAULT_TAG_WORKERS,
+                        help=f"Tag清洗和类型检测使用的工作进程数 (默认 CPU 核数 {DEFAULT_TAG_WORKERS})，1 表示只在主进程处理。"
+                             f"只有一批待处理的TXT足够多时才会启用进程池。")
+    parser.add_argument("--category-weights", metavar="FILE", type=Path, default=None,
+                        help=f"类别权重文件 (CSV: category,tag,weight，tag 为空的行设置阈值；JSON 格式见 category_scoring.py)，"
+                             f"启用后“匹配文件”追加评分类型和各类别评分列。默认使用脚本目录下的 {CATEGORY_WEIGHTS_FILE_NAME}（存在时）。")
+    parser.add_argument("--memory-budget", metavar="MB", type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help="进程内存预算 (MiB，默认 0 不限制)。内存占用接近预算时依次缩小缓存和扫描块、把Tag计数转存到临时文件、"
+                             "把结果Excel切换为流式写入，执行的措施记录在扫描日志中。需要 psutil 或 Linux 的 /proc。")
+    parser.add_argument("--rescan", action="store_true",
+                        help="忽略文件夹指纹，重新扫描所有文件夹。默认情况下，目录结构和扫描设置都与上次相同的文件夹"
+                             "直接复用上次的结果Excel，只追加一条历史记录（原地修改的TXT内容无法被指纹发现）。")
+    parser.add_argument("--limit", type=int, default=DEFAULT_QUERY_LIMIT,
+                        help=f"查询/检索时最多输出多少条结果 (默认 {DEFAULT_QUERY_LIMIT})，0 表示不限制。")
+    return parser.parse_args(argv)
+
+
+def run_watch(folder_path: Path, output_base_dir: Path, debounce_seconds: float):
+    """
+    监视模式入口：结果写入固定文件名，每次刷新覆盖，方便在查看器中重新加载。
+    """
+    if not validate_directory(folder_path, logger):
+        logger.critical(f"致命错误: 监视路径无效: {normalize_drive_letter(str(folder_path))}")
+        sys.exit(1)
+
+    folder_prefix = generate_folder_prefix(folder_path)
+    watch_log_file = output_base_dir / f"{folder_prefix}_watch_log_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+    watch_excel_file = output_base_dir / f"{folder_prefix}_scan_results_watch.xlsx"
+
+    watch_log_sink_id = logger.add(
+        str(watch_log_file),
+        level="INFO",
+        rotation="5 MB",
+        compression="zip",
+        enqueue=True,
+        encoding="utf-8",
+        format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {message}"
+    )
+    try:
+        run_watch_mode(folder_path, watch_excel_file, logger, debounce_seconds)
+    finally:
+        logger.remove(watch_log_sink_id)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_arguments(argv)
+
     history_folder_path = script_dir / HISTORY_FOLDER_NAME
+    catalog_db_path = args.catalog if args.catalog is not None else history_folder_path / CATALOG_FILE_NAME
+
+    # 查询模式只读取扫描目录，不创建日志和输出文件夹
+    if args.tag_query is not None:
+        sys.exit(run_tag_query(catalog_db_path, args.tag_query, args.limit))
+    if args.search is not None:
+        sys.exit(run_caption_search(catalog_db_path, args.search, args.limit))
+    if args.grep is not None:
+        # 结果写到标准输出，日志只保留警告和错误（写到标准错误），避免混入结果
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+        grep_folders = args.grep_folders or read_batch_paths(script_dir / "batchPath.txt", logger)
+        sys.exit(run_caption_grep(grep_folders, args.grep, logger, args.regex, args.ignore_case, args.workers))
     output_base_dir = script_dir / OUTPUT_FOLDER_NAME
     final_history_excel_path = history_folder_path / HISTORY_EXCEL_NAME
     cache_folder_path = script_dir / CACHE_FOLDER_NAME
+    checkpoint_folder_path = script_dir / CHECKPOINT_FOLDER_NAME
 
     # 配置日志系统，并获取错误日志文件路径
     error_warning_log_file_path = setup_logger(log_output_folder)
@@ -70,10 +222,36 @@ def main():
         logger.critical("致命错误: 无法创建缓存文件夹，程序退出。")
         sys.exit(1)
 
+    if args.match_mode != TAG_MATCH_MODE:
+        configure_tag_match_mode(args.match_mode)
+    if args.type_rules:
+        try:
+            configure_type_rules(dict(parse_type_rule_argument(argument) for argument in args.type_rules))
+        except TagQueryError as e:
+            logger.critical(f"致命错误: 类型规则无效: {e}")
+            sys.exit(1)
+    tag_alias_file_path = args.tag_aliases if args.tag_aliases is not None else script_dir / TAG_ALIAS_FILE_NAME
+    if args.tag_aliases is not None or tag_alias_file_path.exists():
+        configure_tag_aliases(load_alias_table(tag_alias_file_path, cache_folder_path, logger))
+    if args.tag_workers != DEFAULT_TAG_WORKERS:
+        configure_tag_workers(args.tag_workers)
+    category_weights_file_path = args.category_weights if args.category_weights is not None else script_dir / CATEGORY_WEIGHTS_FILE_NAME
+    category_scorer = None
+    if args.category_weights is not None or category_weights_file_path.exists():
+        category_scorer = load_category_scorer(category_weights_file_path, logger)
+
+    if not create_directory_if_not_exists(checkpoint_folder_path, logger):
+        logger.critical("致命错误: 无法创建检查点文件夹，程序退出。")
+        sys.exit(1)
+
     if not create_directory_if_not_exists(output_base_dir, logger):
         logger.critical("致命错误: 无法创建输出文件夹 (反推记录)，程序退出。")
         sys.exit(1)
 
+    if args.watch is not None:
+        run_watch(args.watch, output_base_dir, args.debounce)
+        return
+
     # --- 开始修改历史管理器初始化和使用方式 ---
     # 定义文件扫描项目的字段结构
     # 这里的顺序决定了Excel中列的顺序
@@ -84,14 +262,18 @@ def main():
         {"internal_key": "total_files", "excel_header": "总文件数", "is_path": False},
         {"internal_key": "found_txt_count", "excel_header": "找到TXT文件数", "is_path": False},
         {"internal_key": "not_found_txt_count", "excel_header": "未找到TXT文件数", "is_path": False},
+        {"internal_key": "scan_duration_seconds", "excel_header": "扫描耗时(秒)", "is_path": False},
         {"internal_key": "log_file_abs_path", "excel_header": "Log文件绝对路径", "is_path": True,
          "hyperlink_display_text": "打开Log", "hyperlink_not_exist_text": "Log文件不存在"},
         {"internal_key": "result_xlsx_abs_path", "excel_header": "结果XLSX文件绝对路径", "is_path": True,
-         "hyperlink_display_text": "打开结果XLSX", "hyperlink_not_exist_text": "结果XLSX文件不存在"}
+         "hyperlink_display_text": "打开结果XLSX", "hyperlink_not_exist_text": "结果XLSX文件不存在"},
+        {"internal_key": "folder_fingerprint", "excel_header": "文件夹指纹", "is_path": False}
     ]
 
     # 初始化 final_files_to_open_at_end 列表
     final_files_to_open_at_end: List[Path] = []
+    # 所有文件夹的输出文件在批次结束时汇总为一个索引文件，扫描过程中不再逐个打开
+    artifact_collector = ArtifactCollector()
 
     # 实例化 HistoryManager，传入 field_definitions 和新增参数
     history_manager = HistoryManager(
@@ -99,7 +281,8 @@ def main():
         logger_obj=logger, #
         field_definitions=file_scan_field_definitions, #
         cache_folder_path=cache_folder_path, # 传入缓存路径
-        files_to_open_at_end=final_files_to_open_at_end # 传入文件列表引用
+        files_to_open_at_end=final_files_to_open_at_end, # 传入文件列表引用
+        snapshot_retention=SnapshotRetention(SNAPSHOT_KEEP_LAST, SNAPSHOT_MAX_BYTES, SNAPSHOT_MAX_AGE_DAYS)
     )
     # --- 结束修改历史管理器初始化和使用方式 ---
 
@@ -113,19 +296,105 @@ def main():
         logger.close()
         sys.exit(0)
 
-    current_folder_log_sink_id: Optional[int] = None
+    # 批量台账：每完成一个文件夹立即落盘，崩溃后可通过 --resume 跳过已完成的文件夹
+    batch_ledger = BatchLedger(checkpoint_folder_path / BATCH_LEDGER_FILE_NAME, folders_to_scan, logger)
+    completed_before_resume = batch_ledger.open(args.resume)
+    if args.resume:
+        logger.info(f"恢复模式: 上次运行已完成 {completed_before_resume}/{len(folders_to_scan)} 个文件夹。")
+
+    # 所有文件夹的扫描结果同时写入一个全局 SQLite 目录，结果Excel变为可选的导出
+    try:
+        scan_catalog = ScanCatalog(catalog_db_path, logger)
+    except Exception as e:
+        logger.critical(f"致命错误: 无法打开扫描目录数据库 '{normalize_drive_letter(str(catalog_db_path))}': {e}")
+        sys.exit(1)
 
-    for folder_path in folders_to_scan:
-        logger.info(f"\n--- 开始处理文件夹: {normalize_drive_letter(str(folder_path))} ---")
+    # 内存预算按整个进程计算，并发扫描的文件夹共用一个 MemoryGovernor (见 memory_budget.py)
+    memory_governor: Optional[MemoryGovernor] = None
+    if args.memory_budget > 0:
+        memory_governor = MemoryGovernor(args.memory_budget, logger)
+
+    # 文件夹指纹计入扫描设置，匹配方式、类型规则、别名表、类别权重或扫描目录结构变化后不会复用旧结果。
+    # 没有结果Excel可复用 (--no-excel) 或指定了 --rescan 时只计算并记录指纹，不跳过扫描
+    scan_settings_token = scan_settings_digest(get_tag_processing_settings(),
+                                               category_weights_file_path if category_scorer is not None else None,
+                                               CATALOG_SCHEMA_VERSION)
+    fingerprint_index: Optional[FingerprintIndex] = None
+    if not args.rescan and not args.no_excel:
+        fingerprint_index = FingerprintIndex(history_manager.history_data)
+
+    def reuse_previous_result(folder_path: Path, folder_logger, folder_fingerprint: str,
+                              previous_entry: Dict[str, Any], folder_start_time: float):
+        """
+        文件夹自上次扫描以来没有变化：不扫描、不生成新的结果Excel，只追加一条指向上次结果的历史记录。
+        """
+        previous_result_path = history_entry_path(previous_entry.get("result_xlsx_abs_path"))
+        previous_log_path = history_entry_path(previous_entry.get("log_file_abs_path"))
+        folder_logger.info(f"文件夹指纹与 {previous_entry.get('scan_time')} 的扫描相同，复用上次的结果: "
+                           f"{normalize_drive_letter(str(folder_path))} -> {normalize_drive_letter(str(previous_result_path))} "
+                           f"(检查耗时 {time.monotonic() - folder_start_time:.1f} 秒)")
+        new_entry_data: Dict[str, Any] = {
+            "scan_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "folder_path": folder_path,
+            "total_files": previous_entry.get("total_files"),
+            "found_txt_count": previous_entry.get("found_txt_count"),
+            "not_found_txt_count": previous_entry.get("not_found_txt_count"),
+            # 沿用产生该结果的那次扫描的耗时，调度器据此估算文件夹下次真正变化时的扫描耗时
+            "scan_duration_seconds": previous_entry.get("scan_duration_seconds"),
+            "log_file_abs_path": previous_log_path,
+            "result_xlsx_abs_path": previous_result_path,
+            "folder_fingerprint": folder_fingerprint
+        }
+        history_manager.add_history_entry(new_entry_data)
+        # 上次中断留下的检查点已经没有意义
+        ScanCheckpoint(checkpoint_folder_path, folder_path, folder_logger).discard()
+        batch_ledger.mark_completed(folder_path, new_entry_data)
+
+        folder_display_name = normalize_drive_letter(str(folder_path))
+        artifact_collector.add(folder_display_name, "结果XLSX (复用)", previous_result_path)
+        if previous_log_path is not None and previous_log_path.exists():
+            artifact_collector.add(folder_display_name, "扫描日志", previous_log_path)
+
+    def process_folder(folder_path: Path):
+        """
+        处理单个文件夹：扫描、保存结果、记录历史、打开输出文件。
+        可能在调度器的工作线程中并发调用，因此使用绑定了文件夹标识的 logger，
+        每个文件夹的日志 sink 只接收属于自己的记录。
+        """
+        scan_folder_key = normalize_drive_letter(str(folder_path))
+        folder_logger = logger.bind(scan_folder=scan_folder_key)
+        folder_start_time = time.monotonic()
+
+        # 指纹在扫描之前计算，扫描期间发生的变化会使下次的指纹不同
+        folder_fingerprint = compute_folder_fingerprint(folder_path, scan_settings_token)
+        if fingerprint_index is not None:
+            previous_entry = fingerprint_index.find_reusable_entry(folder_path, folder_fingerprint)
+            # 扫描目录中也必须有这次结果对应的记录（数据库是新建的、被删除或换了 --catalog 时需要重新扫描）
+            if previous_entry is not None and scan_catalog.folder_summary(catalog_folder_key(folder_path)) != (
+                    previous_entry.get("total_files"), previous_entry.get("found_txt_count"),
+                    previous_entry.get("not_found_txt_count")):
+                folder_logger.info(f"文件夹指纹未变化，但扫描目录中没有对应的记录，重新扫描: {scan_folder_key}")
+                previous_entry = None
+            if previous_entry is not None:
+                try:
+                    reuse_previous_result(folder_path, folder_logger, folder_fingerprint, previous_entry, folder_start_time)
+                except Exception as e:
+                    folder_logger.error(f"处理文件夹 {normalize_drive_letter(str(folder_path))} 时发生错误: {e}")
+                return
 
-        scan_timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        scan_checkpoint = ScanCheckpoint(checkpoint_folder_path, folder_path, folder_logger,
+                                         interval_files=args.checkpoint_interval)
+        scan_timestamp = scan_checkpoint.open(args.resume, datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
         folder_prefix = generate_folder_prefix(folder_path)
 
+        folder_logger.info(f"\n--- 开始处理文件夹: {normalize_drive_letter(str(folder_path))} ---")
+
         current_scan_log_file = output_base_dir / f"{folder_prefix}_scan_log_{scan_timestamp}.txt"
         current_excel_file = output_base_dir / f"{folder_prefix}_scan_results_{scan_timestamp}.xlsx"
 
         fallback_excel_file = log_output_folder / f"FALLBACK_{folder_prefix}_scan_results_{scan_timestamp}.xlsx"
 
+        current_folder_log_sink_id: Optional[int] = None
         try:
             current_folder_log_sink_id = logger.add(
                 str(current_scan_log_file),
@@ -134,77 +403,84 @@ def main():
                 compression="zip",
                 enqueue=True,
                 encoding="utf-8",
-                format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {message}"
+                format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {message}",
+                filter=lambda record: record["extra"].get("scan_folder") == scan_folder_key
             )
-            logger.info(f"针对当前文件夹的扫描日志将写入: {normalize_drive_letter(str(current_scan_log_file))}")
+            folder_logger.info(f"针对当前文件夹的扫描日志将写入: {normalize_drive_letter(str(current_scan_log_file))}")
         except Exception as e:
-            logger.error(f"无法为文件夹 '{normalize_drive_letter(str(folder_path))}' 添加扫描日志文件 sink: {e}")
+            folder_logger.error(f"无法为文件夹 '{normalize_drive_letter(str(folder_path))}' 添加扫描日志文件 sink: {e}")
             current_folder_log_sink_id = None
 
-        logger.info(f"开始扫描 {normalize_drive_letter(str(folder_path))}")
+        folder_logger.info(f"开始扫描 {normalize_drive_letter(str(folder_path))}")
 
         try:
-            wb = create_empty_workbook()
-
-            # 定义各个工作表的标题
-            matched_headers = ["文件夹路径", "文件绝对路径", "文件链接", "文件扩展名",
-                               "TXT文件绝对路径", "TXT文件内容", "清洗后内容", "内容长度",
-                               "提示词类型", "找到TXT"]
-            unmatched_headers = ["文件夹路径", "文件绝对路径", "文件链接", "文件扩展名", "找到TXT"]
-            tag_frequency_headers = ["Tag", "出现次数"]
-
-            # 创建“匹配文件”工作表
-            ws_matched = create_sheet_with_headers(wb, "匹配文件", matched_headers, 0)
-
-            # 创建“未匹配文件”工作表
-            ws_no_txt = create_sheet_with_headers(wb, "未匹配文件", unmatched_headers, 1)
-
-            # 创建“Tag词频统计”工作表
-            ws_tag_frequency = create_sheet_with_headers(wb, "Tag词频统计", tag_frequency_headers, 2)
-
-
-            # 在调用 scan_files_and_extract_data 之前，创建 ExcelDataWriter 实例
-            excel_data_writer = ExcelDataWriter(ws_matched, ws_no_txt, logger)
-            total_files, found_txt_count, not_found_txt_count, tag_counts = scan_files_and_extract_data(
-                folder_path,
-                excel_data_writer,
-                logger
-            )
-
-            sorted_tags = sorted(tag_counts.items(), key=lambda item: item[1], reverse=True)
-            for tag, count in sorted_tags:
-                ws_tag_frequency.append([tag, count])
-
-            for worksheet in [ws_matched, ws_no_txt, ws_tag_frequency]:
-                set_fixed_column_widths(worksheet, FIXED_COLUMN_WIDTH, logger)
-
-            save_successful = False
-            actual_result_file_path = Path("N/A_SAVE_FAILED")
-
-            for attempt in range(MAX_SAVE_RETRIES):
-                try:
-                    wb.save(str(current_excel_file))
-                    logger.info(f"扫描结果已保存到: {normalize_drive_letter(str(current_excel_file))} (尝试 {attempt + 1}/{MAX_SAVE_RETRIES})")
-                    actual_result_file_path = current_excel_file
-                    save_successful = True
-                    break
-                except PermissionError as e:
-                    logger.warning(f"警告: 无法将扫描结果保存到 '{normalize_drive_letter(str(current_excel_file))}'，原因: 权限拒绝！请确保该文件未被其他程序（如Excel）打开。尝试 {attempt + 1}/{MAX_SAVE_RETRIES}。错误: {e}")
-                    time.sleep(RETRY_DELAY_SECONDS)
-                except Exception as e:
-                    logger.error(f"错误: 将扫描结果保存到 '{normalize_drive_letter(str(current_excel_file))}' 失败: {e} (尝试 {attempt + 1}/{MAX_SAVE_RETRIES})")
-                    break
-
-            if not save_successful:
-                logger.critical(f"严重警告: 经过 {MAX_SAVE_RETRIES} 次尝试后，仍无法将扫描结果保存到 '{normalize_drive_letter(str(current_excel_file))}'。尝试保存到备用位置。")
-
-                try:
-                    wb.save(str(fallback_excel_file))
-                    logger.warning(f"成功将扫描结果保存到备用位置: {normalize_drive_letter(str(fallback_excel_file))}")
-                    actual_result_file_path = fallback_excel_file
-                except Exception as fallback_e:
-                    logger.critical(f"致命错误: 尝试将扫描结果保存到备用位置 '{normalize_drive_letter(str(fallback_excel_file))}' 也失败了！错误: {fallback_e}")
-                    actual_result_file_path = Path("N/A_SAVE_FAILED")
+            excel_data_writer: Optional[ExcelDataWriter] = None
+            scoring_data_writer: Optional[ScoringDataWriter] = None
+            if not args.no_excel:
+                # 创建“匹配文件”、“未匹配文件”、“Tag词频统计”、“负向Tag词频统计”四个工作表
+                wb, ws_matched, ws_no_txt, ws_tag_frequency, ws_negative_tag_frequency = create_scan_result_workbook(
+                    category_scorer.headers if category_scorer else None)
+                # 在调用 scan_files_and_extract_data 之前，创建 ExcelDataWriter 实例
+                excel_data_writer = ExcelDataWriter(ws_matched, ws_no_txt, folder_logger)
+                if category_scorer is not None:
+                    # 匹配的行按批计算类别评分后再写入Excel
+                    scoring_data_writer = ScoringDataWriter(category_scorer, excel_data_writer)
+
+            # 每一行先写入扫描目录，再交给 Excel 写入器（如果启用）
+            catalog_data_writer = CatalogDataWriter(scan_catalog, catalog_folder_key(folder_path), scan_timestamp,
+                                                    folder_logger, next_writer=scoring_data_writer or excel_data_writer)
+            negative_tag_aggregator = DefaultTagAggregator()
+            error_aggregator = ScanErrorAggregator()
+            memory_scope: Optional[MemoryBudgetScope] = None
+            if memory_governor is not None:
+                memory_scope = memory_governor.scope(folder_logger)
+                memory_scope.register("清空Tag匹配缓存并降低缓存上限", shrink_tag_caches, DEGRADE_PRIORITY_CACHES)
+                if excel_data_writer is not None:
+                    def stream_result_rows():
+                        nonlocal wb, ws_matched, ws_no_txt, ws_tag_frequency, ws_negative_tag_frequency
+                        wb, (ws_matched, ws_no_txt, ws_tag_frequency, ws_negative_tag_frequency) = \
+                            convert_to_write_only_workbook(wb, FIXED_COLUMN_WIDTH)
+                        excel_data_writer.switch_to_streaming(ws_matched, ws_no_txt)
+                    memory_scope.register("结果Excel切换为流式写入", stream_result_rows, DEGRADE_PRIORITY_RESULT_ROWS)
+            try:
+                total_files, found_txt_count, not_found_txt_count, tag_counts = scan_files_and_extract_data(
+                    folder_path,
+                    catalog_data_writer,
+                    folder_logger,
+                    checkpoint=scan_checkpoint,
+                    negative_tag_aggregator=negative_tag_aggregator,
+                    error_aggregator=error_aggregator,
+                    memory_scope=memory_scope
+                )
+            finally:
+                if memory_scope is not None:
+                    memory_scope.close()
+            if memory_scope is not None and memory_scope.actions_taken:
+                folder_logger.warning(f"本次扫描因内存预算执行了降级措施: {'; '.join(memory_scope.actions_taken)}")
+            catalog_data_writer.finish(total_files, found_txt_count, not_found_txt_count)
+            if scoring_data_writer is not None:
+                scoring_data_writer.flush()
+
+            if excel_data_writer is None:
+                folder_logger.info(f"已跳过结果Excel (--no-excel)，扫描结果已写入扫描目录: {normalize_drive_letter(str(catalog_db_path))}")
+                actual_result_file_path = Path("N/A_EXCEL_DISABLED")
+                result_saved = True
+            else:
+                write_tag_frequency(ws_tag_frequency, tag_counts)
+                write_tag_frequency(ws_negative_tag_frequency, negative_tag_aggregator.get_counts())
+                ws_error_summary = write_error_summary(wb, error_aggregator)
+
+                # 流式写入的工作表已在切换时设置列宽，写入后无法再修改
+                for worksheet in [ws_matched, ws_no_txt, ws_tag_frequency, ws_negative_tag_frequency, ws_error_summary]:
+                    if worksheet is not None and not wb.write_only:
+                        set_fixed_column_widths(worksheet, FIXED_COLUMN_WIDTH, folder_logger)
+
+                # 工作簿只序列化一次，目标被占用时只重试文件替换，失败后移动到备用位置
+                saved_path = save_workbook_with_retries(wb, current_excel_file, fallback_excel_file, folder_logger,
+                                                        MAX_SAVE_RETRIES, RETRY_DELAY_SECONDS)
+                actual_result_file_path = saved_path if saved_path is not None else Path("N/A_SAVE_FAILED")
+
+                result_saved = actual_result_file_path.exists()
 
             # --- 修改 add_history_entry 的调用方式 ---
             new_entry_data: Dict[str, Any] = {
@@ -213,27 +489,47 @@ def main():
                 "total_files": total_files,
                 "found_txt_count": found_txt_count,
                 "not_found_txt_count": not_found_txt_count,
+                "scan_duration_seconds": round(time.monotonic() - folder_start_time, 1),
                 "log_file_abs_path": current_scan_log_file,
-                "result_xlsx_abs_path": actual_result_file_path
+                "result_xlsx_abs_path": actual_result_file_path,
+                "folder_fingerprint": folder_fingerprint
             }
             history_manager.add_history_entry(new_entry_data)
-            logger.info(f"本次扫描历史记录已成功添加至内存。")
+            folder_logger.info(f"本次扫描历史记录已成功添加至内存。")
+
+            # 结果已落盘后才删除检查点并记入台账；保存失败时保留检查点，--resume 可快速重试
+            if result_saved:
+                scan_checkpoint.discard()
+                batch_ledger.mark_completed(folder_path, new_entry_data)
             # --- 结束修改 add_history_entry 的调用方式 ---
 
-            # 将本次扫描的日志和结果Excel添加到待打开列表
-            files_to_open_this_scan = [current_scan_log_file]
+            # 将本次扫描的结果Excel和日志登记到批次汇总
+            folder_display_name = normalize_drive_letter(str(folder_path))
             if actual_result_file_path.exists():
-                files_to_open_this_scan.append(actual_result_file_path)
-
-            open_output_files_automatically(files_to_open_this_scan, logger)
+                artifact_collector.add(folder_display_name, "结果XLSX", actual_result_file_path)
+            artifact_collector.add(folder_display_name, "扫描日志", current_scan_log_file)
 
         except Exception as e:
-            logger.error(f"处理文件夹 {normalize_drive_letter(str(folder_path))} 时发生错误: {e}")
+            folder_logger.error(f"处理文件夹 {normalize_drive_letter(str(folder_path))} 时发生错误: {e}")
         finally:
+            folder_logger.info(f"--- 完成处理文件夹: {normalize_drive_letter(str(folder_path))} ---\n")
             if current_folder_log_sink_id is not None:
                 logger.remove(current_folder_log_sink_id)
-                current_folder_log_sink_id = None
-            logger.info(f"--- 完成处理文件夹: {normalize_drive_letter(str(folder_path))} ---\n")
+
+    folders_pending: List[Path] = []
+    for folder_path in folders_to_scan:
+        if batch_ledger.is_completed(folder_path):
+            history_manager.add_history_entry(batch_ledger.get_history_entry(folder_path))
+            logger.info(f"文件夹已在上次运行中完成，跳过: {normalize_drive_letter(str(folder_path))}")
+        else:
+            folders_pending.append(folder_path)
+
+    # 按历史耗时估算并按设备分组：不同设备并发，同一设备顺序，耗时最长的优先
+    folder_costs = estimate_folder_costs(folders_pending, history_manager.history_data, logger)
+    device_groups = build_device_groups(folder_costs)
+    run_device_groups(device_groups, process_folder, logger, max_parallel_devices=args.parallel_devices)
+
+    scan_catalog.close()
 
     logger.info(f"所有扫描任务完成，开始将历史记录保存到最终的Excel文件: {normalize_drive_letter(str(final_history_excel_path))}")
     logger.info(f"准备保存 {len(history_manager.history_data)} 条历史记录到Excel。")
@@ -242,6 +538,8 @@ def main():
     # 调用 HistoryManager 的 save_history_to_excel 方法。
     # 该方法内部会处理历史记录的保存和缓存快照的生成，并将缓存快照路径添加到 final_files_to_open_at_end 列表中。
     save_history_success = history_manager.save_history_to_excel() #
+    if save_history_success:
+        batch_ledger.clear()
 
     # Add error/warning log file to the list
     if error_warning_log_file_path and error_warning_log_file_path.exists():
@@ -249,8 +547,17 @@ def main():
     else:
         logger.warning("警告: 错误和警告日志文件不存在或路径无效，无法自动打开。")
 
-    # 统一打开所有收集到的文件，包括主结果Excel、日志和历史缓存快照
-    open_output_files_automatically(final_files_to_open_at_end, logger)
+    # 把历史记录、缓存快照和错误日志也登记到汇总，最终只打开一个汇总索引文件（后台启动，不等待查看器）
+    if save_history_success:
+        artifact_collector.add("批次汇总", "历史记录", final_history_excel_path)
+    for final_file_path in final_files_to_open_at_end:
+        artifact_collector.add("批次汇总", final_file_path.name, final_file_path)
+
+    summary_index_path = output_base_dir / f"batch_summary_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
+    if artifact_collector.write_summary(summary_index_path, logger):
+        open_output_files_automatically([summary_index_path], logger)
+    else:
+        open_output_files_automatically(final_files_to_open_at_end, logger)
 
     logger.info("所有文件夹处理完毕，程序即将退出。")
 
@@ -0,0 +1,180 @@
+# memory_budget.py
+"""
+扫描过程的内存预算。
+
+结果行 (openpyxl 工作簿)、Tag计数和各种缓存都常驻内存直到扫描结束，一个超大的文件夹可能把进程推到可用内存之外。
+设置了内存预算 (--memory-budget) 时，扫描器每处理完一块文件调用一次 MemoryGovernor.check()：
+进程的常驻内存 (RSS) 达到预算的 MEMORY_PRESSURE_RATIO 时，按优先级执行下一项尚未执行的降级措施，
+例如缩小缓存、把Tag计数转存到临时文件、把结果工作簿切换为流式写入。每次检查最多执行一项，
+压力解除后不再继续降级。执行的措施和前后的内存占用写入扫描日志。
+
+RSS 是整个进程的内存占用，批量任务中并发扫描的文件夹 (--parallel-devices) 共用一个 MemoryGovernor：
+每个文件夹通过 MemoryGovernor.scope() 登记自己的降级措施，压力出现时整个批次只按优先级选出下一项措施，
+而不是每个文件夹都把其他文件夹占用的内存算在自己头上、各自降级。
+措施会修改所属扫描的数据结构，因此只交给登记它的扫描线程在下一次 check() 时执行。
+
+RSS 的读取方式：优先使用 psutil；没有 psutil 时在 Linux 上读取 /proc/self/statm；
+都不可用时退回 resource.getrusage 的峰值 (ru_maxrss，只增不减，只能作为近似)；Windows 上没有 psutil 时无法监控。
+"""
+import os
+import sys
+import gc
+import threading
+from typing import Callable, List, Optional, Tuple
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    psutil = None
+    PSUTIL_AVAILABLE = False
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# --- Configuration ---
+DEFAULT_MEMORY_BUDGET_MB = 0       # 0 表示不限制
+MEMORY_PRESSURE_RATIO = 0.8        # RSS 达到预算的这个比例时开始降级
+
+# 降级措施的优先级，数值小的先执行（代价越小越靠前）
+DEGRADE_PRIORITY_CACHES = 10
+DEGRADE_PRIORITY_SCAN_BLOCKS = 20
+DEGRADE_PRIORITY_TAG_COUNTS = 30
+DEGRADE_PRIORITY_RESULT_ROWS = 40
+
+_STATM_PATH = "/proc/self/statm"
+
+
+def current_rss_bytes() -> Optional[int]:
+    """
+    当前进程的常驻内存字节数；无法获取时返回 None。
+    """
+    if PSUTIL_AVAILABLE:
+        return psutil.Process().memory_info().rss
+    try:
+        with open(_STATM_PATH, 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024 # macOS 单位为字节，Linux 为 KB
+    return None
+
+
+def _format_mib(byte_count: int) -> str:
+    return f"{byte_count / (1024 * 1024):.0f} MiB"
+
+
+class MemoryBudgetScope:
+    """
+    一个文件夹扫描在共享 MemoryGovernor 中的登记范围，扫描结束后调用 close()。
+    """
+    def __init__(self, governor: "MemoryGovernor", logger_obj):
+        self.governor = governor
+        self.logger_obj = logger_obj
+        self.actions_taken: List[str] = []
+        self._due_actions: List[Tuple[str, Callable[[], None]]] = []
+
+    def register(self, description: str, action: Callable[[], None], priority: int):
+        """
+        登记一项降级措施。description 写入日志，例如 "Tag计数转存到临时文件"。
+        """
+        self.governor._register(self, description, action, priority)
+
+    def check(self):
+        """
+        检查当前内存占用，并执行分配给本扫描的降级措施。由扫描线程每处理完一块文件调用一次。
+        """
+        self.governor._check()
+        while True:
+            with self.governor._lock:
+                if not self._due_actions:
+                    return
+                description, action = self._due_actions.pop(0)
+            self._run(description, action)
+
+    def _run(self, description: str, action: Callable[[], None]):
+        rss = current_rss_bytes()
+        try:
+            action()
+        except Exception as e:
+            self.logger_obj.error(f"错误: 执行内存降级措施 '{description}' 失败: {e}")
+        else:
+            gc.collect()
+            self.actions_taken.append(description)
+            rss_after = current_rss_bytes()
+            self.logger_obj.warning(
+                f"内存占用 {_format_mib(rss) if rss is not None else '未知'} 接近预算 {_format_mib(self.governor.budget_bytes)}，"
+                f"已执行降级: {description} (执行后 {_format_mib(rss_after) if rss_after is not None else '未知'})")
+        finally:
+            self.governor._action_finished()
+
+    def close(self):
+        """
+        撤销本扫描尚未执行的降级措施。
+        """
+        with self.governor._lock:
+            unfinished_count = len(self._due_actions)
+            self._due_actions = []
+            self.governor._pending_actions = [entry for entry in self.governor._pending_actions if entry[4] is not self]
+            self.governor._due_action_count -= unfinished_count
+
+
+class MemoryGovernor:
+    """
+    按内存预算依次执行各扫描登记的降级措施。每项措施只执行一次。多个扫描线程共用，内部加锁。
+    """
+    def __init__(self, budget_mb: int, logger_obj, pressure_ratio: float = MEMORY_PRESSURE_RATIO):
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self.pressure_bytes = int(self.budget_bytes * pressure_ratio)
+        self.logger_obj = logger_obj
+        # (优先级, 登记顺序, 说明, 措施, 所属范围)
+        self._pending_actions: List[Tuple[int, int, str, Callable[[], None], MemoryBudgetScope]] = []
+        self._registration_count = 0
+        self._due_action_count = 0 # 已分配但所属扫描尚未执行的措施数
+        self._over_budget_reported = False
+        self._lock = threading.Lock()
+        self.enabled = budget_mb > 0 and current_rss_bytes() is not None
+        if budget_mb > 0 and not self.enabled:
+            logger_obj.warning("警告: 无法读取进程内存占用（未安装 psutil），内存预算不生效。")
+
+    def scope(self, logger_obj) -> MemoryBudgetScope:
+        """
+        为一个文件夹扫描创建登记范围，措施的执行情况写入该文件夹的日志 (logger_obj)。
+        """
+        return MemoryBudgetScope(self, logger_obj)
+
+    def _register(self, scope: MemoryBudgetScope, description: str, action: Callable[[], None], priority: int):
+        with self._lock:
+            self._pending_actions.append((priority, self._registration_count, description, action, scope))
+            self._registration_count += 1
+            self._pending_actions.sort(key=lambda item: item[:2])
+
+    def _action_finished(self):
+        with self._lock:
+            self._due_action_count -= 1
+
+    def _check(self):
+        """
+        超过压力线时把下一项措施分配给所属扫描。上一项措施尚未执行完时不再分配，先看它的效果。
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._due_action_count:
+                return
+            rss = current_rss_bytes()
+            if rss is None or rss < self.pressure_bytes:
+                return
+            if not self._pending_actions:
+                if rss >= self.budget_bytes and not self._over_budget_reported:
+                    self._over_budget_reported = True
+                    self.logger_obj.warning(f"警告: 内存占用 {_format_mib(rss)} 已超过预算 {_format_mib(self.budget_bytes)}，"
+                                            f"已无可用的降级措施。")
+                return
+            _, _, description, action, scope = self._pending_actions.pop(0)
+            scope._due_actions.append((description, action))
+            self._due_action_count += 1
@@ -1,18 +1,26 @@
 import os
 import sys
+import pickle
 import datetime
+import tempfile
 from pathlib import Path
 from openpyxl.worksheet.worksheet import Worksheet
-from typing import Tuple, Dict, Optional, Set, List, Any, Generator, Protocol, runtime_checkable
+from typing import Tuple, Dict, Optional, Set, List, Any, Generator, Protocol, Sequence, runtime_checkable
 import logging
 from dataclasses import dataclass, field
 from enum import Enum # 新增导入 Enum
 
 from collections import defaultdict
 
-from file_system_utils import normalize_drive_letter, get_file_details
-from tag_processing import clean_tags, detect_types
-from excel_utilities import set_hyperlink_and_style
+from file_system_utils import normalize_drive_letter, get_file_details, split_file_name
+from file_table import FileTable
+from error_summary import ScanErrorAggregator
+from memory_budget import MemoryBudgetScope, DEGRADE_PRIORITY_SCAN_BLOCKS, DEGRADE_PRIORITY_TAG_COUNTS
+from tag_processing import PromptTagBatch, process_prompt_batch
+from tag_batch import ParallelTagProcessor, get_shared_tag_processor
+from txt_reader import read_caption_text, TXT_MAX_READ_BYTES
+from excel_utilities import set_hyperlink_and_style, create_write_only_cell
+from checkpoint import ScanCheckpoint, compute_file_list_digest
 
 # --- 模块级别常量 ---
 class ScannerConstants:
@@ -32,6 +40,7 @@ class ScannerConstants:
     class ErrorTypes(Enum):
         FILE_NOT_FOUND = "文件不存在"
         READ_TXT_FAILED = "读取TXT文件失败"
+        TXT_BINARY_CONTENT = "TXT文件疑似二进制内容"
         TAG_PROCESSING_FAILED = "标签处理失败"
         INVALID_RETURN_TYPE = "返回非预期类型"
         DIRECTORY_ACCESS_FAILED = "目录访问失败"
@@ -41,6 +50,15 @@ class ScannerConstants:
     class ExcelConfig:
         EXCEL_FILE_LINK_COLUMN = 3
 
+    # 每次先读取这么多个文件的TXT，再一次性交给批量Tag处理 (足够多时由进程池并行处理，见 tag_batch.py)
+    SCAN_TAG_BLOCK_SIZE = 4096
+    # 内存预算降级后的扫描块大小，以及转存到临时文件后内存中最多保留的Tag计数条目
+    REDUCED_SCAN_TAG_BLOCK_SIZE = 512
+    TAG_COUNT_SPILL_ENTRIES = 50000
+
+    # 扫描结束时日志中列出的 (错误类型, 目录) 计数条数，完整统计见结果工作簿的“错误汇总”工作表
+    ERROR_SUMMARY_LOG_DIRECTORIES = 20
+
 # Scanner 配置类保持不变
 @dataclass
 class ScannerConfig:
@@ -50,6 +68,9 @@ class ScannerConfig:
     skip_folders: Set[str] = field(default_factory=lambda: ScannerConstants.SKIP_SCAN_FOLDERS.copy())
     skip_extensions: Set[str] = field(default_factory=lambda: ScannerConstants.SKIP_SCAN_EXTENSIONS.copy())
 
+# Python 3.10+ 的 dataclass 支持 slots=True；每行结果不再带 __dict__，大量行常驻内存时明显更省
+_DATACLASS_SLOTS: Dict[str, bool] = {'slots': True} if sys.version_info >= (3, 10) else {}
+
 # 结构化错误记录保持不变
 @dataclass
 class ErrorRecord:
@@ -62,11 +83,13 @@ class ErrorRecord:
     timestamp: datetime.datetime = field(default_factory=datetime.datetime.now)
     details: Optional[str] = None
 
-@dataclass
+@dataclass(**_DATACLASS_SLOTS)
 class ProcessedFileData:
     """
     定义处理后文件数据的结构，提高代码可读性和类型安全性，并提供更像对象的访问方式。
     新增了结构化的错误记录列表。
+    root_resolved_path 由 FileTable 按目录缓存，同一目录的行共用同一个字符串；
+    category_scores / processing_errors 默认是共享的空元组，只有真正有内容的行才分配列表。
     """
     root_resolved_path: str
     file_absolute_path: str
@@ -79,7 +102,12 @@ class ProcessedFileData:
     cleaned_data_length: int
     prompt_type: str
     found_txt_flag: str
-    processing_errors: List[ErrorRecord] = field(default_factory=list)
+    negative_prompt: str = ""
+    generation_parameters: str = ""
+    # 类别评分 (见 category_scoring.py)，未启用评分时为空，不输出评分列
+    scored_types: str = ""
+    category_scores: Sequence[float] = ()
+    processing_errors: Sequence[ErrorRecord] = ()
 
     # _is_matched_flag 被替换为一个属性
     @property
@@ -90,6 +118,19 @@ class ProcessedFileData:
         return self.found_txt_flag == ScannerConstants.FileStatus.FOUND_TXT_FLAG_YES.value
 
 
+def extract_tags(cleaned_data: str) -> List[str]:
+    """
+    将清洗后的内容拆分为用于词频统计的标签列表（去除首尾空白并转为小写）。
+    Args:
+        cleaned_data (str): clean_tags 返回的清洗后字符串。
+    Returns:
+        List[str]: 非空标签列表。
+    """
+    if not cleaned_data or not isinstance(cleaned_data, str):
+        return []
+    return [t.strip().lower() for t in cleaned_data.split(',') if t.strip()]
+
+
 # 元数据处理器接口和实现保持不变
 @runtime_checkable
 class MetadataProcessor(Protocol):
@@ -97,10 +138,11 @@ class MetadataProcessor(Protocol):
     元数据处理器的抽象接口。
     定义了如何从文件中提取和处理元数据。
     """
-    def process(self, file_path: Path, logger_obj: logging.Logger) -> Tuple[str, str, int, str, str, List[ErrorRecord]]:
+    def process(self, file_path: Path, logger_obj: logging.Logger) -> Tuple[str, str, str, int, str, str, str, List[ErrorRecord]]:
         """
         处理指定文件，提取其元数据。
-        返回 (txt_absolute_path, txt_content, cleaned_data, cleaned_data_length, prompt_type, errors)
+        返回 (txt_absolute_path, txt_content, cleaned_data, cleaned_data_length, prompt_type,
+              negative_prompt, generation_parameters, errors)
         """
         ...
 
@@ -108,72 +150,88 @@ class TxtMetadataProcessor:
     """
     TXT文件元数据处理器的具体实现。
     """
-    def process(self, txt_file_path: Path, logger_obj: logging.Logger) -> Tuple[str, str, int, str, str, List[ErrorRecord]]:
+    def __init__(self, max_read_bytes: int = TXT_MAX_READ_BYTES):
+        """
+        Args:
+            max_read_bytes (int): 每个TXT文件最多读取的字节数，超出部分被截断。
+        """
+        self.max_read_bytes = max_read_bytes
+
+    def read_text(self, txt_file_path: Path, logger_obj: logging.Logger) -> Tuple[str, str, bool, List[ErrorRecord]]:
+        """
+        读取TXT内容（I/O 部分），不做Tag处理。
+        Returns:
+            Tuple[str, str, bool, List[ErrorRecord]]: (TXT绝对路径, TXT内容, 是否读取成功, 错误记录)
+        """
         txt_absolute_path = normalize_drive_letter(str(txt_file_path.resolve()))
         txt_content = ""
-        cleaned_data = ""
-        cleaned_data_length = 0
-        prompt_type = ScannerConstants.FileStatus.PROMPT_TYPE_NA.value # 使用 .value
         errors: List[ErrorRecord] = []
 
-        try_encodings = ['utf-8', 'gbk', 'latin-1']
+        txt_display_path = normalize_drive_letter(str(txt_file_path))
         txt_read_success = False
-
-        for encoding in try_encodings:
-            try:
-                with open(txt_file_path, 'r', encoding=encoding) as f:
-                    txt_content = f.readline().strip()
-                    txt_read_success = True
-                    break
-            except UnicodeDecodeError as e:
-                msg = f"TXT文件 {normalize_drive_letter(str(txt_file_path))} 无法使用 {encoding} 解码，尝试其他编码。"
+        try:
+            caption = read_caption_text(txt_file_path, self.max_read_bytes)
+            for encoding, reason in caption.failed_encodings:
+                msg = f"TXT文件 {txt_display_path} 无法使用 {encoding} 解码，尝试其他编码。"
                 logger_obj.warning(f"警告: {msg}")
-                errors.append(ErrorRecord(ScannerConstants.ErrorTypes.READ_TXT_FAILED.value, msg, file_path=normalize_drive_letter(str(txt_file_path)), details=str(e))) # 使用 .value
-                continue
-            except Exception as e:
-                msg = f"读取TXT文件 {normalize_drive_letter(str(txt_file_path))} 失败 (编码尝试 {encoding}): {e}"
-                logger_obj.error(f"错误: {msg}")
-                errors.append(ErrorRecord(ScannerConstants.ErrorTypes.READ_TXT_FAILED.value, msg, file_path=normalize_drive_letter(str(txt_file_path)), details=str(e))) # 使用 .value
-                txt_read_success = False
-                break
-
-        if not txt_read_success:
-            if not any(err.error_type == ScannerConstants.ErrorTypes.READ_TXT_FAILED.value for err in errors): # 使用 .value
-                 errors.append(ErrorRecord(ScannerConstants.ErrorTypes.READ_TXT_FAILED.value, # 使用 .value
-                                            "无法通过任何尝试的编码解码或发生其他读取错误",
-                                            file_path=normalize_drive_letter(str(txt_file_path))))
-            return txt_absolute_path, txt_content, cleaned_data, cleaned_data_length, prompt_type, errors
-
-        if txt_read_success:
-            try:
-                temp_cleaned_data, _ = clean_tags(txt_content)
-
-                if not isinstance(temp_cleaned_data, str):
-                    msg = f"cleaned_data {ScannerConstants.ErrorTypes.INVALID_RETURN_TYPE.value}. 实际类型: {type(temp_cleaned_data).__name__}" # 使用 .value
-                    logger_obj.warning(f"警告: {ScannerConstants.ErrorTypes.TAG_PROCESSING_FAILED.value}: {msg} for {normalize_drive_letter(str(txt_file_path))}") # 使用 .value
-                    errors.append(ErrorRecord(ScannerConstants.ErrorTypes.TAG_PROCESSING_FAILED.value, msg, file_path=normalize_drive_letter(str(txt_file_path)))) # 使用 .value
-                    temp_cleaned_data = ""
-                cleaned_data = temp_cleaned_data
-                cleaned_data_length = len(cleaned_data) if isinstance(cleaned_data, str) else 0
-
-                temp_prompt_type = detect_types(txt_content, cleaned_data)
-
-                if not isinstance(temp_prompt_type, str):
-                    msg = f"prompt_type {ScannerConstants.ErrorTypes.INVALID_RETURN_TYPE.value}. 实际类型: {type(temp_prompt_type).__name__}" # 使用 .value
-                    logger_obj.warning(f"警告: {ScannerConstants.ErrorTypes.TAG_PROCESSING_FAILED.value}: {msg} for {normalize_drive_letter(str(txt_file_path))}") # 使用 .value
-                    errors.append(ErrorRecord(ScannerConstants.ErrorTypes.TAG_PROCESSING_FAILED.value, msg, file_path=normalize_drive_letter(str(txt_file_path)))) # 使用 .value
-                    temp_prompt_type = ScannerConstants.FileStatus.PROMPT_TYPE_NA.value # 使用 .value
-                prompt_type = temp_prompt_type
-
-            except Exception as e:
-                msg = f"标签处理失败: {e}"
-                logger_obj.error(f"错误: {msg} for TXT文件 {normalize_drive_letter(str(txt_file_path))}")
-                errors.append(ErrorRecord(ScannerConstants.ErrorTypes.TAG_PROCESSING_FAILED.value, msg, file_path=normalize_drive_letter(str(txt_file_path)), details=str(e))) # 使用 .value
-                cleaned_data = ""
-                cleaned_data_length = 0
-                prompt_type = ScannerConstants.FileStatus.PROMPT_TYPE_NA.value # 使用 .value
-
-        return txt_absolute_path, txt_content, cleaned_data, cleaned_data_length, prompt_type, errors
+                errors.append(ErrorRecord(ScannerConstants.ErrorTypes.READ_TXT_FAILED.value, msg, file_path=txt_display_path, details=reason)) # 使用 .value
+            if caption.is_binary:
+                msg = f"TXT文件 {txt_display_path} 疑似二进制或乱码文件，已跳过。"
+                logger_obj.warning(f"警告: {msg}")
+                errors.append(ErrorRecord(ScannerConstants.ErrorTypes.TXT_BINARY_CONTENT.value, msg, file_path=txt_display_path)) # 使用 .value
+            elif caption.encoding:
+                txt_content = caption.text
+                txt_read_success = True
+                if caption.truncated:
+                    logger_obj.warning(f"警告: TXT文件 {txt_display_path} 超过读取上限 {self.max_read_bytes} 字节，仅读取前 {caption.bytes_read} 字节。")
+        except Exception as e:
+            msg = f"读取TXT文件 {txt_display_path} 失败: {e}"
+            logger_obj.error(f"错误: {msg}")
+            errors.append(ErrorRecord(ScannerConstants.ErrorTypes.READ_TXT_FAILED.value, msg, file_path=txt_display_path, details=str(e))) # 使用 .value
+
+        if not txt_read_success and not errors:
+            errors.append(ErrorRecord(ScannerConstants.ErrorTypes.READ_TXT_FAILED.value, # 使用 .value
+                                      "无法通过任何尝试的编码解码或发生其他读取错误",
+                                      file_path=txt_display_path))
+        return txt_absolute_path, txt_content, txt_read_success, errors
+
+    def finish(self, txt_file_path: Path, read_result: Tuple[str, str, bool, List[ErrorRecord]],
+               tag_batch: Optional[PromptTagBatch], batch_index: int,
+               logger_obj: logging.Logger) -> Tuple[str, str, str, int, str, str, str, List[ErrorRecord]]:
+        """
+        把 read_text 的结果与批量Tag处理结果 (tag_batch 的第 batch_index 条) 组合成 process 的返回值。
+        读取失败时 tag_batch 可以为 None。
+        """
+        txt_absolute_path, txt_content, txt_read_success, read_errors = read_result
+        cleaned_data = ""
+        cleaned_data_length = 0
+        prompt_type = ScannerConstants.FileStatus.PROMPT_TYPE_NA.value # 使用 .value
+        negative_prompt = ""
+        generation_parameters = ""
+        errors: List[ErrorRecord] = list(read_errors)
+
+        if not txt_read_success or tag_batch is None:
+            return txt_absolute_path, txt_content, cleaned_data, cleaned_data_length, prompt_type, negative_prompt, generation_parameters, errors
+
+        tag_error = tag_batch.errors[batch_index]
+        if tag_error:
+            msg = f"标签处理失败: {tag_error}"
+            logger_obj.error(f"错误: {msg} for TXT文件 {normalize_drive_letter(str(txt_file_path))}")
+            errors.append(ErrorRecord(ScannerConstants.ErrorTypes.TAG_PROCESSING_FAILED.value, msg, file_path=normalize_drive_letter(str(txt_file_path)), details=tag_error)) # 使用 .value
+            return txt_absolute_path, txt_content, cleaned_data, cleaned_data_length, prompt_type, negative_prompt, generation_parameters, errors
+
+        # 只有正向提示词参与清洗、类型检测和Tag统计；负向提示词和生成参数单独输出 (见 process_prompt_batch)
+        cleaned_data = tag_batch.cleaned_lines[batch_index]
+        cleaned_data_length = len(cleaned_data)
+        prompt_type = tag_batch.prompt_types[batch_index]
+        negative_prompt = tag_batch.negative_prompts[batch_index]
+        generation_parameters = tag_batch.generation_parameters[batch_index]
+        return txt_absolute_path, txt_content, cleaned_data, cleaned_data_length, prompt_type, negative_prompt, generation_parameters, errors
+
+    def process(self, txt_file_path: Path, logger_obj: logging.Logger) -> Tuple[str, str, str, int, str, str, str, List[ErrorRecord]]:
+        read_result = self.read_text(txt_file_path, logger_obj)
+        tag_batch = process_prompt_batch([read_result[1]]) if read_result[2] else None
+        return self.finish(txt_file_path, read_result, tag_batch, 0, logger_obj)
 
 # 数据写入器接口和实现保持不变
 @runtime_checkable
@@ -199,6 +257,35 @@ class ExcelDataWriter:
         self.ws_matched = ws_matched
         self.ws_no_txt = ws_no_txt
         self.logger_obj = logger_obj
+        self.streaming = False
+
+    def switch_to_streaming(self, ws_matched: Worksheet, ws_no_txt: Worksheet):
+        """
+        之后的行写入 write_only 工作表（行直接写入临时文件，不再常驻内存），
+        两个工作表须已包含之前写入的行 (见 excel_utilities.convert_to_write_only_workbook)。
+        """
+        self.ws_matched = ws_matched
+        self.ws_no_txt = ws_no_txt
+        self.streaming = True
+
+    def _append_row(self, worksheet: Worksheet, row_data: List[Any], processed_data: ProcessedFileData, sheet_description: str):
+        link_index = ScannerConstants.ExcelConfig.EXCEL_FILE_LINK_COLUMN - 1
+        if self.streaming:
+            # write_only 工作表不能在写入后再访问单元格，超链接单元格须在写入前构造
+            row_data[link_index] = create_write_only_cell(worksheet, processed_data.file_link_location,
+                                                          processed_data.file_link_text, self.logger_obj,
+                                                          source_description=sheet_description)
+            worksheet.append(row_data)
+            return
+        worksheet.append(row_data)
+        link_cell = worksheet.cell(row=worksheet.max_row, column=ScannerConstants.ExcelConfig.EXCEL_FILE_LINK_COLUMN)
+        set_hyperlink_and_style(
+            link_cell,
+            processed_data.file_link_location,
+            processed_data.file_link_text,
+            self.logger_obj,
+            source_description=f"{sheet_description} (行: {worksheet.max_row})"
+        )
 
     def write_matched_data(self, processed_data: ProcessedFileData):
         if processed_data.processing_errors:
@@ -215,17 +302,14 @@ class ExcelDataWriter:
             processed_data.cleaned_data,
             processed_data.cleaned_data_length,
             processed_data.prompt_type,
-            processed_data.found_txt_flag
+            processed_data.found_txt_flag,
+            processed_data.negative_prompt,
+            processed_data.generation_parameters
         ]
-        self.ws_matched.append(current_row_data)
-        link_cell = self.ws_matched.cell(row=self.ws_matched.max_row, column=ScannerConstants.ExcelConfig.EXCEL_FILE_LINK_COLUMN)
-        set_hyperlink_and_style(
-            link_cell,
-            processed_data.file_link_location,
-            processed_data.file_link_text,
-            self.logger_obj,
-            source_description=f"匹配文件 (行: {self.ws_matched.max_row})"
-        )
+        if processed_data.category_scores:
+            current_row_data.append(processed_data.scored_types)
+            current_row_data.extend(processed_data.category_scores)
+        self._append_row(self.ws_matched, current_row_data, processed_data, "匹配文件")
 
     def write_no_txt_data(self, processed_data: ProcessedFileData):
         if processed_data.processing_errors:
@@ -239,15 +323,7 @@ class ExcelDataWriter:
             processed_data.file_extension,
             processed_data.found_txt_flag
         ]
-        self.ws_no_txt.append(current_row_data_no_txt)
-        link_cell = self.ws_no_txt.cell(row=self.ws_no_txt.max_row, column=ScannerConstants.ExcelConfig.EXCEL_FILE_LINK_COLUMN)
-        set_hyperlink_and_style(
-            link_cell,
-            processed_data.file_link_location,
-            processed_data.file_link_text,
-            self.logger_obj,
-            source_description=f"未匹配文件 (行: {self.ws_no_txt.max_row})"
-        )
+        self._append_row(self.ws_no_txt, current_row_data_no_txt, processed_data, "未匹配文件")
 
 # 标签聚合器协议和实现保持不变
 @runtime_checkable
@@ -270,30 +346,107 @@ class DefaultTagAggregator:
     """
     def __init__(self):
         self._tag_counts = defaultdict(int)
+        # 转存到临时文件的计数块 (见 enable_disk_spill)；None 表示全部计数都在内存中
+        self._spill_file = None
+        self._spill_entries = 0
 
     def add_tags(self, tags: List[str]):
         for tag in tags:
             if tag: # 确保标签不为空
                 self._tag_counts[tag] += 1
+        if self._spill_file is not None and len(self._tag_counts) >= self._spill_entries:
+            self._spill()
+
+    def enable_disk_spill(self, max_entries: int = ScannerConstants.TAG_COUNT_SPILL_ENTRIES):
+        """
+        把当前计数转存到临时文件，之后内存中的计数每达到 max_entries 个不同的标签就再转存一块。
+        get_counts 按顺序逐块合并，结果（包括同频标签的先后顺序）与全部在内存中计数时相同；
+        合并需要读回所有块，只应在扫描结束时调用一次（检查点不保存Tag计数）。
+        """
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(prefix="tag_counts_")
+        self._spill_entries = max(1, max_entries)
+        self._spill()
+
+    def _spill(self):
+        pickle.dump(dict(self._tag_counts), self._spill_file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._tag_counts = defaultdict(int)
+
+    def _iter_spilled_counts(self) -> Generator[Dict[str, int], None, None]:
+        if self._spill_file is None:
+            return
+        self._spill_file.seek(0)
+        while True:
+            try:
+                yield pickle.load(self._spill_file)
+            except EOFError:
+                break
+        self._spill_file.seek(0, os.SEEK_END)
+
+    def remove_tags(self, tags: List[str]):
+        """
+        撤销之前添加过的一批标签（用于监视模式下文件变化后的增量更新）。
+        计数归零的标签会被移除，避免词频表中出现 0 次的标签。
+        """
+        for tag in tags:
+            if tag and tag in self._tag_counts:
+                self._tag_counts[tag] -= 1
+                if self._tag_counts[tag] <= 0:
+                    del self._tag_counts[tag]
 
     def get_counts(self) -> Dict[str, int]:
-        return dict(self._tag_counts) # 返回字典的副本
+        if self._spill_file is None:
+            return dict(self._tag_counts) # 返回字典的副本
+        counts: Dict[str, int] = {}
+        for chunk in self._iter_spilled_counts():
+            for tag, count in chunk.items():
+                counts[tag] = counts.get(tag, 0) + count
+        for tag, count in self._tag_counts.items():
+            counts[tag] = counts.get(tag, 0) + count
+        return counts
 
 class Scanner:
     def __init__(self, logger_obj: logging.Logger,
                  data_writer: DataWriter,
                  config: ScannerConfig = ScannerConfig(),
-                 tag_aggregator: TagAggregator = DefaultTagAggregator()):
+                 tag_aggregator: TagAggregator = DefaultTagAggregator(),
+                 checkpoint: Optional[ScanCheckpoint] = None,
+                 negative_tag_aggregator: Optional[TagAggregator] = None,
+                 tag_processor: Optional[ParallelTagProcessor] = None,
+                 error_aggregator: Optional[ScanErrorAggregator] = None,
+                 memory_scope: Optional[MemoryBudgetScope] = None):
         self.logger_obj = logger_obj
         self.data_writer = data_writer
         self.config = config
         self.tag_aggregator = tag_aggregator
+        # 负向提示词的Tag单独统计，不混入正向的词频
+        self.negative_tag_aggregator = negative_tag_aggregator if negative_tag_aggregator is not None else DefaultTagAggregator()
+        self.checkpoint = checkpoint
+        # 默认使用程序内共享的进程池 (configure_tag_workers 设置工作进程数)
+        self.tag_processor = tag_processor if tag_processor is not None else get_shared_tag_processor()
         self.all_extensions: Set[str] = set()
         self.skipped_extensions: Set[str] = set()
-        self.all_scan_errors: List[ErrorRecord] = []
+        # 错误只按类型/目录计数并抽样保留 (见 error_summary.py)，内存占用与错误数量无关
+        self.error_aggregator = error_aggregator if error_aggregator is not None else ScanErrorAggregator()
+        # 最近一次收集得到的 TXT 文件表和 stem小写 -> 下标 的映射 (见 txt_files_map)
+        self._txt_files = FileTable()
+        self._txt_index_by_stem: Dict[str, int] = {}
         self.metadata_processors: Dict[str, MetadataProcessor] = {
             '.txt': TxtMetadataProcessor()
         }
+        self.block_size = ScannerConstants.SCAN_TAG_BLOCK_SIZE
+        # 设置了内存预算时，每处理完一块检查一次内存占用 (见 memory_budget.py)
+        self.memory_scope = memory_scope
+        if memory_scope is not None:
+            memory_scope.register(f"扫描块缩小为 {ScannerConstants.REDUCED_SCAN_TAG_BLOCK_SIZE} 个文件",
+                                     self._reduce_block_size, DEGRADE_PRIORITY_SCAN_BLOCKS)
+            for aggregator, description in ((self.tag_aggregator, "Tag计数"), (self.negative_tag_aggregator, "负向Tag计数")):
+                if hasattr(aggregator, "enable_disk_spill"):
+                    memory_scope.register(f"{description}转存到临时文件", aggregator.enable_disk_spill,
+                                             DEGRADE_PRIORITY_TAG_COUNTS)
+
+    def _reduce_block_size(self):
+        self.block_size = min(self.block_size, ScannerConstants.REDUCED_SCAN_TAG_BLOCK_SIZE)
 
     def _generate_file_link_info(self, file_path: Path) -> Tuple[Optional[str], str, Optional[ErrorRecord]]:
         file_abs_path = file_path.resolve()
@@ -316,14 +469,22 @@ class Scanner:
     def _process_file_metadata(
         self,
         file_path: Path,
-        matched_txt_path: Optional[Path]
+        matched_txt_path: Optional[Path],
+        processed_txt: Optional[Tuple[str, str, str, int, str, str, str, List[ErrorRecord]]] = None,
+        root_resolved_path: Optional[str] = None
     ) -> ProcessedFileData:
+        """
+        生成一个文件的处理结果。processed_txt 为已批量处理好的TXT结果 (与 MetadataProcessor.process 的返回值相同)，
+        为 None 时在这里逐个处理。root_resolved_path 为已解析的所在目录 (FileTable.resolved_directory)，
+        为 None 时在这里解析。
+        """
         file_stem, file_ext = get_file_details(file_path)
 
         file_link_location, file_link_text, file_exist_error = self._generate_file_link_info(file_path)
+        row_errors: List[ErrorRecord] = []
 
         result_data = ProcessedFileData(
-            root_resolved_path=normalize_drive_letter(str(file_path.parent.resolve())),
+            root_resolved_path=root_resolved_path or normalize_drive_letter(str(file_path.parent.resolve())),
             file_absolute_path=normalize_drive_letter(str(file_path.resolve())),
             file_link_text=file_link_text,
             file_link_location=file_link_location,
@@ -338,95 +499,199 @@ class Scanner:
         # _is_matched_flag 现在通过属性自动计算，无需在这里设置
 
         if file_exist_error:
-            result_data.processing_errors.append(file_exist_error)
-            self.all_scan_errors.append(file_exist_error)
+            row_errors.append(file_exist_error)
+            self.error_aggregator.add(file_exist_error)
 
         if matched_txt_path:
             processor = self.metadata_processors.get('.txt')
             if processor:
-                txt_absolute_path, txt_content, cleaned_data, cleaned_data_length, prompt_type, errors = \
-                    processor.process(matched_txt_path, self.logger_obj)
+                txt_absolute_path, txt_content, cleaned_data, cleaned_data_length, prompt_type, \
+                    negative_prompt, generation_parameters, errors = processed_txt or processor.process(matched_txt_path, self.logger_obj)
 
                 result_data.txt_absolute_path = txt_absolute_path
                 result_data.txt_content = txt_content
                 result_data.cleaned_data = cleaned_data
                 result_data.cleaned_data_length = cleaned_data_length
                 result_data.prompt_type = prompt_type
-                result_data.processing_errors.extend(errors)
-                self.all_scan_errors.extend(errors)
+                result_data.negative_prompt = negative_prompt
+                result_data.generation_parameters = generation_parameters
+                row_errors.extend(errors)
+                self.error_aggregator.extend(errors)
 
                 if not errors and txt_content:
                      result_data.found_txt_flag = ScannerConstants.FileStatus.FOUND_TXT_FLAG_YES.value # 使用 .value
                 else:
                     result_data.found_txt_flag = ScannerConstants.FileStatus.FOUND_TXT_FLAG_ERROR.value # 使用 .value
 
-                if result_data.cleaned_data and isinstance(result_data.cleaned_data, str):
-                    tags = [t.strip().lower() for t in result_data.cleaned_data.split(',') if t.strip()]
+                tags = extract_tags(result_data.cleaned_data)
+                if tags:
                     self.tag_aggregator.add_tags(tags)
+                negative_tags = extract_tags(result_data.negative_prompt)
+                if negative_tags:
+                    self.negative_tag_aggregator.add_tags(negative_tags)
             else:
                 msg = f"未找到处理 {matched_txt_path.suffix} 文件的元数据处理器。"
                 self.logger_obj.error(msg)
                 err_record = ErrorRecord(ScannerConstants.ErrorTypes.UNKNOWN_ERROR.value, msg, file_path=normalize_drive_letter(str(matched_txt_path))) # 使用 .value
-                result_data.processing_errors.append(err_record)
-                self.all_scan_errors.append(err_record)
+                row_errors.append(err_record)
+                self.error_aggregator.add(err_record)
                 result_data.found_txt_flag = ScannerConstants.FileStatus.FOUND_TXT_FLAG_ERROR.value # 使用 .value
         else:
             self.logger_obj.info(f"未找到匹配的TXT文件: {normalize_drive_letter(str(file_path))}")
 
         # result_data._is_matched_flag = (result_data.found_txt_flag == ScannerConstants.FileStatus.FOUND_TXT_FLAG_YES) # 移除此行
+        if row_errors:
+            result_data.processing_errors = row_errors
         return result_data
 
-    def _scan_directory_recursive(self, current_dir: Path, all_files_to_scan: List[Path], all_txt_files_map: Dict[str, Path]):
+    def _process_file_block(self, files: FileTable, block_start: int, block_end: int,
+                            txt_files: FileTable, txt_index_by_stem: Dict[str, int]) -> List[ProcessedFileData]:
+        """
+        先依次读取 files[block_start:block_end] 的TXT（I/O），再把读取成功的内容一次性交给批量Tag处理（CPU），
+        结果顺序与文件顺序一致。Path 对象只为当前块临时构造。
+        """
+        file_paths = files[block_start:block_end]
+        matched_txt_paths: List[Optional[Path]] = []
+        for file_index in range(block_start, block_end):
+            txt_index = txt_index_by_stem.get(split_file_name(files.file_name(file_index))[0].lower())
+            matched_txt_paths.append(txt_files.path(txt_index) if txt_index is not None else None)
+        root_paths = [files.resolved_directory(files.directory_id(file_index)) for file_index in range(block_start, block_end)]
+        processor = self.metadata_processors.get('.txt')
+        if not isinstance(processor, TxtMetadataProcessor):
+            return [self._process_file_metadata(file_path, txt_path, root_resolved_path=root_path)
+                    for file_path, txt_path, root_path in zip(file_paths, matched_txt_paths, root_paths)]
+
+        read_results = {index: processor.read_text(txt_path, self.logger_obj)
+                        for index, txt_path in enumerate(matched_txt_paths) if txt_path}
+        batch_positions = {index: position for position, index in
+                           enumerate(index for index, read_result in read_results.items() if read_result[2])}
+        tag_batch = self.tag_processor.process([read_results[index][1] for index in batch_positions])
+
+        block_results: List[ProcessedFileData] = []
+        for index, (file_path, txt_path) in enumerate(zip(file_paths, matched_txt_paths)):
+            processed_txt = None
+            if txt_path:
+                processed_txt = processor.finish(txt_path, read_results[index], tag_batch,
+                                                 batch_positions.get(index, -1), self.logger_obj)
+            block_results.append(self._process_file_metadata(file_path, txt_path, processed_txt, root_paths[index]))
+        return block_results
+
+    def _scan_directory_recursive(self, current_dir: str, files: FileTable, txt_files: FileTable,
+                                  txt_index_by_stem: Optional[Dict[str, int]] = None):
+        """
+        递归收集文件。只为子目录创建 Path（用于跳过规则），文件只登记 目录编号 + 文件名。
+        txt_index_by_stem 不为 None 时同时记录 stem小写 -> txt_files 下标（同名时后出现的覆盖先出现的）。
+        """
+        directory_id: Optional[int] = None
+        txt_directory_id: Optional[int] = None
         try:
             with os.scandir(current_dir) as entries:
                 for entry in entries:
-                    entry_path = Path(entry.path)
-
                     if entry.is_dir():
+                        entry_path = Path(entry.path)
                         if any(sf in entry_path.parts or entry_path.name == sf for sf in self.config.skip_folders):
                             self.logger_obj.info(f"跳过扫描文件夹及其子文件夹: {normalize_drive_letter(str(entry_path))}")
                             continue
-                        self._scan_directory_recursive(entry_path, all_files_to_scan, all_txt_files_map)
+                        self._scan_directory_recursive(entry.path, files, txt_files, txt_index_by_stem)
                     elif entry.is_file():
-                        _file_stem, file_ext = get_file_details(entry_path)
+                        _file_stem, file_ext = split_file_name(entry.name)
                         file_ext_lower = file_ext.lower()
 
                         self.all_extensions.add(file_ext_lower)
 
                         if file_ext_lower == '.txt':
-                            all_txt_files_map[_file_stem.lower()] = entry_path
+                            if txt_directory_id is None:
+                                txt_directory_id = txt_files.add_directory(current_dir)
+                            if txt_index_by_stem is not None:
+                                txt_index_by_stem[_file_stem.lower()] = len(txt_files)
+                            txt_files.append(txt_directory_id, entry.name)
                             continue
 
                         if file_ext_lower in self.config.skip_extensions:
                             self.skipped_extensions.add(file_ext_lower)
                             continue
 
-                        all_files_to_scan.append(entry_path)
+                        if directory_id is None:
+                            directory_id = files.add_directory(current_dir)
+                        files.append(directory_id, entry.name)
         except PermissionError as e:
             msg = f"权限不足，无法访问目录 '{normalize_drive_letter(str(current_dir))}': {e}"
             self.logger_obj.warning(f"警告: {msg}")
-            self.all_scan_errors.append(ErrorRecord(ScannerConstants.ErrorTypes.DIRECTORY_ACCESS_FAILED.value, msg, file_path=normalize_drive_letter(str(current_dir)), details=str(e))) # 使用 .value
+            self.error_aggregator.add(ErrorRecord(ScannerConstants.ErrorTypes.DIRECTORY_ACCESS_FAILED.value, msg, file_path=normalize_drive_letter(str(current_dir)), details=str(e)), directory=normalize_drive_letter(str(current_dir))) # 使用 .value
         except FileNotFoundError as e:
             msg = f"目录不存在或已被删除 '{normalize_drive_letter(str(current_dir))}': {e}"
             self.logger_obj.warning(f"警告: {msg}")
-            self.all_scan_errors.append(ErrorRecord(ScannerConstants.ErrorTypes.DIRECTORY_ACCESS_FAILED.value, msg, file_path=normalize_drive_letter(str(current_dir)), details=str(e))) # 使用 .value
+            self.error_aggregator.add(ErrorRecord(ScannerConstants.ErrorTypes.DIRECTORY_ACCESS_FAILED.value, msg, file_path=normalize_drive_letter(str(current_dir)), details=str(e)), directory=normalize_drive_letter(str(current_dir))) # 使用 .value
         except OSError as e:
             msg = f"遍历目录 '{normalize_drive_letter(str(current_dir))}' 时发生操作系统错误: {e}"
             self.logger_obj.error(f"错误: {msg}")
-            self.all_scan_errors.append(ErrorRecord(ScannerConstants.ErrorTypes.DIRECTORY_ACCESS_FAILED.value, msg, file_path=normalize_drive_letter(str(current_dir)), details=str(e))) # 使用 .value
+            self.error_aggregator.add(ErrorRecord(ScannerConstants.ErrorTypes.DIRECTORY_ACCESS_FAILED.value, msg, file_path=normalize_drive_letter(str(current_dir)), details=str(e)), directory=normalize_drive_letter(str(current_dir))) # 使用 .value
         except Exception as e:
             msg = f"遍历目录 '{normalize_drive_letter(str(current_dir))}' 时发生意外错误: {e}"
             self.logger_obj.error(f"错误: {msg}")
-            self.all_scan_errors.append(ErrorRecord(ScannerConstants.ErrorTypes.UNEXPECTED_SCAN_ERROR.value, msg, file_path=normalize_drive_letter(str(current_dir)), details=str(e))) # 使用 .value
+            self.error_aggregator.add(ErrorRecord(ScannerConstants.ErrorTypes.UNEXPECTED_SCAN_ERROR.value, msg, file_path=normalize_drive_letter(str(current_dir)), details=str(e)), directory=normalize_drive_letter(str(current_dir))) # 使用 .value
+
+
+    def _collect_files(self, base_folder_path: Path) -> Tuple[FileTable, FileTable, Dict[str, int]]:
+        """
+        Returns:
+            Tuple[FileTable, FileTable, Dict[str, int]]: (待扫描的文件, TXT文件, stem小写 -> TXT文件下标)
+        """
+        files = FileTable()
+        txt_files = FileTable()
+        txt_index_by_stem: Dict[str, int] = {}
 
+        self._scan_directory_recursive(str(base_folder_path), files, txt_files, txt_index_by_stem)
 
-    def _collect_files(self, base_folder_path: Path) -> Tuple[List[Path], Dict[str, Path]]:
-        all_files_to_scan: List[Path] = []
-        all_txt_files_map: Dict[str, Path] = {}
+        return files, txt_files, txt_index_by_stem
 
-        self._scan_directory_recursive(base_folder_path, all_files_to_scan, all_txt_files_map)
+    def collect_files(self, base_folder_path: Path) -> Tuple[FileTable, FileTable]:
+        """
+        按扫描时相同的遍历和跳过规则收集文件，但不读取任何内容。
+        与 TXT 映射不同，同名（stem相同）的 TXT 文件全部保留。
+        Returns:
+            Tuple[FileTable, FileTable]: (待扫描的图片等文件, 所有TXT文件)，均可像 List[Path] 一样遍历和切片
+        """
+        files = FileTable()
+        txt_files = FileTable()
+        self._scan_directory_recursive(str(base_folder_path), files, txt_files)
+        return files, txt_files
 
-        return all_files_to_scan, all_txt_files_map
+    @property
+    def txt_files_map(self) -> Dict[str, Path]:
+        """
+        最近一次收集得到的 TXT 映射（stem小写 -> 路径），供监视模式增量匹配使用。按需构造 Path。
+        """
+        return {stem: self._txt_files.path(txt_index) for stem, txt_index in self._txt_index_by_stem.items()}
+
+    def _restore_from_checkpoint(self, file_list_digest: str) -> Tuple[int, int, int]:
+        """
+        若检查点与当前文件列表一致，则按原顺序重放已处理的行，并从这些行重新统计Tag计数。
+        Returns:
+            Tuple[int, int, int]: (继续处理的起始下标, 已找到TXT数, 未找到TXT数)
+        """
+        state = self.checkpoint.restore(file_list_digest)
+        if state is None:
+            return 0, 0, 0
+
+        for row_dict in self.checkpoint.iter_saved_rows():
+            row_errors = [ErrorRecord(**dict(error_dict, timestamp=datetime.datetime.fromisoformat(error_dict["timestamp"])))
+                          for error_dict in row_dict.pop("processing_errors", ())]
+            processed_data = ProcessedFileData(**row_dict)
+            if row_errors:
+                # 与首次扫描一样计入错误汇总，恢复后的“错误汇总”工作表保持一致
+                processed_data.processing_errors = row_errors
+                self.error_aggregator.extend(row_errors)
+            # Tag计数不写入检查点状态（转存到磁盘时每次保存都要合并全部计数块），按原顺序从重放的行重新统计，
+            # 同频标签的先后顺序与不中断运行时一致
+            self.tag_aggregator.add_tags(extract_tags(processed_data.cleaned_data))
+            self.negative_tag_aggregator.add_tags(extract_tags(processed_data.negative_prompt))
+            if processed_data.is_matched_flag:
+                self.data_writer.write_matched_data(processed_data)
+            else:
+                self.data_writer.write_no_txt_data(processed_data)
+        self.logger_obj.info(f"已从检查点恢复 {state['cursor']} 个文件的处理结果。")
+        return state["cursor"], state["found_txt_count"], state["not_found_txt_count"]
 
     def scan_files_and_extract_data(
         self,
@@ -436,30 +701,49 @@ class Scanner:
         found_txt_count = 0
         not_found_txt_count = 0
 
-        self.all_scan_errors.clear()
+        self.error_aggregator.clear()
 
         self.logger_obj.info(f"开始扫描文件夹: {normalize_drive_letter(str(base_folder_path))}")
 
         try:
-            all_files_to_scan, all_txt_files_map = self._collect_files(base_folder_path)
+            all_files_to_scan, self._txt_files, self._txt_index_by_stem = self._collect_files(base_folder_path)
 
             total_files_scanned = len(all_files_to_scan)
 
-            for file_path in all_files_to_scan:
-                processed_data = self._process_file_metadata(file_path, all_txt_files_map.get(get_file_details(file_path)[0].lower()))
-
-                # 使用 processed_data.is_matched_flag 属性
-                if processed_data.is_matched_flag:
-                    self.data_writer.write_matched_data(processed_data)
-                    found_txt_count += 1
-                else:
-                    self.data_writer.write_no_txt_data(processed_data)
-                    not_found_txt_count += 1
+            start_index = 0
+            file_list_digest = ""
+            if self.checkpoint:
+                file_list_digest = compute_file_list_digest(all_files_to_scan)
+                start_index, found_txt_count, not_found_txt_count = self._restore_from_checkpoint(file_list_digest)
+
+            block_start = start_index
+            while block_start < total_files_scanned:
+                block_end = min(block_start + self.block_size, total_files_scanned)
+                block_results = self._process_file_block(all_files_to_scan, block_start, block_end,
+                                                         self._txt_files, self._txt_index_by_stem)
+                for file_index, processed_data in enumerate(block_results, block_start):
+                    # 使用 processed_data.is_matched_flag 属性
+                    if processed_data.is_matched_flag:
+                        self.data_writer.write_matched_data(processed_data)
+                        found_txt_count += 1
+                    else:
+                        self.data_writer.write_no_txt_data(processed_data)
+                        not_found_txt_count += 1
+
+                    if self.checkpoint:
+                        self.checkpoint.record_row(processed_data)
+                        if self.checkpoint.is_due():
+                            self.checkpoint.save(file_index + 1, file_list_digest, found_txt_count, not_found_txt_count)
+
+                block_start = block_end
+                if self.memory_scope is not None:
+                    self.memory_scope.check()
 
         except Exception as e:
             msg = f"致命错误: {ScannerConstants.ErrorTypes.UNEXPECTED_SCAN_ERROR.value} for folder {normalize_drive_letter(str(base_folder_path))}: {e}" # 使用 .value
             self.logger_obj.critical(msg)
-            self.all_scan_errors.append(ErrorRecord(ScannerConstants.ErrorTypes.UNEXPECTED_SCAN_ERROR.value, msg, file_path=normalize_drive_letter(str(base_folder_path)), details=str(e))) # 使用 .value
+            self.error_aggregator.add(ErrorRecord(ScannerConstants.ErrorTypes.UNEXPECTED_SCAN_ERROR.value, msg, file_path=normalize_drive_letter(str(base_folder_path)), details=str(e)), # 使用 .value
+                                      directory=normalize_drive_letter(str(base_folder_path)))
 
         self.logger_obj.info(
             f"文件夹 {normalize_drive_letter(str(base_folder_path))} 扫描完成. "
@@ -477,16 +761,20 @@ class Scanner:
             self.logger_obj.info("未扫描到任何文件扩展名。")
         self.logger_obj.info(f"\n--- 文件类型概览结束 ---")
 
-        if self.all_scan_errors:
+        if self.error_aggregator.total:
             self.logger_obj.warning("\n--- 扫描过程错误汇总 ---")
-            reported_errors = set()
-            for error in self.all_scan_errors:
-                error_key = (error.error_type, error.message, error.file_path)
-                if error_key not in reported_errors:
-                    # 优化日志输出，更清晰地展示错误详情
-                    details_str = f", 详情: {error.details}" if error.details else ""
-                    self.logger_obj.warning(f"- 类型: {error.error_type}, 消息: {error.message}, 文件: {error.file_path or 'N/A'}{details_str}")
-                    reported_errors.add(error_key)
+            self.logger_obj.warning(f"共 {self.error_aggregator.total} 个错误。")
+            for error_type, count in self.error_aggregator.type_counts():
+                self.logger_obj.warning(f"- 类型: {error_type}, 次数: {count}")
+            for error_type, directory, count in self.error_aggregator.directory_counts(ScannerConstants.ERROR_SUMMARY_LOG_DIRECTORIES):
+                self.logger_obj.warning(f"- 类型: {error_type}, 目录: {directory or 'N/A'}, 次数: {count}")
+            samples = self.error_aggregator.samples()
+            if len(samples) < self.error_aggregator.total:
+                self.logger_obj.warning(f"以下为随机抽样的 {len(samples)} 条错误示例:")
+            for error in samples:
+                # 优化日志输出，更清晰地展示错误详情
+                details_str = f", 详情: {error.details}" if error.details else ""
+                self.logger_obj.warning(f"- 类型: {error.error_type}, 消息: {error.message}, 文件: {error.file_path or 'N/A'}{details_str}")
             self.logger_obj.warning("--- 扫描过程错误汇总结束 ---\n")
         else:
             self.logger_obj.info("\n扫描过程中未发现明显错误。")
@@ -497,14 +785,24 @@ class Scanner:
 def scan_files_and_extract_data(
     base_folder_path: Path,
     data_writer: DataWriter,
-    logger_obj: logging.Logger
+    logger_obj: logging.Logger,
+    checkpoint: Optional[ScanCheckpoint] = None,
+    negative_tag_aggregator: Optional[TagAggregator] = None,
+    error_aggregator: Optional[ScanErrorAggregator] = None,
+    memory_scope: Optional[MemoryBudgetScope] = None
 ) -> Tuple[int, int, int, Dict[str, int]]:
     """
     扫描指定文件夹下的文件，查找匹配的TXT文件，提取数据并写入。
     此函数现在是 main.py 的适配层，它实例化 Scanner 类并调用其方法。
+    传入 checkpoint 时会定期保存扫描进度，并在可能时从上次的检查点继续。
+    返回的Tag计数只包含正向提示词；需要负向提示词的Tag统计时传入 negative_tag_aggregator。
+    需要错误汇总（例如写入“错误汇总”工作表）时传入 error_aggregator。
+    传入 memory_scope (MemoryGovernor.scope()) 时按内存预算逐步降级（缩小扫描块、Tag计数转存到临时文件等）。
     """
     scanner_config = ScannerConfig()
     tag_aggregator_instance = DefaultTagAggregator()
     scanner = Scanner(logger_obj=logger_obj, data_writer=data_writer,
-                      config=scanner_config, tag_aggregator=tag_aggregator_instance)
+                      config=scanner_config, tag_aggregator=tag_aggregator_instance,
+                      checkpoint=checkpoint, negative_tag_aggregator=negative_tag_aggregator,
+                      error_aggregator=error_aggregator, memory_scope=memory_scope)
     return scanner.scan_files_and_extract_data(base_folder_path)
\ No newline at end of file
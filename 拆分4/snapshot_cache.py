@@ -0,0 +1,297 @@
+# snapshot_cache.py
+"""
+按内容寻址的历史记录快照缓存。
+
+缓存目录结构：
+    <cache>/snapshot_manifest.json         —— 快照清单（时间、摘要、对应的数据块、大小、来源）
+    <cache>/blobs/<摘要前2位>/<摘要>.xlsx    —— 快照内容，相同内容只存一份
+    <cache>/opened/<摘要前12位>.xlsx          —— 交给用户打开的副本，数据块本身不直接打开
+
+- 内容与最新快照相同时不写入任何文件，也不新增清单条目。
+- 摘要忽略 xlsx 中每次保存都会变化的元数据（docProps/core.xml 的修改时间、zip 条目时间戳），
+  否则 openpyxl 每次保存出的文件字节都不同，去重永远不会命中。
+- 保留策略：最近 N 个、总字节数上限、最长保留天数，超出时从最旧的快照开始淘汰，
+  最新的快照始终保留；不再被任何清单条目引用的数据块随即删除。
+"""
+import os
+import json
+import shutil
+import hashlib
+import zipfile
+import datetime
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+from file_system_utils import normalize_drive_letter
+
+# --- Configuration ---
+SNAPSHOT_MANIFEST_FILE_NAME = "snapshot_manifest.json"
+SNAPSHOT_BLOB_FOLDER_NAME = "blobs"
+SNAPSHOT_OPENED_FOLDER_NAME = "opened"
+SNAPSHOT_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+LEGACY_SNAPSHOT_TIME_FORMAT = "%Y%m%d_%H%M%S"
+DEFAULT_KEEP_LAST_SNAPSHOTS = 50
+DEFAULT_MAX_SNAPSHOT_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_SNAPSHOT_AGE_DAYS = 90
+# 每次保存都会变化、与历史记录内容无关的 xlsx 成员
+VOLATILE_XLSX_MEMBERS = {"docProps/core.xml"}
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class SnapshotRetention:
+    """
+    快照保留策略。任一项为 None 或 0 表示不限制该项。
+    """
+    keep_last: Optional[int] = DEFAULT_KEEP_LAST_SNAPSHOTS
+    max_bytes: Optional[int] = DEFAULT_MAX_SNAPSHOT_BYTES
+    max_age_days: Optional[float] = DEFAULT_MAX_SNAPSHOT_AGE_DAYS
+
+
+def compute_snapshot_digest(file_path: Path) -> str:
+    """
+    计算快照内容摘要。xlsx (zip) 按成员名排序后对成员名和解压后的内容求哈希，跳过易变的元数据成员；
+    其他文件直接对文件内容求哈希。
+    """
+    digest = hashlib.sha256()
+    if zipfile.is_zipfile(file_path):
+        with zipfile.ZipFile(file_path) as archive:
+            for member_name in sorted(archive.namelist()):
+                if member_name in VOLATILE_XLSX_MEMBERS:
+                    continue
+                digest.update(member_name.encode('utf-8'))
+                digest.update(b'\0')
+                with archive.open(member_name) as member:
+                    for chunk in iter(lambda: member.read(HASH_CHUNK_SIZE), b''):
+                        digest.update(chunk)
+                digest.update(b'\0')
+        return digest.hexdigest()
+
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SnapshotCache:
+    """
+    历史记录快照缓存。多个线程可能同时保存快照，清单读写加锁。
+    """
+    def __init__(self, cache_folder_path: Path, logger_obj,
+                 retention: Optional[SnapshotRetention] = None,
+                 legacy_snapshot_glob: Optional[str] = None):
+        """
+        Args:
+            cache_folder_path (Path): 缓存目录。
+            logger_obj: 日志管理器实例。
+            retention (Optional[SnapshotRetention]): 保留策略，默认使用 SnapshotRetention()。
+            legacy_snapshot_glob (Optional[str]): 旧版按时间戳命名的快照文件模式
+                (例如 "operation_history_cached_*.xlsx")，首次使用时导入缓存并删除原文件。
+        """
+        self.cache_folder_path = cache_folder_path
+        self.logger_obj = logger_obj
+        self.retention = retention if retention is not None else SnapshotRetention()
+        self.legacy_snapshot_glob = legacy_snapshot_glob
+        self.manifest_path = cache_folder_path / SNAPSHOT_MANIFEST_FILE_NAME
+        self.blob_folder_path = cache_folder_path / SNAPSHOT_BLOB_FOLDER_NAME
+        self.opened_folder_path = cache_folder_path / SNAPSHOT_OPENED_FOLDER_NAME
+        self._lock = threading.Lock()
+
+    def _load_manifest(self) -> List[Dict[str, Any]]:
+        if not self.manifest_path.exists():
+            return []
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("snapshots", [])
+        except (OSError, ValueError) as e:
+            # 清单损坏时从数据块目录无法恢复时间信息，重新开始记录；孤立的数据块在下次淘汰时清理
+            self.logger_obj.warning(f"快照清单 '{normalize_drive_letter(str(self.manifest_path))}' 无法读取，将重新创建: {e}")
+            return []
+
+    def _save_manifest(self, snapshots: List[Dict[str, Any]]):
+        temp_path = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"snapshots": snapshots}, f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.manifest_path)
+
+    def _blob_path(self, digest: str, suffix: str) -> Path:
+        return self.blob_folder_path / digest[:2] / f"{digest}{suffix}"
+
+    def _store_blob(self, source_path: Path, blob_path: Path, move: bool = False):
+        """
+        写入数据块：先写临时文件再原子替换，中断时不会留下半个快照。
+        """
+        if blob_path.exists():
+            if move:
+                os.remove(source_path)
+            return
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        if move:
+            shutil.move(str(source_path), str(blob_path))
+            return
+        temp_path = blob_path.with_name(blob_path.name + ".tmp")
+        shutil.copy2(str(source_path), str(temp_path))
+        os.replace(temp_path, blob_path)
+
+    def _import_legacy_snapshots(self, snapshots: List[Dict[str, Any]]) -> bool:
+        """
+        把旧版的时间戳快照文件并入缓存（内容相同的只保留一份），返回是否有变动。
+        """
+        if not self.legacy_snapshot_glob:
+            return False
+        legacy_files = sorted(self.cache_folder_path.glob(self.legacy_snapshot_glob))
+        if not legacy_files:
+            return False
+
+        self.logger_obj.info(f"发现 {len(legacy_files)} 个旧版历史记录快照，正在导入快照缓存...")
+        imported: List[Dict[str, Any]] = []
+        for legacy_path in legacy_files:
+            try:
+                stem_parts = legacy_path.stem.rsplit("_", 2)
+                created = datetime.datetime.strptime("_".join(stem_parts[-2:]), LEGACY_SNAPSHOT_TIME_FORMAT)
+            except ValueError:
+                created = datetime.datetime.fromtimestamp(legacy_path.stat().st_mtime)
+            try:
+                digest = compute_snapshot_digest(legacy_path)
+                blob_path = self._blob_path(digest, legacy_path.suffix)
+                size = legacy_path.stat().st_size
+                self._store_blob(legacy_path, blob_path, move=True)
+            except (OSError, zipfile.BadZipFile) as e:
+                self.logger_obj.warning(f"旧版快照 '{normalize_drive_letter(str(legacy_path))}' 导入失败，保留原文件: {e}")
+                continue
+            imported.append({
+                "created": created.strftime(SNAPSHOT_TIME_FORMAT),
+                "digest": digest,
+                "blob": blob_path.relative_to(self.cache_folder_path).as_posix(),
+                "size": size,
+                "source": normalize_drive_letter(str(legacy_path)),
+            })
+
+        # 旧快照都早于清单中的条目；按时间排序后合并，连续相同的内容只保留第一次出现
+        imported.sort(key=lambda entry: entry["created"])
+        merged: List[Dict[str, Any]] = []
+        for entry in imported + snapshots:
+            if merged and merged[-1]["digest"] == entry["digest"]:
+                continue
+            merged.append(entry)
+        snapshots[:] = merged
+        return True
+
+    def _apply_retention(self, snapshots: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        从最新的快照往前保留，第一次超出任一限制时，更早的快照全部淘汰。最新快照始终保留。
+        """
+        keep_last = self.retention.keep_last
+        max_bytes = self.retention.max_bytes
+        max_age_days = self.retention.max_age_days
+        oldest_allowed = None
+        if max_age_days:
+            oldest_allowed = (datetime.datetime.now() - datetime.timedelta(days=max_age_days)).strftime(SNAPSHOT_TIME_FORMAT)
+
+        kept: List[Dict[str, Any]] = []
+        counted_blobs = set()
+        total_bytes = 0
+        for entry in reversed(snapshots):
+            extra_bytes = 0 if entry["blob"] in counted_blobs else entry.get("size", 0)
+            if kept:
+                if keep_last and len(kept) >= keep_last:
+                    break
+                if oldest_allowed and entry["created"] < oldest_allowed:
+                    break
+                if max_bytes and total_bytes + extra_bytes > max_bytes:
+                    break
+            kept.append(entry)
+            counted_blobs.add(entry["blob"])
+            total_bytes += extra_bytes
+        kept.reverse()
+        return kept
+
+    def _remove_unreferenced_blobs(self, snapshots: List[Dict[str, Any]]):
+        referenced = {entry["blob"] for entry in snapshots}
+        if not self.blob_folder_path.exists():
+            return
+        removed_count = 0
+        for blob_path in self.blob_folder_path.glob("*/*"):
+            if blob_path.relative_to(self.cache_folder_path).as_posix() in referenced:
+                continue
+            try:
+                os.remove(blob_path)
+                removed_count += 1
+            except OSError as e:
+                self.logger_obj.warning(f"无法删除过期快照 '{normalize_drive_letter(str(blob_path))}': {e}")
+                continue
+            try:
+                blob_path.parent.rmdir() # 仅在分片目录已空时成功
+            except OSError:
+                pass
+        if removed_count:
+            self.logger_obj.info(f"已清理 {removed_count} 个过期的历史记录快照。")
+
+    def store(self, source_path: Path) -> Optional[Path]:
+        """
+        保存一份快照。
+        Returns:
+            Optional[Path]: 快照数据块路径（内容未变化时返回已有快照）；失败返回 None。
+        """
+        with self._lock:
+            try:
+                self.cache_folder_path.mkdir(parents=True, exist_ok=True)
+                snapshots = self._load_manifest()
+                manifest_changed = self._import_legacy_snapshots(snapshots)
+
+                digest = compute_snapshot_digest(source_path)
+                blob_path = self._blob_path(digest, source_path.suffix)
+                if snapshots and snapshots[-1]["digest"] == digest and blob_path.exists():
+                    self.logger_obj.info(f"历史记录内容与最新快照相同，跳过写入: {normalize_drive_letter(str(blob_path))}")
+                else:
+                    self._store_blob(source_path, blob_path)
+                    snapshots.append({
+                        "created": datetime.datetime.now().strftime(SNAPSHOT_TIME_FORMAT),
+                        "digest": digest,
+                        "blob": blob_path.relative_to(self.cache_folder_path).as_posix(),
+                        "size": blob_path.stat().st_size,
+                        "source": normalize_drive_letter(str(source_path)),
+                    })
+                    manifest_changed = True
+                    self.logger_obj.info(f"已保存历史记录快照: {normalize_drive_letter(str(blob_path))}")
+
+                if manifest_changed:
+                    kept = self._apply_retention(snapshots)
+                    self._save_manifest(kept)
+                    if len(kept) != len(snapshots):
+                        self._remove_unreferenced_blobs(kept)
+                return blob_path
+            except Exception as e:
+                self.logger_obj.error(f"错误: 保存历史记录快照失败 '{normalize_drive_letter(str(source_path))}': {e}")
+                return None
+
+    def open_copy(self, blob_path: Path) -> Optional[Path]:
+        """
+        返回快照的独立副本供用户打开。数据块按内容共享，在 Excel 中修改它会同时改变所有引用它的快照，
+        因此只打开副本；同一内容复用已有副本，其他旧副本顺带删除（正在被打开的删除失败，忽略）。
+        Returns:
+            Optional[Path]: 副本路径；失败返回 None。
+        """
+        with self._lock:
+            copy_path = self.opened_folder_path / f"{blob_path.stem[:12]}{blob_path.suffix}"
+            try:
+                self.opened_folder_path.mkdir(parents=True, exist_ok=True)
+                for old_copy_path in self.opened_folder_path.iterdir():
+                    if old_copy_path == copy_path:
+                        continue
+                    try:
+                        os.remove(old_copy_path)
+                    except OSError:
+                        pass
+                if not copy_path.exists():
+                    temp_path = copy_path.with_name(copy_path.name + ".tmp")
+                    shutil.copy2(str(blob_path), str(temp_path))
+                    os.replace(temp_path, copy_path)
+                return copy_path
+            except OSError as e:
+                self.logger_obj.error(f"错误: 无法创建历史记录快照副本 '{normalize_drive_letter(str(copy_path))}': {e}")
+                return None
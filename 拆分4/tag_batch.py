@@ -0,0 +1,87 @@
+# tag_batch.py
+"""
+多进程批量Tag处理。
+
+分词、清洗和类型检测是纯 CPU 计算，在线程中无法并行 (GIL)。一批内容足够大时，
+把它切分成若干块交给 ProcessPoolExecutor，每个工作进程处理 process_prompt_batch 并返回列式结果，
+主进程按原顺序拼接。批量太小时进程间传输的开销大于收益，直接在当前进程处理。
+
+工作进程启动时由 initializer 接收一次 configure_* 设置的快照（匹配方式、额外类型规则、别名表）并各自编译规则，
+之后每个任务只传输TXT内容本身。进程池在第一次需要时创建，整个程序运行期间共用（多个设备组的线程也共用）。
+"""
+import os
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from tag_processing import (
+    PromptTagBatch, TagProcessingSettings, process_prompt_batch,
+    get_tag_processing_settings, apply_tag_processing_settings,
+)
+
+# --- Configuration ---
+DEFAULT_TAG_WORKERS = os.cpu_count() or 1
+PARALLEL_TAG_MIN_BATCH = 1024       # 少于这么多条内容时在当前进程处理
+TAG_BATCH_MIN_CHUNK_SIZE = 128      # 每个任务至少包含的内容条数
+TAG_BATCH_CHUNKS_PER_WORKER = 4     # 每个工作进程大约分到的任务数，便于负载均衡
+
+
+def _init_tag_worker(settings: TagProcessingSettings):
+    apply_tag_processing_settings(settings)
+
+
+class ParallelTagProcessor:
+    """
+    按批量大小自动选择当前进程或进程池的Tag处理器。
+    """
+    def __init__(self, workers: int = DEFAULT_TAG_WORKERS, min_batch: int = PARALLEL_TAG_MIN_BATCH):
+        self.workers = max(1, workers)
+        self.min_batch = max(1, min_batch)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # 设置快照在创建进程池时确定，因此 configure_* 必须在第一次扫描之前调用
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_tag_worker,
+                                                     initargs=(get_tag_processing_settings(),))
+            return self._executor
+
+    def process(self, texts: List[str]) -> PromptTagBatch:
+        """
+        与 process_prompt_batch 相同，批量足够大且允许多个工作进程时并行处理。
+        """
+        if self.workers <= 1 or len(texts) < self.min_batch:
+            return process_prompt_batch(texts)
+        chunk_size = max(TAG_BATCH_MIN_CHUNK_SIZE, -(-len(texts) // (self.workers * TAG_BATCH_CHUNKS_PER_WORKER)))
+        chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        result = PromptTagBatch()
+        for chunk_result in self._get_executor().map(process_prompt_batch, chunks):
+            result.extend(chunk_result)
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+_shared_tag_processor = ParallelTagProcessor()
+
+def configure_tag_workers(workers: int):
+    """
+    设置共享Tag处理器的工作进程数 (1 表示不使用进程池)。应在扫描开始前调用一次。
+    """
+    global _shared_tag_processor
+    _shared_tag_processor.close()
+    _shared_tag_processor = ParallelTagProcessor(workers)
+
+def get_shared_tag_processor() -> ParallelTagProcessor:
+    return _shared_tag_processor
+
+@atexit.register
+def _close_shared_tag_processor():
+    _shared_tag_processor.close()
@@ -0,0 +1,310 @@
+# tag_index.py
+"""
+Tag 倒排索引与布尔查询。
+
+索引与扫描目录存放在同一个 SQLite 数据库中：
+    tags          (tag_id, tag)                                  —— Tag 字典
+    tag_postings  (tag_id, scan_folder, doc_count, postings)     —— 每个 Tag 在每个扫描文件夹中的倒排列表
+倒排列表是升序的 files.file_id，按文件夹分片存放，重新扫描某个文件夹时只替换该文件夹的分片。
+列表先做差分编码再用 zlib 压缩（小端 uint32），解码时 zlib 解压、array.frombytes 和
+itertools.accumulate 都在 C 中完成，百万级的列表也只需几毫秒。
+
+查询语法：
+    1girl AND red_hair AND NOT monochrome
+    (1girl OR 2girls) red_*          —— 相邻的词默认按 AND 处理，末尾的 * 表示前缀匹配
+    "red hair"                       —— 含空格的 Tag 用引号括起来
+优先级：NOT > AND > OR。Tag 不区分大小写，空格与下划线视为相同。
+"""
+import sys
+import time
+import zlib
+import array
+import sqlite3
+import itertools
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, List, Iterable, Tuple, Optional
+
+from scanner import extract_tags
+from tag_rules import TagQueryError, tokenize_tag_expression
+
+# --- Configuration ---
+POSTINGS_TYPECODE = 'I'         # uint32，file_id 超过 2^32 之前足够使用
+GALLOP_LENGTH_RATIO = 16        # 两个列表长度相差超过此倍数时，用二分查找代替集合求交
+DEFAULT_QUERY_LIMIT = 100
+
+TAG_INDEX_SCHEMA_STATEMENTS = (
+    """
+    CREATE TABLE IF NOT EXISTS tags (
+        tag_id  INTEGER PRIMARY KEY,
+        tag     TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tag_postings (
+        tag_id      INTEGER NOT NULL,
+        scan_folder TEXT NOT NULL,
+        doc_count   INTEGER NOT NULL,
+        postings    BLOB NOT NULL,
+        PRIMARY KEY (tag_id, scan_folder)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_tag_postings_scan_folder ON tag_postings (scan_folder)",
+)
+
+
+def normalize_index_tag(tag: str) -> str:
+    """
+    倒排索引中的 Tag 键：小写，空格统一为下划线（"red hair" 与 "red_hair" 视为同一个 Tag）。
+    """
+    return tag.strip().lower().replace(' ', '_')
+
+
+def encode_postings(file_ids: List[int]) -> bytes:
+    """
+    差分编码 + zlib 压缩。file_ids 必须升序且不重复。
+    """
+    deltas = array.array(POSTINGS_TYPECODE, (b - a for a, b in zip(itertools.chain((0,), file_ids), file_ids)))
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    return zlib.compress(deltas.tobytes())
+
+
+def decode_postings(blob: bytes) -> List[int]:
+    deltas = array.array(POSTINGS_TYPECODE)
+    deltas.frombytes(zlib.decompress(blob))
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    return list(itertools.accumulate(deltas))
+
+
+def rebuild_folder_postings(connection: sqlite3.Connection, scan_folder: str):
+    """
+    根据扫描目录中该文件夹的当前内容重建其倒排列表分片。调用方负责事务。
+    """
+    postings_by_tag: Dict[str, List[int]] = {}
+    rows = connection.execute(
+        "SELECT file_id, cleaned_data FROM files WHERE scan_folder = ? AND is_matched = 1 ORDER BY file_id",
+        (scan_folder,))
+    for file_id, cleaned_data in rows:
+        for tag in set(normalize_index_tag(t) for t in extract_tags(cleaned_data)):
+            postings_by_tag.setdefault(tag, []).append(file_id)
+
+    connection.execute("DELETE FROM tag_postings WHERE scan_folder = ?", (scan_folder,))
+    if not postings_by_tag:
+        return
+    connection.executemany("INSERT OR IGNORE INTO tags (tag) VALUES (?)", ((tag,) for tag in postings_by_tag))
+    tag_ids: Dict[str, int] = {}
+    tag_list = list(postings_by_tag)
+    for start in range(0, len(tag_list), 500): # SQLite 单条语句的参数个数有上限
+        chunk = tag_list[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        tag_ids.update((tag, tag_id) for tag_id, tag in
+                       connection.execute(f"SELECT tag_id, tag FROM tags WHERE tag IN ({placeholders})", chunk))
+    connection.executemany(
+        "INSERT INTO tag_postings (tag_id, scan_folder, doc_count, postings) VALUES (?, ?, ?, ?)",
+        ((tag_ids[tag], scan_folder, len(file_ids), encode_postings(file_ids))
+         for tag, file_ids in postings_by_tag.items()))
+
+
+def _intersect(a: List[int], b: List[int]) -> List[int]:
+    if len(a) > len(b):
+        a, b = b, a
+    if not a:
+        return []
+    if len(a) * GALLOP_LENGTH_RATIO < len(b):
+        # 短列表中的每个元素在长列表中二分查找，查找起点单调递增
+        result = []
+        low = 0
+        for value in a:
+            low = bisect_left(b, value, low)
+            if low == len(b):
+                break
+            if b[low] == value:
+                result.append(value)
+        return result
+    return sorted(set(a).intersection(b))
+
+
+def _union(a: List[int], b: List[int]) -> List[int]:
+    if not a:
+        return b
+    if not b:
+        return a
+    return sorted(set(a).union(b))
+
+
+def _difference(a: List[int], b: List[int]) -> List[int]:
+    if not a or not b:
+        return a
+    excluded = set(b)
+    return [value for value in a if value not in excluded]
+
+
+class TagIndex:
+    """
+    只读的 Tag 查询接口。
+    """
+    def __init__(self, db_path: Path):
+        if not db_path.exists():
+            raise FileNotFoundError(f"扫描目录数据库不存在: {db_path}")
+        self.connection = sqlite3.connect(f"{db_path.resolve().as_uri()}?mode=ro", uri=True)
+        self._universe: Optional[List[int]] = None
+
+    def close(self):
+        self.connection.close()
+
+    def _postings_for_tag_ids(self, tag_ids: Iterable[int]) -> List[int]:
+        tag_ids = list(tag_ids)
+        if not tag_ids:
+            return []
+        shards: List[List[int]] = []
+        for start in range(0, len(tag_ids), 500):
+            chunk = tag_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            shards.extend(decode_postings(blob) for (blob,) in self.connection.execute(
+                f"SELECT postings FROM tag_postings WHERE tag_id IN ({placeholders})", chunk))
+        if len(shards) == 1:
+            return shards[0]
+        return sorted(set().union(*shards))
+
+    def lookup(self, tag: str) -> List[int]:
+        row = self.connection.execute("SELECT tag_id FROM tags WHERE tag = ?", (normalize_index_tag(tag),)).fetchone()
+        return self._postings_for_tag_ids([row[0]]) if row else []
+
+    def lookup_prefix(self, prefix: str) -> List[int]:
+        prefix = normalize_index_tag(prefix)
+        # 利用 tag 上的唯一索引做范围扫描
+        rows = self.connection.execute(
+            "SELECT tag_id FROM tags WHERE tag >= ? AND tag < ?", (prefix, prefix + '\U0010ffff'))
+        return self._postings_for_tag_ids(tag_id for (tag_id,) in rows)
+
+    def universe(self) -> List[int]:
+        """
+        所有已匹配TXT的文件，单独使用 NOT 时作为全集。
+        """
+        if self._universe is None:
+            self._universe = [file_id for (file_id,) in self.connection.execute(
+                "SELECT file_id FROM files WHERE is_matched = 1 ORDER BY file_id")]
+        return self._universe
+
+    def query(self, expression: str) -> List[int]:
+        """
+        执行布尔查询，返回升序的 file_id 列表。
+        """
+        tokens = tokenize_tag_expression(expression)
+        if not tokens:
+            raise TagQueryError("查询表达式为空")
+        position = 0
+
+        def peek() -> Optional[str]:
+            return tokens[position] if position < len(tokens) else None
+
+        def parse_or() -> List[int]:
+            nonlocal position
+            result = parse_and()
+            while peek() is not None and peek().upper() == 'OR':
+                position += 1
+                result = _union(result, parse_and())
+            return result
+
+        def parse_and() -> List[int]:
+            nonlocal position
+            include: List[List[int]] = []
+            exclude: List[List[int]] = []
+            while True:
+                token = peek()
+                if token is None or token == ')' or token.upper() == 'OR':
+                    break
+                if token.upper() == 'AND':
+                    position += 1
+                    continue
+                negated, operand = parse_not()
+                (exclude if negated else include).append(operand)
+            if not include and not exclude:
+                raise TagQueryError(f"缺少查询词 (位置 {position + 1})")
+            # 先求交（从最短的列表开始），最后再做差集
+            include.sort(key=len)
+            result = include[0] if include else self.universe()
+            for operand in include[1:]:
+                if not result:
+                    break
+                result = _intersect(result, operand)
+            for operand in exclude:
+                result = _difference(result, operand)
+            return result
+
+        def parse_not() -> Tuple[bool, List[int]]:
+            nonlocal position
+            negated = False
+            while peek() is not None and peek().upper() == 'NOT':
+                negated = not negated
+                position += 1
+            return negated, parse_primary()
+
+        def parse_primary() -> List[int]:
+            nonlocal position
+            token = peek()
+            if token is None:
+                raise TagQueryError("表达式意外结束")
+            position += 1
+            if token == '(':
+                result = parse_or()
+                if peek() != ')':
+                    raise TagQueryError("缺少右括号")
+                position += 1
+                return result
+            if token == ')':
+                raise TagQueryError("多余的右括号")
+            if token.startswith('"'):
+                return self.lookup(token.strip('"'))
+            if token.endswith('*'):
+                return self.lookup_prefix(token[:-1])
+            return self.lookup(token)
+
+        result = parse_or()
+        if position != len(tokens):
+            raise TagQueryError(f"无法解析的内容: {' '.join(tokens[position:])}")
+        return result
+
+    def describe_files(self, file_ids: List[int]) -> List[Tuple[str, Optional[str]]]:
+        """
+        返回 (图片路径, TXT路径) 列表，顺序与 file_ids 一致。
+        """
+        paths: Dict[int, Tuple[str, Optional[str]]] = {}
+        for start in range(0, len(file_ids), 500):
+            chunk = file_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for file_id, file_path, txt_path in self.connection.execute(
+                    f"SELECT file_id, file_path, txt_path FROM files WHERE file_id IN ({placeholders})", chunk):
+                paths[file_id] = (file_path, txt_path)
+        return [paths[file_id] for file_id in file_ids if file_id in paths]
+
+
+def run_tag_query(db_path: Path, expression: str, limit: int = DEFAULT_QUERY_LIMIT) -> int:
+    """
+    命令行查询入口：打印匹配的图片路径，返回进程退出码。
+    """
+    try:
+        tag_index = TagIndex(db_path)
+    except (FileNotFoundError, sqlite3.Error) as e:
+        print(f"错误: 无法打开扫描目录数据库: {e}", file=sys.stderr)
+        return 1
+    try:
+        start_time = time.perf_counter()
+        file_ids = tag_index.query(expression)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        shown_ids = file_ids if limit <= 0 else file_ids[:limit]
+        for file_path, txt_path in tag_index.describe_files(shown_ids):
+            print(f"{file_path}\t{txt_path or ''}")
+        print(f"共 {len(file_ids)} 个文件匹配 (查询耗时 {elapsed_ms:.1f} ms)"
+              + (f"，仅显示前 {len(shown_ids)} 个" if len(shown_ids) < len(file_ids) else ""), file=sys.stderr)
+        return 0
+    except TagQueryError as e:
+        print(f"查询语法错误: {e}", file=sys.stderr)
+        return 2
+    except sqlite3.Error as e:
+        print(f"错误: 查询失败: {e}", file=sys.stderr)
+        return 1
+    finally:
+        tag_index.close()
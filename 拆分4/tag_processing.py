@@ -1,10 +1,22 @@
-from typing import Tuple, List, Dict, Set
+from dataclasses import dataclass, field
+from typing import Tuple, List, Dict, Set, FrozenSet, Iterable
+
+from prompt_tokenizer import tokenize_prompt, DEFAULT_WEIGHT
+from prompt_parser import split_prompt
+from txt_reader import join_caption_lines
+from tag_aliases import TagCanonicalizer, normalize_tag
+from tag_rules import TagRule, TagRuleSet, TagVocabulary, TAG_MATCH_MODE_EXACT, TAG_MATCH_MODE_SUBSTRING, TAG_MATCH_MODES
 
 # --- Global Configuration for Tag Processing ---
 # 新增全局配置：定义各种类型检测的规则
 # 原理：将类型检测的关键词和对应的类型名称集中管理，提高可维护性和扩展性。
 # 这样，添加新的类型检测只需修改此字典，而无需修改detect_types函数内部逻辑。
-TAG_DETECTION_RULES: Dict[str, List[str]] = {
+# 值可以是关键词列表（任一命中即可），也可以是布尔表达式（语法见 tag_rules.py），例如：
+#     'R18(有码)': '@R18 AND NOT uncensored'
+#     '纯男性':    '@boy AND NOT (1girl OR 2girls OR multiple_girls)'
+#     '兽人':      'furry AND animal_focus'
+# 规则按顺序求值，@类型名 只能引用排在前面的类型。
+TAG_DETECTION_RULES: Dict[str, TagRule] = {
     'R18': [
         'sex', 'nude', 'pussy', 'penis', 'cum', 'nipples', 'vaginal',
         'cum_in_pussy', 'oral', 'rape', 'fellatio', 'facial', 'anus',
@@ -25,13 +37,134 @@ TAG_DETECTION_RULES: Dict[str, List[str]] = {
     '简单背景': ['background']
 }
 
+# 除类型关键词外额外清洗的Tag。'uncensored' 始终保留，不受影响
+EXTRA_WORDS_TO_CLEAN: List[str] = ['censor', 'censored']
+
+# exact 模式下代表一族Tag的关键词按以下通配符展开（只用于上面的关键词列表，substring 模式仍使用原关键词）
+# 例如 'background' 命中 blue_background，'sex' 命中 group_sex / sex_from_behind 但不命中 sexy
+EXACT_MODE_KEYWORD_PATTERNS: Dict[str, List[str]] = {
+    'background': ['background', '*_background'],
+    'censor': ['*censor*'],
+    'nipple': ['*nipple*'],
+    'pussy': ['*pussy*'],
+    'penis': ['*penis*'],
+    'sex': ['sex', 'sex_*', '*_sex', '*_sex_*'],
+}
+
+# 关键词匹配方式：
+#   substring : 默认，旧行为，关键词出现在Tag任意位置即命中
+#   exact     : 逐个Tag精确比较（字典查找，O(1)），含 * ? [ 的关键词按通配符匹配整个Tag；
+#               例如 'oral' 不会命中 'floral'，'cum' 不会命中 'cucumber'。
+#               只展开了 EXACT_MODE_KEYWORD_PATTERNS 中的关键词族，'nude' 等不会命中 'completely_nude'，
+#               需要时在 --type-rule 中用通配符补充
+TAG_MATCH_MODE = TAG_MATCH_MODE_SUBSTRING
+
+# 内存预算降级时 Tag -> 位图 缓存的条目上限 (见 shrink_tag_caches)
+REDUCED_TAG_BITS_CACHE_SIZE = 10000
+
 # 新增全局配置：统一管理需要进行敏感词检查的词汇集合
 # 原理：将分散的敏感词汇集中管理，确保clean_tags函数中敏感词判断的准确性和一致性。
 # 主要改动点：将R18词汇和额外的通用敏感词合并到一个集合中。
-SENSITIVE_WORDS_FOR_CHECK: Set[str] = set(TAG_DETECTION_RULES['R18'] + [
+SENSITIVE_WORDS_FOR_CHECK: Set[str] = set(list(TAG_DETECTION_RULES['R18']) + [
     'nipple', 'pussy', 'penis', 'hetero', 'sex', 'anus', 'naked', 'explicit'
 ])
 
+def _keywords_for_mode(keywords: Iterable[str], match_mode: str) -> List[str]:
+    """
+    exact 模式下按 EXACT_MODE_KEYWORD_PATTERNS 展开代表一族Tag的关键词；substring 模式原样返回。
+    """
+    if match_mode != TAG_MATCH_MODE_EXACT:
+        return list(keywords)
+    return [pattern for keyword in keywords for pattern in EXACT_MODE_KEYWORD_PATTERNS.get(keyword, [keyword])]
+
+def _compile_tag_rules(match_mode: str, rules: Dict[str, TagRule]) -> Tuple[TagRuleSet, int, int]:
+    """
+    把类型规则、清洗关键词和敏感词登记到同一个 TagVocabulary 中，每个Tag只需匹配一次。
+    关键词列表按匹配方式展开 (_keywords_for_mode)；表达式规则中的关键词按原样匹配。
+    Returns:
+        Tuple[TagRuleSet, int, int]: (类型规则, 清洗关键词掩码, 敏感词掩码)
+    """
+    rules = {type_name: rule if isinstance(rule, str) else _keywords_for_mode(rule, match_mode)
+             for type_name, rule in rules.items()}
+    vocabulary = TagVocabulary(match_mode)
+    rule_set = TagRuleSet(rules, vocabulary)
+    # 根据TAG_DETECTION_RULES生成需要清洗的关键词；R18关键词用于敏感词判断，而不是直接清洗；
+    # 表达式规则只用于类型检测，不参与清洗
+    words_to_clean = [keyword for type_name, keywords in rules.items()
+                      if type_name != 'R18' and not isinstance(keywords, str) for keyword in keywords]
+    clean_mask = vocabulary.mask_of(words_to_clean + _keywords_for_mode(EXTRA_WORDS_TO_CLEAN, match_mode))
+    sensitive_mask = vocabulary.mask_of(_keywords_for_mode(SENSITIVE_WORDS_FOR_CHECK, match_mode))
+    return rule_set, clean_mask, sensitive_mask
+
+
+_tag_match_mode = TAG_MATCH_MODE
+_extra_type_rules: Dict[str, str] = {}
+_tag_rule_set, _clean_mask, _sensitive_mask = _compile_tag_rules(TAG_MATCH_MODE, TAG_DETECTION_RULES)
+
+def _recompile_tag_rules():
+    global _tag_rule_set, _clean_mask, _sensitive_mask
+    _tag_rule_set, _clean_mask, _sensitive_mask = _compile_tag_rules(
+        _tag_match_mode, {**TAG_DETECTION_RULES, **_extra_type_rules})
+
+def configure_tag_match_mode(match_mode: str):
+    """
+    切换关键词匹配方式并重新编译所有规则。应在扫描开始前调用一次。
+    """
+    global _tag_match_mode
+    if match_mode not in TAG_MATCH_MODES:
+        raise ValueError(f"未知的关键词匹配方式: {match_mode}")
+    _tag_match_mode = match_mode
+    _recompile_tag_rules()
+
+def configure_type_rules(extra_rules: Dict[str, str]):
+    """
+    追加或覆盖类型规则（类型名 -> 布尔表达式），新类型排在内置类型之后。应在扫描开始前调用一次。
+    Raises:
+        TagQueryError: 表达式语法错误或引用了未定义的类型。
+    """
+    global _extra_type_rules
+    _extra_type_rules = dict(extra_rules)
+    _recompile_tag_rules()
+
+def shrink_tag_caches(cache_size: int = REDUCED_TAG_BITS_CACHE_SIZE):
+    """
+    清空当前进程的Tag匹配缓存并降低其上限（内存预算的降级措施，见 memory_budget.py）。
+    """
+    _tag_rule_set.vocabulary.shrink_cache(cache_size)
+
+def split_tag_set(line: str) -> FrozenSet[str]:
+    """
+    把逗号分隔的Tag串转为规范化的Tag集合。
+    """
+    return frozenset(tag for tag in (normalize_tag(raw_tag) for raw_tag in line.split(',')) if tag)
+
+# Tag 规范化：默认只统一大小写和空格/下划线，configure_tag_aliases 加载别名表后同时映射别名
+_tag_canonicalizer = TagCanonicalizer()
+
+def configure_tag_aliases(alias_table: Dict[str, str]):
+    """
+    设置全局Tag别名表（load_alias_table 的结果）。应在扫描开始前调用一次。
+    """
+    global _tag_canonicalizer
+    _tag_canonicalizer = TagCanonicalizer(alias_table)
+
+def tokenize_canonical_tags(line: str) -> List[Tuple[str, float]]:
+    """
+    去除强调语法并把每个Tag替换为规范名，返回 (Tag, 权重) 列表。
+    注意：规范名可能含括号 (例如 "yoimiya_(genshin_impact)")，结果不应再次交给 tokenize_prompt。
+    """
+    canonicalize = _tag_canonicalizer.canonicalize
+    return [(canonicalize(tag), weight) for tag, weight in tokenize_prompt(line.strip())]
+
+def join_tag_names(weighted_tags: List[Tuple[str, float]]) -> str:
+    return ', '.join(tag for tag, _ in weighted_tags)
+
+def canonicalize_prompt(line: str) -> str:
+    """
+    返回规范化后逗号分隔的Tag串（权重丢弃），供类型检测和统计使用。
+    """
+    return join_tag_names(tokenize_canonical_tags(line))
+
 # --- Data Processor (RESTORED FROM V4.0) ---
 def detect_types(line: str, cleaned: str) -> str:
     """
@@ -39,19 +172,15 @@ def detect_types(line: str, cleaned: str) -> str:
     优化原理：通过遍历预定义的TAG_DETECTION_RULES字典，动态地检测各种类型。
              这使得添加或修改类型检测规则时，只需修改TAG_DETECTION_RULES字典，
              而无需修改函数内部逻辑，极大提高了代码的通用性和可维护性。
+             规则在编译时转为位图运算 (见 tag_rules.py)，每个Tag只按 TAG_MATCH_MODE 匹配一次。
     Args:
-        line (str): 原始的txt文件内容。
+        line (str): 逗号分隔的Tag串（通常是 canonicalize_prompt 的结果）。
         cleaned (str): 清洗后的txt文件内容。 (在此函数中未使用cleaned，但保留参数签名以兼容原有接口)
     Returns:
         str: 识别到的提示词类型，用逗号分隔。
     """
-    types: List[str] = []
-    lower_line: str = line.lower()
-
-    # 主要改动点：迭代TAG_DETECTION_RULES，动态检测类型
-    for type_name, keywords in TAG_DETECTION_RULES.items():
-        if any(word in lower_line for word in keywords):
-            types.append(type_name)
+    # 主要改动点：按TAG_DETECTION_RULES的顺序求值编译后的规则，动态检测类型
+    types: List[str] = _tag_rule_set.detect(_tag_rule_set.vocabulary.caption_bits(split_tag_set(line)))
 
     # 如果没有检测到任何类型，返回 "N/A"
     if not types:
@@ -62,51 +191,134 @@ def clean_tags(line: str) -> Tuple[str, bool]:
     """
     清洗标签字符串。修改了对'censor'词的清理逻辑和'uncensored'的添加逻辑。
     优化原理：统一管理需要清洗的关键词和敏感词，减少重复定义，提高代码一致性。
+    强调语法 ((tag), (tag:1.2), [tag], \\(转义\\)) 先由 tokenize_prompt 规范化，
+    每个Tag再经过规范化和别名映射 (见 tag_aliases.py)，因此 "(Red Hair:1.2)" 与 "red_hair" 清洗后是同一个Tag；
+    需要权重时使用 clean_weighted_tags。
     Args:
         line (str): 原始的标签字符串。
     Returns:
         Tuple[str, bool]: 清洗后的字符串和是否含有敏感词的布尔值。
     """
-    tags: List[str] = [tag.strip() for tag in line.strip().split(',')]
-
-    # 主要改动点：根据TAG_DETECTION_RULES动态生成需要清洗的关键词
-    # 不包含 'uncensored'，因为uncensored不是一个需要被清洗的通用tag，而是标记
-    # 同时排除R18类型词汇，因为这些词在clean_tags中不应被直接清洗，而是用于判断敏感性。
-    words_to_clean: Set[str] = set()
-    for type_name, keywords in TAG_DETECTION_RULES.items():
-        if type_name != 'R18': # R18关键词用于敏感词判断，而不是直接清洗
-            words_to_clean.update(keywords)
-    # 额外添加'censor', 'censored'，确保这些通用清理词也被包含
-    words_to_clean.update(['censor', 'censored'])
-
+    cleaned_weighted_tags, has_sensitive = clean_weighted_tags(tokenize_canonical_tags(line))
+    # 用逗号和空格连接（空Tag已在分词时丢弃）
+    cleaned_line: str = join_tag_names(cleaned_weighted_tags)
+    return cleaned_line, has_sensitive
 
-    # 主要改动点：使用统一的SENSITIVE_WORDS_FOR_CHECK集合判断是否含有敏感词
+def clean_weighted_tags(weighted_tags: List[Tuple[str, float]]) -> Tuple[List[Tuple[str, float]], bool]:
+    """
+    清洗 tokenize_prompt 输出的 (Tag, 权重) 列表，规则与 clean_tags 相同，权重原样保留。
+    Args:
+        weighted_tags (List[Tuple[str, float]]): (Tag, 权重) 列表。
+    Returns:
+        Tuple[List[Tuple[str, float]], bool]: 清洗后的 (Tag, 权重) 列表和是否含有敏感词的布尔值。
+    """
+    # 需要清洗的关键词和敏感词已在 _compile_tag_rules 中编译为掩码
+    tag_bits = _tag_rule_set.vocabulary.tag_bits
+    normalized_tags: List[str] = [normalize_tag(tag) for tag, _ in weighted_tags]
+    bits_per_tag: List[int] = [tag_bits(tag) for tag in normalized_tags]
     # 检查是否含有敏感词 (基于原始标签列表，因为这些词不应该被清洗掉，而是用于标记)
-    has_sensitive: bool = False
-    for tag in tags:
-        if any(word in tag.lower() for word in SENSITIVE_WORDS_FOR_CHECK):
-            has_sensitive = True
-            break
-    
-    cleaned_tags: List[str] = []
-    for tag in tags:
-        lower_tag = tag.lower()
-        
+    caption_bits = 0
+    for bits in bits_per_tag:
+        caption_bits |= bits
+    has_sensitive: bool = caption_bits & _sensitive_mask != 0
+
+    cleaned_tags: List[Tuple[str, float]] = []
+    for (tag, weight), normalized_tag, bits in zip(weighted_tags, normalized_tags, bits_per_tag):
         # 如果是 'uncensored'，直接添加，不进行清洗
-        if lower_tag == 'uncensored':
-            cleaned_tags.append(tag)
+        if normalized_tag == 'uncensored':
+            cleaned_tags.append((tag, weight))
             continue
             
-        # 只有当tag不包含任何words_to_clean中的词时才保留
-        # 确保完整的tag不包含清理词，而不是部分包含
-        if not any(word in lower_tag for word in words_to_clean):
-            cleaned_tags.append(tag)
+        # 只有当tag不命中需要清洗的关键词时才保留
+        if not bits & _clean_mask:
+            cleaned_tags.append((tag, weight))
 
     # 如果检测到敏感词，则添加 'uncensored' 标记
     # 确保只添加一次
-    if has_sensitive and 'uncensored' not in [t.lower() for t in cleaned_tags]:
-        cleaned_tags.append('uncensored')
+    if has_sensitive and 'uncensored' not in [t.lower() for t, _ in cleaned_tags]:
+        cleaned_tags.append(('uncensored', DEFAULT_WEIGHT))
     
-    # 过滤掉空字符串，然后用逗号和空格连接
-    cleaned_line: str = ', '.join([tag for tag in cleaned_tags if tag])
-    return cleaned_line, has_sensitive
+    return cleaned_tags, has_sensitive
+
+# --- Batch API ---
+@dataclass
+class TagProcessingSettings:
+    """
+    configure_* 设置的快照。编译后的规则含闭包，不能跨进程传递，
+    多进程处理时把快照传给每个工作进程，由工作进程各自编译一次 (见 tag_batch.py)。
+    """
+    match_mode: str = TAG_MATCH_MODE
+    extra_type_rules: Dict[str, str] = field(default_factory=dict)
+    alias_table: Dict[str, str] = field(default_factory=dict)
+
+def get_tag_processing_settings() -> TagProcessingSettings:
+    return TagProcessingSettings(_tag_match_mode, dict(_extra_type_rules), _tag_canonicalizer.alias_table)
+
+def apply_tag_processing_settings(settings: TagProcessingSettings):
+    global _tag_match_mode, _extra_type_rules
+    _tag_match_mode = settings.match_mode
+    _extra_type_rules = dict(settings.extra_type_rules)
+    _recompile_tag_rules()
+    configure_tag_aliases(settings.alias_table)
+
+@dataclass
+class PromptTagBatch:
+    """
+    process_prompt_batch 的列式结果，第 i 个元素对应第 i 条输入。
+    """
+    cleaned_lines: List[str] = field(default_factory=list)       # 清洗后的正向Tag串
+    sensitive_flags: List[bool] = field(default_factory=list)    # 是否含有敏感词
+    prompt_types: List[str] = field(default_factory=list)        # detect_types 的结果
+    tag_lists: List[List[str]] = field(default_factory=list)     # 清洗后的Tag列表
+    negative_prompts: List[str] = field(default_factory=list)    # 规范化后的负向提示词
+    generation_parameters: List[str] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)              # 处理失败时的异常信息，成功时为空字符串
+
+    def __len__(self) -> int:
+        return len(self.cleaned_lines)
+
+    def extend(self, other: 'PromptTagBatch'):
+        self.cleaned_lines.extend(other.cleaned_lines)
+        self.sensitive_flags.extend(other.sensitive_flags)
+        self.prompt_types.extend(other.prompt_types)
+        self.tag_lists.extend(other.tag_lists)
+        self.negative_prompts.extend(other.negative_prompts)
+        self.generation_parameters.extend(other.generation_parameters)
+        self.errors.extend(other.errors)
+
+def process_prompt_batch(texts: List[str]) -> PromptTagBatch:
+    """
+    批量处理TXT内容：拆分正向/负向提示词，正向提示词分词、规范化、清洗并检测类型。
+    只有正向提示词参与清洗、类型检测和Tag统计；多行内容合并为一行后再处理，分词和别名映射每条只做一次。
+    单条内容处理失败不影响其他内容，异常信息记录在 errors 列中。
+    Args:
+        texts (List[str]): TXT内容（txt_reader 读取后的多行文本）。
+    Returns:
+        PromptTagBatch: 列式结果。
+    """
+    batch = PromptTagBatch()
+    for text in texts:
+        try:
+            prompt_parts = split_prompt(text)
+            negative_prompt = canonicalize_prompt(join_caption_lines(prompt_parts.negative))
+            positive_tags = tokenize_canonical_tags(join_caption_lines(prompt_parts.positive))
+            cleaned_positive_tags, has_sensitive = clean_weighted_tags(positive_tags)
+            cleaned_tags = [tag for tag, _ in cleaned_positive_tags]
+            prompt_type = detect_types(join_tag_names(positive_tags), '')
+        except Exception as e:
+            batch.cleaned_lines.append("")
+            batch.sensitive_flags.append(False)
+            batch.prompt_types.append("N/A")
+            batch.tag_lists.append([])
+            batch.negative_prompts.append("")
+            batch.generation_parameters.append("")
+            batch.errors.append(str(e) or type(e).__name__)
+            continue
+        batch.cleaned_lines.append(', '.join(cleaned_tags))
+        batch.sensitive_flags.append(has_sensitive)
+        batch.prompt_types.append(prompt_type)
+        batch.tag_lists.append(cleaned_tags)
+        batch.negative_prompts.append(negative_prompt)
+        batch.generation_parameters.append(prompt_parts.parameters)
+        batch.errors.append("")
+    return batch
@@ -0,0 +1,343 @@
+# tag_rules.py
+"""
+Tag 布尔表达式与提示词类型规则。
+
+表达式语法（--tag-query 查询与类型规则共用）：
+    1girl AND red_hair AND NOT monochrome
+    (1boy OR 2boys) NOT 1girl        —— 相邻的词默认按 AND 处理
+    red_*                            —— 查询中末尾的 * 表示前缀匹配；类型规则中含 * ? [ 的词按通配符匹配整个Tag
+    "red hair"                       —— 含空格或括号的 Tag 用引号括起来
+    @R18 AND NOT uncensored          —— (仅类型规则) @类型名 引用排在前面的类型的判断结果
+优先级：NOT > AND > OR。类型规则也可以直接写成关键词列表，等价于 "kw1 OR kw2 OR ..."。
+
+类型规则的编译方式：规则中出现的每个关键词登记 (intern) 为一个位，一条反推内容的Tag集合转换为一个整数位图
+（每个不同的Tag只在第一次出现时做一次匹配，之后查缓存），每条规则在位图上只做几次整数与/比较；
+同一层相邻的 OR / AND 关键词在编译时合并为一个掩码，新增类型不会增加逐Tag的匹配开销。
+"""
+import re
+import fnmatch
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from tag_aliases import normalize_tag
+
+# --- Configuration ---
+TAG_MATCH_MODE_EXACT = "exact"
+TAG_MATCH_MODE_SUBSTRING = "substring"
+TAG_MATCH_MODES = (TAG_MATCH_MODE_EXACT, TAG_MATCH_MODE_SUBSTRING)
+TYPE_REFERENCE_PREFIX = '@'
+TAG_BITS_CACHE_SIZE = 200000     # Tag -> 位图 缓存的条目上限，超过后清空重建
+
+_GLOB_CHARACTERS = frozenset('*?[')
+
+TagRule = Union[str, Iterable[str]]
+RuleEvaluator = Callable[[int, int], bool] # (Tag位图, 已命中的类型位图) -> 是否命中
+
+
+class TagQueryError(ValueError):
+    """
+    查询表达式/类型规则语法错误。
+    """
+
+
+def tokenize_tag_expression(expression: str) -> List[str]:
+    tokens: List[str] = []
+    index = 0
+    while index < len(expression):
+        char = expression[index]
+        if char.isspace():
+            index += 1
+        elif char in '()':
+            tokens.append(char)
+            index += 1
+        elif char == '"':
+            end = expression.find('"', index + 1)
+            if end < 0:
+                raise TagQueryError("引号未闭合")
+            tokens.append(expression[index:end + 1])
+            index = end + 1
+        else:
+            end = index
+            while end < len(expression) and not expression[end].isspace() and expression[end] not in '()"':
+                end += 1
+            tokens.append(expression[index:end])
+            index = end
+    return tokens
+
+
+def is_glob_term(term: str) -> bool:
+    return not _GLOB_CHARACTERS.isdisjoint(term)
+
+
+class TagVocabulary:
+    """
+    关键词 -> 位 的登记表，以及 Tag -> 位图 的匹配缓存。
+    exact 模式下普通关键词按整个Tag精确比较，substring 模式下关键词出现在Tag任意位置即命中；
+    通配符关键词在两种模式下都匹配整个Tag。
+    """
+    def __init__(self, match_mode: str = TAG_MATCH_MODE_EXACT):
+        if match_mode not in TAG_MATCH_MODES:
+            raise ValueError(f"未知的关键词匹配方式: {match_mode}")
+        self.match_mode = match_mode
+        self._term_bits: Dict[str, int] = {}
+        self._plain_bits: Dict[str, int] = {}
+        self._glob_terms: List[Tuple[re.Pattern, int]] = []
+        self._tag_bits_cache: Dict[str, int] = {}
+        self.cache_size = TAG_BITS_CACHE_SIZE
+
+    def __len__(self) -> int:
+        return len(self._term_bits)
+
+    def intern(self, term: str) -> int:
+        """
+        登记一个关键词，返回它的位（1 << 序号）。同一个关键词多次登记返回同一个位。
+        """
+        term = normalize_tag(term)
+        if not term:
+            raise TagQueryError("关键词为空")
+        bit = self._term_bits.get(term)
+        if bit is None:
+            bit = 1 << len(self._term_bits)
+            self._term_bits[term] = bit
+            if is_glob_term(term):
+                self._glob_terms.append((re.compile(fnmatch.translate(term)), bit))
+            else:
+                self._plain_bits[term] = bit
+            self._tag_bits_cache.clear()
+        return bit
+
+    def mask_of(self, terms: Iterable[str]) -> int:
+        mask = 0
+        for term in terms:
+            if term.strip():
+                mask |= self.intern(term)
+        return mask
+
+    def _match_tag(self, tag: str) -> int:
+        if self.match_mode == TAG_MATCH_MODE_EXACT:
+            bits = self._plain_bits.get(tag, 0)
+        else:
+            bits = 0
+            for term, bit in self._plain_bits.items():
+                if term in tag:
+                    bits |= bit
+        for pattern, bit in self._glob_terms:
+            if pattern.match(tag):
+                bits |= bit
+        return bits
+
+    def tag_bits(self, tag: str) -> int:
+        """
+        tag 须已规范化 (normalize_tag)。返回它命中的所有关键词的位。
+        """
+        bits = self._tag_bits_cache.get(tag)
+        if bits is None:
+            bits = self._match_tag(tag)
+            if len(self._tag_bits_cache) >= self.cache_size:
+                self._tag_bits_cache.clear()
+            self._tag_bits_cache[tag] = bits
+        return bits
+
+    def shrink_cache(self, cache_size: int):
+        """
+        清空 Tag -> 位图 缓存并降低条目上限（内存紧张时使用）。
+        """
+        self.cache_size = max(0, cache_size)
+        self._tag_bits_cache.clear()
+
+    def caption_bits(self, tags: Iterable[str]) -> int:
+        """
+        把一组规范化的Tag转换为位图。
+        """
+        bits = 0
+        tag_bits = self.tag_bits
+        for tag in tags:
+            bits |= tag_bits(tag)
+        return bits
+
+
+# 编译中间结果：(种类, 值)。tags_* / types_* 的值是掩码，not 的值是子节点，and / or 的值是子节点列表
+_Node = Tuple[str, object]
+
+
+def _is_single_bit(mask: int) -> bool:
+    return mask & (mask - 1) == 0
+
+
+def _fold_and(children: List[_Node]) -> _Node:
+    tags_all = tags_none = types_all = 0
+    rest: List[_Node] = []
+    for kind, value in children:
+        if kind == 'tags_all' or (kind == 'tags_any' and _is_single_bit(value)):
+            tags_all |= value
+        elif kind == 'tags_none':
+            tags_none |= value
+        elif kind == 'types_all' or (kind == 'types_any' and _is_single_bit(value)):
+            types_all |= value
+        else:
+            rest.append((kind, value))
+    folded = ([('tags_all', tags_all)] if tags_all else []) + ([('tags_none', tags_none)] if tags_none else []) \
+        + ([('types_all', types_all)] if types_all else []) + rest
+    return folded[0] if len(folded) == 1 else ('and', folded)
+
+
+def _fold_or(children: List[_Node]) -> _Node:
+    tags_any = types_any = 0
+    rest: List[_Node] = []
+    for kind, value in children:
+        if kind == 'tags_any' or (kind == 'tags_all' and _is_single_bit(value)):
+            tags_any |= value
+        elif kind == 'types_any' or (kind == 'types_all' and _is_single_bit(value)):
+            types_any |= value
+        else:
+            rest.append((kind, value))
+    folded = ([('tags_any', tags_any)] if tags_any else []) + ([('types_any', types_any)] if types_any else []) + rest
+    return folded[0] if len(folded) == 1 else ('or', folded)
+
+
+def _negate(node: _Node) -> _Node:
+    kind, value = node
+    if kind == 'tags_any' or (kind == 'tags_all' and _is_single_bit(value)):
+        return ('tags_none', value)
+    if kind == 'tags_none':
+        return ('tags_any', value)
+    if kind == 'not':
+        return value
+    return ('not', node)
+
+
+def _parse_rule_expression(expression: str, vocabulary: TagVocabulary, type_bits: Dict[str, int]) -> _Node:
+    tokens = tokenize_tag_expression(expression)
+    if not tokens:
+        raise TagQueryError("规则表达式为空")
+    position = 0
+
+    def peek() -> Optional[str]:
+        return tokens[position] if position < len(tokens) else None
+
+    def parse_or() -> _Node:
+        nonlocal position
+        children = [parse_and()]
+        while peek() is not None and peek().upper() == 'OR':
+            position += 1
+            children.append(parse_and())
+        return _fold_or(children)
+
+    def parse_and() -> _Node:
+        nonlocal position
+        children: List[_Node] = []
+        while True:
+            token = peek()
+            if token is None or token == ')' or token.upper() == 'OR':
+                break
+            if token.upper() == 'AND':
+                position += 1
+                continue
+            children.append(parse_not())
+        if not children:
+            raise TagQueryError(f"缺少关键词 (位置 {position + 1})")
+        return _fold_and(children)
+
+    def parse_not() -> _Node:
+        nonlocal position
+        negated = False
+        while peek() is not None and peek().upper() == 'NOT':
+            negated = not negated
+            position += 1
+        node = parse_primary()
+        return _negate(node) if negated else node
+
+    def parse_primary() -> _Node:
+        nonlocal position
+        token = peek()
+        if token is None:
+            raise TagQueryError("表达式意外结束")
+        position += 1
+        if token == '(':
+            node = parse_or()
+            if peek() != ')':
+                raise TagQueryError("缺少右括号")
+            position += 1
+            return node
+        if token == ')':
+            raise TagQueryError("多余的右括号")
+        if token.startswith('"'):
+            return ('tags_any', vocabulary.intern(token.strip('"')))
+        if token.startswith(TYPE_REFERENCE_PREFIX):
+            type_name = token[len(TYPE_REFERENCE_PREFIX):]
+            if type_name not in type_bits:
+                raise TagQueryError(f"未定义的类型引用: {token} (只能引用排在前面的类型)")
+            return ('types_any', type_bits[type_name])
+        return ('tags_any', vocabulary.intern(token))
+
+    node = parse_or()
+    if position != len(tokens):
+        raise TagQueryError(f"无法解析的内容: {' '.join(tokens[position:])}")
+    return node
+
+
+def _build_evaluator(node: _Node) -> RuleEvaluator:
+    kind, value = node
+    if kind == 'tags_any':
+        return lambda tag_bits, type_bits: tag_bits & value != 0
+    if kind == 'tags_all':
+        return lambda tag_bits, type_bits: tag_bits & value == value
+    if kind == 'tags_none':
+        return lambda tag_bits, type_bits: tag_bits & value == 0
+    if kind == 'types_any':
+        return lambda tag_bits, type_bits: type_bits & value != 0
+    if kind == 'types_all':
+        return lambda tag_bits, type_bits: type_bits & value == value
+    if kind == 'not':
+        inner = _build_evaluator(value)
+        return lambda tag_bits, type_bits: not inner(tag_bits, type_bits)
+    evaluators = [_build_evaluator(child) for child in value]
+    if kind == 'and':
+        return lambda tag_bits, type_bits: all(evaluate(tag_bits, type_bits) for evaluate in evaluators)
+    return lambda tag_bits, type_bits: any(evaluate(tag_bits, type_bits) for evaluate in evaluators)
+
+
+class TagRuleSet:
+    """
+    编译后的类型规则。规则按定义顺序求值，后面的规则可以用 @类型名 引用前面规则的结果。
+    """
+    def __init__(self, rules: Dict[str, TagRule], vocabulary: Optional[TagVocabulary] = None):
+        self.vocabulary = vocabulary if vocabulary is not None else TagVocabulary()
+        self._type_bits: Dict[str, int] = {}
+        self._rules: List[Tuple[str, int, RuleEvaluator]] = []
+        for type_name, rule in rules.items():
+            try:
+                if isinstance(rule, str):
+                    node = _parse_rule_expression(rule, self.vocabulary, self._type_bits)
+                else:
+                    node = ('tags_any', self.vocabulary.mask_of(rule))
+            except TagQueryError as e:
+                raise TagQueryError(f"类型 '{type_name}' 的规则无效: {e}") from e
+            type_bit = 1 << len(self._type_bits)
+            self._type_bits[type_name] = type_bit
+            self._rules.append((type_name, type_bit, _build_evaluator(node)))
+
+    @property
+    def type_names(self) -> List[str]:
+        return [type_name for type_name, _, _ in self._rules]
+
+    def detect(self, caption_bits: int) -> List[str]:
+        """
+        返回命中的类型名称，顺序与规则定义顺序一致。
+        """
+        types: List[str] = []
+        type_bits = 0
+        for type_name, type_bit, evaluate in self._rules:
+            if evaluate(caption_bits, type_bits):
+                type_bits |= type_bit
+                types.append(type_name)
+        return types
+
+
+def parse_type_rule_argument(argument: str) -> Tuple[str, str]:
+    """
+    解析命令行的 "类型名=表达式"。
+    """
+    type_name, separator, expression = argument.partition('=')
+    if not separator or not type_name.strip() or not expression.strip():
+        raise TagQueryError(f"类型规则应写成 类型名=表达式: {argument}")
+    return type_name.strip(), expression.strip()
@@ -0,0 +1,125 @@
+# txt_reader.py
+"""
+有上限的流式TXT读取器。
+
+- 以字节分块读取，最多读取 max_bytes 字节，超出部分丢弃（标记为已截断），
+  无论TXT文件多大（包括没有换行符的损坏文件），内存占用都不超过上限。
+- 读取第一块后先检查是否为二进制/乱码文件（含 NUL 字节或控制字符比例过高），是则不再继续读取。
+- 按 BOM -> utf-8 -> gbk -> latin-1 的顺序解码；截断处不完整的多字节字符被丢弃，不会导致解码失败。
+- 保留多行结构：去除每行首尾空白并跳过空行，用换行符连接；需要单行Tag串时用 join_caption_lines。
+"""
+import codecs
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Tuple
+
+# --- Configuration ---
+TXT_MAX_READ_BYTES = 32000           # 解码后的字符数不超过字节数，保证内容不超过 Excel 单元格 32767 字符的上限
+TXT_READ_CHUNK_SIZE = 8192
+BINARY_SNIFF_BYTES = 4096            # 用于判断二进制文件的第一块大小
+BINARY_CONTROL_CHAR_RATIO = 0.10     # 第一块中控制字符超过该比例视为二进制/乱码
+DEFAULT_TXT_ENCODINGS: Tuple[str, ...] = ('utf-8', 'gbk', 'latin-1')
+
+# 文本中常见的控制字符：\b \t \n \v \f \r 和 ESC
+_TEXT_CONTROL_BYTES = frozenset(b'\b\t\n\v\f\r\x1b')
+_CONTROL_BYTES = frozenset(range(0x20)) - _TEXT_CONTROL_BYTES | {0x7f}
+
+_BOM_ENCODINGS: Tuple[Tuple[bytes, str], ...] = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),   # UTF-32 LE 的 BOM 以 UTF-16 LE 的 BOM 开头，必须先判断
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+@dataclass
+class CaptionText:
+    """
+    一次TXT读取的结果。
+    """
+    text: str = ""                   # 去除空行后的内容，多行时用换行符连接
+    encoding: str = ""               # 成功解码使用的编码，二进制文件为空
+    truncated: bool = False          # 文件超过读取上限，内容已截断
+    is_binary: bool = False          # 第一块判断为二进制/乱码，text 为空
+    bytes_read: int = 0
+    failed_encodings: List[Tuple[str, str]] = field(default_factory=list) # (编码, 解码错误) ，按尝试顺序
+
+    @property
+    def lines(self) -> List[str]:
+        return self.text.split('\n') if self.text else []
+
+
+def _detect_bom(data: bytes) -> str:
+    for bom, encoding in _BOM_ENCODINGS:
+        if data.startswith(bom):
+            return encoding
+    return ""
+
+
+def looks_binary(block: bytes) -> bool:
+    """
+    判断数据块是否像二进制或乱码文件（不含 BOM 的情况下调用）。
+    """
+    if not block:
+        return False
+    if b'\x00' in block:
+        return True
+    control_count = sum(1 for byte in block if byte in _CONTROL_BYTES)
+    return control_count > len(block) * BINARY_CONTROL_CHAR_RATIO
+
+
+def _normalize_lines(text: str) -> str:
+    return '\n'.join(line for line in (raw_line.strip() for raw_line in text.splitlines()) if line)
+
+
+def read_caption_text(txt_file_path: Path, max_bytes: int = TXT_MAX_READ_BYTES,
+                      encodings: Tuple[str, ...] = DEFAULT_TXT_ENCODINGS) -> CaptionText:
+    """
+    读取TXT文件内容（最多 max_bytes 字节）。
+    Raises:
+        OSError: 文件无法打开或读取。
+    """
+    max_bytes = max(1, max_bytes)
+    result = CaptionText()
+    with open(txt_file_path, 'rb') as f:
+        head = f.read(min(BINARY_SNIFF_BYTES, max_bytes))
+        bom_encoding = _detect_bom(head)
+        if not bom_encoding and looks_binary(head):
+            result.is_binary = True
+            result.bytes_read = len(head)
+            return result
+
+        chunks = [head]
+        remaining = max_bytes - len(head)
+        while remaining > 0:
+            chunk = f.read(min(TXT_READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        result.truncated = remaining <= 0 and f.read(1) != b''
+
+    data = b''.join(chunks)
+    result.bytes_read = len(data)
+    candidate_encodings = ((bom_encoding,) if bom_encoding else ()) + tuple(encodings)
+    for encoding in candidate_encodings:
+        try:
+            # 截断时末尾可能是不完整的多字节字符：final=False 让增量解码器把它留在缓冲区中丢弃
+            text = codecs.getincrementaldecoder(encoding)().decode(data, final=not result.truncated)
+        except UnicodeDecodeError as e:
+            result.failed_encodings.append((encoding, str(e)))
+            continue
+        result.text = _normalize_lines(text)
+        result.encoding = encoding
+        return result
+    return result
+
+
+def join_caption_lines(caption_text: str) -> str:
+    """
+    把多行反推内容合并成一行逗号分隔的Tag串（每行一个Tag或一段Tag都适用）。
+    """
+    if '\n' not in caption_text:
+        return caption_text
+    return ', '.join(line.rstrip(',').strip() for line in caption_text.split('\n'))